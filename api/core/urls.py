@@ -8,6 +8,7 @@ from core.views import (
     CompleteTestAPIView,
     PatientListView,
     PatientDetailView,
+    PatientTimelineView,
     TestListView,
     TestDetailView,
     AssignTestsView,
@@ -18,8 +19,16 @@ from core.views import (
     AddPrescriptionView,
     VisitListView,
     VisitDetailView,
+    VisitTransitionListView,
+    VisitBulkTransitionView,
     CompleteVisitView,
 )
+from core.vital_views import (
+    VitalListView,
+    VitalBatchView,
+    VisitVitalListView,
+    PatientVitalTrendView,
+)
 
 
 urlpatterns = [
@@ -27,9 +36,39 @@ urlpatterns = [
     path("patients/", PatientListView.as_view(), name="patient_list"),
     # Patient detail view for retrieve, update, and delete
     path("patients/<int:pk>/", PatientDetailView.as_view(), name="patient_detail"),
+    # Live and archived visits of a patient
+    path(
+        "patients/<int:pk>/timeline/",
+        PatientTimelineView.as_view(),
+        name="patient-timeline",
+    ),
     # URL to list all visits or create a new visit
     path("visits/", VisitListView.as_view(), name="visit-list"),
     path("visits/<int:visit_id>/", VisitDetailView.as_view(), name="visit-detail"),
+    # Status history and set-based status changes
+    path(
+        "visits/<int:visit_id>/transitions/",
+        VisitTransitionListView.as_view(),
+        name="visit-transitions",
+    ),
+    path(
+        "visits/bulk-transition/",
+        VisitBulkTransitionView.as_view(),
+        name="visit-bulk-transition",
+    ),
+    # Vitals
+    path("vitals/", VitalListView.as_view(), name="vital-list"),
+    path("vitals/batch/", VitalBatchView.as_view(), name="vital-batch"),
+    path(
+        "visits/<int:visit_id>/vitals/",
+        VisitVitalListView.as_view(),
+        name="visit-vital-list",
+    ),
+    path(
+        "patients/<int:pk>/vitals/trend/",
+        PatientVitalTrendView.as_view(),
+        name="patient-vital-trend",
+    ),
     # Visits and Assign Doctor
     path(
         "visits/assign-doctor/",
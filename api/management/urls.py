@@ -12,8 +12,22 @@ from core.management_views import (
     VisitCommentListView,
     VisitCommentDeatilView,
 )
+from core.dashboard_views import DashboardView
+from hms.audit import AuditActorView, AuditEntityView
+from hms.profiling import ProfileListView
 
 urlpatterns = [
+    # Operational dashboard (served from rollup tables)
+    path("dashboard/", DashboardView.as_view(), name="dashboard"),
+    # Sampled request profiles (admins only)
+    path("profiles/", ProfileListView.as_view(), name="profile-list"),
+    # Audit trail per staff member and per record (admins only)
+    path("audit/actors/<int:user_id>/", AuditActorView.as_view(), name="audit-actor"),
+    path(
+        "audit/<str:entity>/<int:object_id>/",
+        AuditEntityView.as_view(),
+        name="audit-entity",
+    ),
     # Insurance URLs
     path("insurance/", InsuranceListView.as_view(), name="insurance-list"),
     path("insurance/<int:pk>/", InsuranceDetailView.as_view(), name="insurance-detail"),
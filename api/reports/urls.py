@@ -0,0 +1,20 @@
+from django.urls import path
+from core.report_views import (
+    RevenueReportView,
+    ReceivablesAgingReportView,
+    CashierShiftReportView,
+)
+
+urlpatterns = [
+    path("revenue/", RevenueReportView.as_view(), name="revenue-report"),
+    path(
+        "receivables-aging/",
+        ReceivablesAgingReportView.as_view(),
+        name="receivables-aging-report",
+    ),
+    path(
+        "cashier-shifts/",
+        CashierShiftReportView.as_view(),
+        name="cashier-shift-report",
+    ),
+]
@@ -16,6 +16,9 @@ from .models import (
     HospitalItem,
     ItemType,
     VisitComment,
+    VisitRollup,
+    RevenueRollup,
+    TestRollup,
 )
 
 admin.site.register(Patient)
@@ -34,3 +37,6 @@ admin.site.register(HospitalItem)
 admin.site.register(Insurance)
 admin.site.register(ItemType)
 admin.site.register(VisitComment)
+admin.site.register(VisitRollup)
+admin.site.register(RevenueRollup)
+admin.site.register(TestRollup)
@@ -0,0 +1,215 @@
+"""
+Cold storage for completed visits.
+
+archive_visits() moves the whole graph of each old, closed visit into one
+ArchivedVisit row (zlib-compressed JSON) and deletes the originals, so the
+hot tables and their indexes only hold the working set. visit_graph()
+produces the same JSON for a live visit, which lets the patient timeline
+merge live and archived visits without caring where each one came from.
+
+Rollups are history, not live state: deleting an archived visit must not
+take it out of the dashboard counters, so the delete runs inside
+``archiving()`` and the rollup signals skip it. Each ArchivedVisit keeps
+the counts the visit contributed, which rollups.rebuild() adds back.
+
+Only settled visits are archived: a visit with an unpaid invoice or a
+payment item still pending stays in the hot tables until it is collected.
+"""
+
+import json
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from . import rollups
+from .models import ArchivedVisit, Invoice, Payment, PaymentItem, Test, Visit
+
+_archiving = ContextVar("archiving", default=False)
+
+
+@contextmanager
+def archiving():
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+def in_progress():
+    return _archiving.get()
+
+
+def graph_queryset(queryset):
+    """Load everything visit_graph() reads in a fixed number of queries."""
+    return queryset.select_related(
+        "department", "assigned_doctor", "invoice"
+    ).prefetch_related(
+        "histories",
+        Prefetch("tests", Test.objects.select_related("item", "result")),
+        "prescriptions",
+        Prefetch(
+            "payment_set",
+            Payment.objects.prefetch_related(
+                Prefetch("items", PaymentItem.objects.select_related("item"))
+            ),
+        ),
+        "invoice__items__item",
+        "comments",
+        "vital_set",
+    )
+
+
+def _item(item):
+    return {"id": item.id, "name": item.name, "price": item.price} if item else None
+
+
+def visit_graph(visit):
+    """JSON-ready dict of a visit and everything recorded against it."""
+    try:
+        invoice = visit.invoice
+    except Visit.invoice.RelatedObjectDoesNotExist:
+        invoice = None
+
+    graph = {
+        "id": visit.id,
+        "visit_number": visit.visit_number,
+        "visit_date": visit.visit_date,
+        "status": visit.status,
+        "department": visit.department_id,
+        "department_name": visit.department.name if visit.department else None,
+        "assigned_doctor": visit.assigned_doctor_id,
+        "assigned_doctor_email": (
+            visit.assigned_doctor.email if visit.assigned_doctor else None
+        ),
+        "histories": [
+            {
+                "description": h.description,
+                "recorded_by": h.recorded_by_id,
+                "created_at": h.created_at,
+            }
+            for h in visit.histories.all()
+        ],
+        "tests": [
+            {
+                "item": _item(t.item),
+                "status": t.status,
+                "result": getattr(getattr(t, "result", None), "result_details", None),
+            }
+            for t in visit.tests.all()
+        ],
+        "prescriptions": [
+            {
+                "medicine_name": p.medicine_name,
+                "dosage": p.dosage,
+                "quantity": p.quantity,
+                "frequency": p.frequency,
+                "price": p.price,
+                "status": p.status,
+            }
+            for p in visit.prescriptions.all()
+        ],
+        "payments": [
+            {
+                "amount": p.amount,
+                "status": p.status,
+                "created_at": p.created_at,
+                "items": [
+                    {
+                        "item": _item(i.item),
+                        "status": i.status,
+                        "completed_at": i.completed_at,
+                    }
+                    for i in p.items.all()
+                ],
+            }
+            for p in visit.payment_set.all()
+        ],
+        "invoice": (
+            {
+                "total_amount": invoice.total_amount,
+                "is_paid": invoice.is_paid,
+                "is_insurance": invoice.is_insurance,
+                "items": [_item(i.item) for i in invoice.items.all()],
+            }
+            if invoice
+            else None
+        ),
+        "comments": [
+            {
+                "description": c.description,
+                "created_by": c.created_by_id,
+                "created_at": c.created_at,
+            }
+            for c in visit.comments.all()
+        ],
+        "vitals": [
+            {
+                "weight": v.weight,
+                "temperature": v.temperature,
+                "blood_pressure": v.blood_pressure,
+                "recorded_at": v.recorded_at,
+            }
+            for v in visit.vital_set.all()
+        ],
+    }
+    # Dates and decimals as the strings an API response would carry
+    return json.loads(json.dumps(graph, cls=DjangoJSONEncoder))
+
+
+def archivable(cutoff):
+    """Closed, fully settled visits dated before ``cutoff``."""
+    return Visit.objects.filter(
+        ~Exists(Invoice.objects.filter(visit=OuterRef("pk"), is_paid=False)),
+        ~Exists(
+            PaymentItem.objects.filter(payment__visit=OuterRef("pk"), status="pending")
+        ),
+        status="completed",
+        is_active=False,
+        visit_date__lt=cutoff,
+    )
+
+
+def archive_visits(cutoff, batch_size=500):
+    """
+    Archive every closed visit dated before ``cutoff`` in batches of
+    ``batch_size``, each in its own transaction. Returns the number of
+    visits archived and the JSON bytes before and after compression.
+    """
+    archived = raw_bytes = stored_bytes = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                archivable(cutoff)
+                .order_by("pk")
+                .select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            rows = []
+            for visit in graph_queryset(Visit.objects.filter(pk__in=ids)):
+                raw = json.dumps(visit_graph(visit)).encode()
+                payload = zlib.compress(raw, 6)
+                raw_bytes += len(raw)
+                stored_bytes += len(payload)
+                rows.append(
+                    ArchivedVisit(
+                        original_id=visit.id,
+                        visit_number=visit.visit_number,
+                        patient_id=visit.patient_id,
+                        department_id=visit.department_id,
+                        assigned_doctor_id=visit.assigned_doctor_id,
+                        visit_date=visit.visit_date,
+                        payment_method=visit.payment_method,
+                        rollup=rollups.archived_counts(visit),
+                        payload=payload,
+                    )
+                )
+            ArchivedVisit.objects.bulk_create(rows)
+            with archiving():
+                Visit.objects.filter(pk__in=ids).delete()
+            archived += len(rows)
+    return archived, raw_bytes, stored_bytes
@@ -0,0 +1,94 @@
+"""
+Optimistic concurrency for rows several desks edit at once (visits,
+payments, invoices).
+
+Each VersionedModel row carries a version number. save() turns the UPDATE
+into ``UPDATE ... SET version = version + 1 WHERE id = ? AND version = ?``,
+so a write based on a stale read matches no row and raises ConcurrentUpdate
+instead of silently overwriting the other desk's change. Nothing is locked
+while the user looks at the record, and hot rows never queue behind
+SELECT ... FOR UPDATE.
+
+Detail endpoints send the version as an ETag; clients echo it in If-Match
+to make their write conditional on what they last saw.
+"""
+
+from django.db import models
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConcurrentUpdate(Exception):
+    """The row was changed or deleted since the instance was read."""
+
+
+class VersionedModel(models.Model):
+    # db_default lets rows inserted outside the ORM (COPY loads, raw SQL)
+    # start at version 1 too, and keeps the column add cheap on PostgreSQL
+    version = models.PositiveIntegerField(default=1, db_default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        field = self._meta.get_field("version")
+        expected = self.version
+        values = [value for value in values if value[0] is not field]
+        values.append((field, None, expected + 1))
+        updated = super()._do_update(
+            base_qs.filter(version=expected),
+            using,
+            pk_val,
+            values,
+            update_fields,
+            forced_update,
+        )
+        if updated:
+            self.version = expected + 1
+        elif base_qs.filter(pk=pk_val).exists():
+            raise ConcurrentUpdate(
+                f"{self._meta.object_name} {pk_val} is no longer at version {expected}."
+            )
+        return updated
+
+
+def etag(instance):
+    return f'"{instance.version}"'
+
+
+def if_match(request, instance):
+    """
+    False when the request carries an If-Match header that does not name the
+    instance's current version. Requests without the header are let through;
+    their save is still conditional on the version that was read.
+    """
+    header = request.headers.get("If-Match")
+    if header is None:
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag(instance) in tags
+
+
+def with_etag(response, instance):
+    response["ETag"] = etag(instance)
+    return response
+
+
+def precondition_failed(instance):
+    return with_etag(
+        Response(
+            {
+                "detail": "The record has changed since you loaded it. Reload and try again.",
+                "version": instance.version,
+            },
+            status=status.HTTP_412_PRECONDITION_FAILED,
+        ),
+        instance,
+    )
+
+
+def conflict():
+    return Response(
+        {"detail": "The record was changed by another request. Reload and try again."},
+        status=status.HTTP_409_CONFLICT,
+    )
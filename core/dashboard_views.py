@@ -0,0 +1,137 @@
+from datetime import timedelta
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from users.permissions import IsFinanceStaff
+from .models import RevenueRollup, TestRollup, VisitRollup
+
+
+def _parse_date(value):
+    """None when ``value`` is empty; ValueError when it is not a date."""
+    if not value:
+        return None
+    # parse_date returns None for malformed input and raises ValueError for
+    # well-formed but impossible dates
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"{value!r} is not a date.")
+    return parsed
+
+
+class DashboardView(APIView):
+    """
+    Operational dashboard served exclusively from the rollup tables.
+
+    Query parameters:
+      - start / end: ISO dates, inclusive (defaults to the last 30 days)
+      - department: optional department ID to narrow every section
+
+    The revenue series is only included for finance staff, who may also
+    read the financial reports.
+    """
+
+    use_read_replica = True
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            end = _parse_date(request.query_params.get("end")) or timezone.localdate()
+            start = _parse_date(request.query_params.get("start")) or end - timedelta(
+                days=29
+            )
+            department_id = request.query_params.get("department")
+            department_id = int(department_id) if department_id else None
+        except ValueError:
+            return Response(
+                {
+                    "detail": "start and end must be ISO dates and department "
+                    "an integer."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if start > end:
+            return Response(
+                {"detail": "start must not be after end."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        filters = {"date__gte": start, "date__lte": end}
+        if department_id is not None:
+            filters["department_id"] = department_id
+
+        visits = (
+            VisitRollup.objects.filter(**filters)
+            .values("date", "department", "department__name", "status")
+            .annotate(count=Sum("visits"))
+            .filter(count__gt=0)
+            .order_by("date", "department", "status")
+        )
+        payment_mix = (
+            VisitRollup.objects.filter(**filters)
+            .values("date", "payment_method")
+            .annotate(count=Sum("visits"))
+            .filter(count__gt=0)
+            .order_by("date", "payment_method")
+        )
+        tests = (
+            TestRollup.objects.filter(**filters)
+            .values("date", "item_type", "item_type__name")
+            .annotate(count=Sum("tests"))
+            .filter(count__gt=0)
+            .order_by("date", "item_type")
+        )
+
+        data = {
+            "start": start,
+            "end": end,
+            "visits": [
+                {
+                    "date": row["date"],
+                    "department": row["department"],
+                    "department_name": row["department__name"],
+                    "status": row["status"],
+                    "count": row["count"],
+                }
+                for row in visits
+            ],
+            "payment_mix": [
+                {
+                    "date": row["date"],
+                    "payment_method": row["payment_method"],
+                    "count": row["count"],
+                }
+                for row in payment_mix
+            ],
+            "tests": [
+                {
+                    "date": row["date"],
+                    "item_type": row["item_type"],
+                    "item_type_name": row["item_type__name"],
+                    "count": row["count"],
+                }
+                for row in tests
+            ],
+        }
+        if IsFinanceStaff().has_permission(request, self):
+            revenue = (
+                RevenueRollup.objects.filter(**filters)
+                .values("date", "department", "department__name", "payment_method")
+                .annotate(amount=Sum("amount"), items=Sum("items"))
+                .order_by("date", "department", "payment_method")
+            )
+            data["revenue"] = [
+                {
+                    "date": row["date"],
+                    "department": row["department"],
+                    "department_name": row["department__name"],
+                    "payment_method": row["payment_method"],
+                    "amount": row["amount"],
+                    "items": row["items"],
+                }
+                for row in revenue
+            ]
+        return Response(data, status=status.HTTP_200_OK)
@@ -0,0 +1,45 @@
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move completed visits older than HMS_ARCHIVE_AFTER_DAYS, with their "
+        "payments, tests, prescriptions, histories, comments and vitals, into "
+        "compressed ArchivedVisit rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=getattr(settings, "HMS_ARCHIVE_AFTER_DAYS", 365),
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only count the visits to archive."
+        )
+
+    def handle(self, *args, **options):
+        cutoff = date.today() - timedelta(days=options["older_than_days"])
+        if options["dry_run"]:
+            count = archive.archivable(cutoff).count()
+            self.stdout.write(f"{count} completed visits before {cutoff} would be archived.")
+            return
+
+        started = time.perf_counter()
+        archived, raw_bytes, stored_bytes = archive.archive_visits(
+            cutoff, options["batch_size"]
+        )
+        elapsed = time.perf_counter() - started
+        ratio = raw_bytes / stored_bytes if stored_bytes else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {archived} visits before {cutoff} in {elapsed:.1f}s "
+                f"({raw_bytes // 1024} kB of JSON stored as {stored_bytes // 1024} kB, "
+                f"{ratio:.1f}x)."
+            )
+        )
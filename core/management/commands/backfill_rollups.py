@@ -0,0 +1,40 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the dashboard rollup tables from visits, tests and payment items. "
+        "Without --start/--end the whole history is recomputed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First visit date to rebuild (YYYY-MM-DD).")
+        parser.add_argument("--end", help="Last visit date to rebuild (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        start = self.parse(options["start"], "--start")
+        end = self.parse(options["end"], "--end")
+        if start and end and start > end:
+            raise CommandError("--start must not be after --end.")
+
+        started = time.perf_counter()
+        counts = rollups.rebuild(start, end)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {counts['visits']} visit, {counts['revenue']} revenue and "
+                f"{counts['tests']} test rollup rows in {elapsed:.2f}s."
+            )
+        )
+
+    def parse(self, value, option):
+        if value is None:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"{option} must be a date in YYYY-MM-DD format.")
+        return parsed
@@ -0,0 +1,88 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare API request latency when every request opens a new database "
+        "connection, with persistent connections and with a psycopg pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--url", default="/api/users/departments/")
+        parser.add_argument(
+            "--email", help="User to authenticate as (defaults to the first active user)."
+        )
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.filter(is_active=True)
+        if options["email"]:
+            users = users.filter(email=options["email"])
+        user = users.order_by("pk").first()
+        if user is None:
+            raise CommandError("No active user to authenticate as.")
+        token = RefreshToken.for_user(user).access_token
+
+        client = Client(HTTP_HOST="localhost", HTTP_AUTHORIZATION=f"Bearer {token}")
+        settings_dict = connection.settings_dict
+        original = (settings_dict["CONN_MAX_AGE"], dict(settings_dict["OPTIONS"]))
+        pool_options = original[1].get("pool") or True
+
+        modes = [
+            ("new connection per request", 0, None),
+            ("persistent connections", None, None),
+        ]
+        if connection.vendor == "postgresql":
+            modes.append(("psycopg pool", 0, pool_options))
+        else:
+            self.stdout.write(f"Pooling needs PostgreSQL; skipped on {connection.vendor}.")
+
+        try:
+            for label, conn_max_age, pool in modes:
+                self.configure(conn_max_age, pool)
+                timings = self.run(client, options["url"], options["requests"])
+                self.report(label, timings)
+        finally:
+            self.close()
+            settings_dict["CONN_MAX_AGE"], settings_dict["OPTIONS"] = original
+
+    def close(self):
+        connection.close()
+        if connection.vendor == "postgresql":
+            connection.close_pool()
+
+    def configure(self, conn_max_age, pool):
+        self.close()
+        settings_dict = connection.settings_dict
+        settings_dict["CONN_MAX_AGE"] = conn_max_age
+        settings_dict["OPTIONS"] = {
+            key: value for key, value in settings_dict["OPTIONS"].items() if key != "pool"
+        }
+        if pool:
+            settings_dict["OPTIONS"]["pool"] = pool
+
+    def run(self, client, url, count):
+        # Warm up the URL resolver, the auth cache and the pool
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} returned {response.status_code}.")
+
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        return sorted(timings)
+
+    def report(self, label, timings):
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{label}: median {statistics.median(timings):.2f}ms, "
+            f"p95 {p95:.2f}ms, max {timings[-1]:.2f}ms"
+        )
@@ -0,0 +1,74 @@
+import statistics
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from core import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare a recent-window query and VACUUM on a partitioned table with "
+        "an unpartitioned copy of the same rows (PostgreSQL only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--table",
+            choices=sorted(partitions.PARTITIONED_TABLES),
+            default="core_paymentitem",
+        )
+        parser.add_argument("--days", type=int, default=7, help="Width of the recent window.")
+        parser.add_argument("--runs", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError(f"Partitioning needs PostgreSQL, not {connection.vendor}.")
+        table = options["table"]
+        if not partitions.is_partitioned(connection, table):
+            raise CommandError(f"{table} is not partitioned; run migrate first.")
+
+        qn = connection.ops.quote_name
+        column = qn(partitions.PARTITIONED_TABLES[table])
+        flat = f"{table}_bench_flat"
+        current = partitions.partition_name(table, date.today().replace(day=1))
+
+        with connection.cursor() as cursor:
+            self.stdout.write(f"Copying {table} into an unpartitioned table...")
+            cursor.execute(f"DROP TABLE IF EXISTS {qn(flat)}")
+            cursor.execute(f"CREATE TABLE {qn(flat)} AS SELECT * FROM {qn(table)}")
+            cursor.execute(f"CREATE INDEX ON {qn(flat)} ({column})")
+            cursor.execute(f"ANALYZE {qn(flat)}")
+            cursor.execute(f"ANALYZE {qn(table)}")
+            try:
+                query = (
+                    "SELECT count(*), min(id), max(id) FROM {} "
+                    f"WHERE {column} >= now() - interval '{options['days']} days'"
+                )
+                for label, name in (("unpartitioned", flat), ("partitioned", table)):
+                    timings = self.time(cursor, query.format(qn(name)), options["runs"])
+                    self.stdout.write(
+                        f"last {options['days']} days, {label}: median "
+                        f"{statistics.median(timings):.2f}ms, max {max(timings):.2f}ms"
+                    )
+
+                # The win for maintenance is that only the month being written
+                # to needs vacuuming; closed months stay frozen
+                for label, name in (
+                    ("whole unpartitioned table", flat),
+                    ("current month partition", current),
+                ):
+                    timing = self.time(cursor, f"VACUUM (ANALYZE) {qn(name)}", 1)[0]
+                    self.stdout.write(f"VACUUM {label}: {timing:.0f}ms")
+            finally:
+                cursor.execute(f"DROP TABLE IF EXISTS {qn(flat)}")
+
+    def time(self, cursor, sql, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            cursor.execute(sql)
+            if cursor.description:
+                cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
@@ -0,0 +1,82 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs inside a fresh interpreter per profile so each one pays its own startup
+WORKER = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+startup = (time.perf_counter() - started) * 1000
+
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import CustomUser
+
+url, count = sys.argv[1], int(sys.argv[2])
+user = CustomUser.objects.filter(is_active=True).order_by("pk").first()
+headers = {"HTTP_HOST": "localhost"}
+if user is not None:
+    headers["HTTP_AUTHORIZATION"] = f"Bearer {RefreshToken.for_user(user).access_token}"
+client = Client(**headers)
+status = client.get(url).status_code
+
+timings = []
+for _ in range(count):
+    t = time.perf_counter()
+    client.get(url)
+    timings.append((time.perf_counter() - t) * 1000)
+print(json.dumps({"startup": startup, "status": status, "timings": timings}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare interpreter startup time and per-request overhead of the dev "
+        "and prod settings profiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--runs", type=int, default=3, help="Startups per profile.")
+        parser.add_argument("--url", default="/api/users/departments/")
+        parser.add_argument("--profiles", nargs="+", default=["dev", "prod"])
+
+    def handle(self, *args, **options):
+        for profile in options["profiles"]:
+            startups, timings = [], []
+            for _ in range(options["runs"]):
+                result = self.run_worker(profile, options["url"], options["requests"])
+                startups.append(result["startup"])
+                timings.extend(result["timings"])
+            timings.sort()
+            self.stdout.write(
+                f"{profile}: startup {statistics.median(startups):.0f}ms, "
+                f"GET {options['url']} ({result['status']}) median "
+                f"{statistics.median(timings):.2f}ms, "
+                f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f}ms"
+            )
+
+    def run_worker(self, profile, url, count):
+        env = {
+            **os.environ,
+            "DJANGO_ENV": profile,
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", "hms.settings"
+            ),
+        }
+        completed = subprocess.run(
+            [sys.executable, "-c", WORKER, url, str(count)],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if completed.returncode != 0:
+            raise CommandError(f"{profile} profile failed:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
@@ -0,0 +1,160 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Avg, Count
+from django.utils import timezone
+from core.models import Patient, Visit, Vital
+from core.vital_views import TREND_INTERVALS
+
+# Seeded rows are tagged through the patient phone so they can be removed again
+PHONE_PREFIX = "bv-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic vitals and time the per-visit and per-patient trend queries. "
+        "Use --rows 10000000 for the reference benchmark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--patients", type=int, default=1_000)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--samples", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--skip-seed",
+            action="store_true",
+            help="Reuse the rows seeded by a previous run.",
+        )
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the seeded patients (and their vitals) when done.",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+
+        if not options["skip_seed"]:
+            self.seed(rng, options)
+
+        visit_ids = list(
+            Visit.objects.filter(patient__phone__startswith=PHONE_PREFIX).values_list(
+                "id", flat=True
+            )
+        )
+        patient_ids = list(
+            Patient.objects.filter(phone__startswith=PHONE_PREFIX).values_list(
+                "id", flat=True
+            )
+        )
+        if not visit_ids:
+            self.stderr.write("No seeded vitals found; run without --skip-seed.")
+            return
+
+        self.stdout.write(
+            f"{len(patient_ids):,} patients, {Vital.objects.count():,} vitals in table"
+        )
+
+        samples = options["samples"]
+        self.report(
+            "visit vitals (latest 50)",
+            samples,
+            lambda: list(
+                Vital.objects.filter(visit_id=rng.choice(visit_ids)).order_by(
+                    "-recorded_at"
+                )[:50]
+            ),
+        )
+
+        now = timezone.now()
+        for interval, days in (("hour", 2), ("day", 90), ("week", 365)):
+            start = now - timedelta(days=days)
+            self.report(
+                f"patient trend ({interval}, {days}d)",
+                samples,
+                lambda interval=interval, start=start: list(
+                    Vital.objects.filter(
+                        patient_id=rng.choice(patient_ids),
+                        recorded_at__gte=start,
+                        recorded_at__lt=now,
+                    )
+                    .annotate(period=TREND_INTERVALS[interval]("recorded_at"))
+                    .values("period")
+                    .annotate(readings=Count("id"), systolic=Avg("systolic"))
+                    .order_by("period")
+                ),
+            )
+
+        plan = (
+            Vital.objects.filter(patient_id=patient_ids[0], recorded_at__gte=now)
+            .order_by("recorded_at")
+            .explain()
+        )
+        self.stdout.write(f"\nTrend query plan ({connection.vendor}):\n{plan}")
+
+        if options["cleanup"]:
+            deleted, _ = Patient.objects.filter(phone__startswith=PHONE_PREFIX).delete()
+            self.stdout.write(f"Deleted {deleted} seeded rows.")
+
+    def seed(self, rng, options):
+        patients = Patient.objects.bulk_create(
+            Patient(
+                first_name="Bench",
+                last_name=f"Vitals {i}",
+                date_of_birth=timezone.now().date() - timedelta(days=365 * 30),
+                phone=f"{PHONE_PREFIX}{options['seed']}-{i}",
+                address="Benchmark",
+            )
+            for i in range(options["patients"])
+        )
+        visits = Visit.objects.bulk_create(Visit(patient=patient) for patient in patients)
+
+        now = timezone.now()
+        span = options["days"] * 24 * 3600
+        remaining = options["rows"]
+        started = time.perf_counter()
+        while remaining > 0:
+            size = min(options["batch_size"], remaining)
+            batch = []
+            for _ in range(size):
+                visit = rng.choice(visits)
+                systolic = rng.randint(95, 170)
+                diastolic = systolic - rng.randint(30, 60)
+                batch.append(
+                    Vital(
+                        visit_id=visit.id,
+                        patient_id=visit.patient_id,
+                        weight=Decimal(rng.randint(4000, 12000)) / 100,
+                        temperature=Decimal(rng.randint(355, 400)) / 10,
+                        blood_pressure=f"{systolic}/{diastolic}",
+                        systolic=systolic,
+                        diastolic=diastolic,
+                        recorded_at=now - timedelta(seconds=rng.randint(0, span)),
+                    )
+                )
+            Vital.objects.bulk_create(batch)
+            remaining -= size
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Seeded {options['rows']:,} vitals in {elapsed:.1f}s "
+            f"({options['rows'] / elapsed:,.0f} rows/s)"
+        )
+
+    def report(self, label, samples, query):
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        self.stdout.write(
+            f"{label:<28} mean {statistics.mean(timings):7.2f} ms   p95 {p95:7.2f} ms"
+        )
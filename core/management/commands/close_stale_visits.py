@@ -0,0 +1,78 @@
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Max, Min
+from core.models import Visit
+from core.state_machine import VISIT
+
+
+class Command(BaseCommand):
+    help = (
+        "End-of-day job: close (or only flag) visits still open more than "
+        "HMS_STALE_VISIT_AFTER_DAYS after their visit date, in set-based "
+        "chunks of consecutive ids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=getattr(settings, "HMS_STALE_VISIT_AFTER_DAYS", 1),
+        )
+        parser.add_argument(
+            "--flag",
+            action="store_true",
+            help="Only clear is_active and leave the status for review, "
+            "instead of completing the visits.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="Width of each id range updated in one transaction.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report what would change."
+        )
+
+    def handle(self, *args, **options):
+        cutoff = date.today() - timedelta(days=options["older_than_days"])
+        stale = Visit.objects.filter(
+            is_active=True,
+            status__in=VISIT.sources("completed"),
+            visit_date__lt=cutoff,
+        )
+
+        counts = dict(
+            stale.values_list("status").annotate(visits=Count("id")).order_by()
+        )
+        summary = ", ".join(f"{n} {state}" for state, n in sorted(counts.items()))
+        if not counts:
+            self.stdout.write(f"No open visits dated before {cutoff}.")
+            return
+        if options["dry_run"]:
+            self.stdout.write(
+                f"Would {'flag' if options['flag'] else 'close'} "
+                f"{sum(counts.values())} visits dated before {cutoff} ({summary})."
+            )
+            return
+
+        started = time.perf_counter()
+        bounds = stale.aggregate(first=Min("pk"), last=Max("pk"))
+        changed = 0
+        for low in range(bounds["first"], bounds["last"] + 1, options["chunk_size"]):
+            chunk = stale.filter(pk__gte=low, pk__lt=low + options["chunk_size"])
+            if options["flag"]:
+                changed += chunk.update(is_active=False, version=F("version") + 1)
+            else:
+                changed += VISIT.bulk_transition(
+                    chunk, "completed", reason="Closed by close_stale_visits"
+                )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Flagged' if options['flag'] else 'Closed'} {changed} stale visits "
+                f"dated before {cutoff} ({summary}) in "
+                f"{time.perf_counter() - started:.1f}s."
+            )
+        )
@@ -0,0 +1,373 @@
+import csv
+import io
+import multiprocessing
+import random
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from core.models import (
+    HospitalItem,
+    Insurance,
+    InsuranceCompany,
+    Invoice,
+    InvoiceItem,
+    ItemType,
+    MedicalHistory,
+    Patient,
+    Payment,
+    PaymentItem,
+    Visit,
+)
+from users.models import CustomUser, Department
+
+# patient_number and visit_number are "ddmmyy" plus a three digit daily
+# counter, so no more than this many of either can share a day
+PER_DAY = 999
+
+FIRST_NAMES = (
+    "Amina", "Baraka", "Neema", "Juma", "Rehema", "Hassan", "Zawadi", "Daudi",
+    "Mwajuma", "Emmanuel", "Halima", "Joseph", "Upendo", "Salim", "Grace", "Peter",
+)
+LAST_NAMES = (
+    "Mushi", "Mwakyusa", "Kimaro", "Massawe", "Shirima", "Mollel", "Njau", "Temba",
+    "Lyimo", "Mrema", "Swai", "Kessy", "Minja", "Urassa", "Macha", "Komba",
+)
+COMPLAINTS = (
+    "Fever and headache for three days.",
+    "Persistent dry cough, no fever.",
+    "Abdominal pain after meals.",
+    "Follow-up: blood pressure review.",
+    "Joint pain in both knees.",
+    "Routine check-up, no complaints.",
+)
+
+# The generated tables, in insertion order, with the fields written for each
+MODEL_FIELDS = (
+    (Patient, (
+        "id", "patient_number", "first_name", "last_name", "date_of_birth", "phone",
+        "address", "registration_date", "marital_status", "gender", "priority",
+        "is_active",
+    )),
+    (Insurance, ("patient_id", "provider_id", "policy_number")),
+    (Visit, (
+        "id", "visit_number", "patient_id", "department_id", "assigned_doctor_id",
+        "status", "visit_date", "is_active", "payment_method",
+    )),
+    (MedicalHistory, ("visit_id", "patient_id", "description", "recorded_by_id", "created_at")),
+    (Payment, ("id", "visit_id", "amount", "status", "created_at")),
+    (PaymentItem, ("payment_id", "item_id", "status", "completed_at", "created_at")),
+    (Invoice, ("id", "visit_id", "total_amount", "is_paid", "is_insurance", "created_at")),
+    (InvoiceItem, ("invoice_id", "item_id")),
+)
+
+
+def day_of(index, total_days, end_date):
+    """Date of the index-th patient or visit when they are packed PER_DAY a day."""
+    return end_date - timedelta(days=total_days - 1 - index // PER_DAY)
+
+
+def number_for(index, day):
+    return f"{day:%d%m%y}{index % PER_DAY + 1:03d}"
+
+
+def stamp(day, rng):
+    moment = datetime.combine(day, dtime(rng.randint(7, 18), rng.randint(0, 59)))
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+def build_chunk(plan, start, stop):
+    """
+    Rows for patients [start, stop). Each chunk has its own RNG seeded from
+    the run seed and the chunk's start, so the output does not depend on how
+    many workers there are. Patients, visits, payments and invoices get
+    explicit ids derived from their index; the leaf tables use the sequence.
+    """
+    rng = random.Random(f"{plan['seed']}:{start}")
+    visits_per_patient = plan["visits_per_patient"]
+    patient_days = -(-plan["patients"] // PER_DAY)
+    visit_days = -(-plan["patients"] * visits_per_patient // PER_DAY)
+    total_days = max(patient_days, visit_days)
+    end_date = plan["end_date"]
+    departments, doctors, insurers = plan["departments"], plan["doctors"], plan["insurers"]
+    items = plan["items"]
+
+    rows = {model: [] for model, _ in MODEL_FIELDS}
+    for p in range(start, stop):
+        registered = day_of(p, total_days, end_date)
+        rows[Patient].append((
+            p + 1,
+            number_for(p, registered),
+            rng.choice(FIRST_NAMES),
+            rng.choice(LAST_NAMES),
+            registered - timedelta(days=rng.randint(365, 80 * 365)),
+            f"07{p:08d}",
+            "Dar es Salaam",
+            registered,
+            rng.choice(("single", "married")),
+            rng.choice(("male", "female")),
+            rng.random() < 0.05,
+            True,
+        ))
+        insured = insurers and rng.random() < plan["insured_share"]
+        if insured:
+            rows[Insurance].append((p + 1, rng.choice(insurers), f"POL-{p + 1:09d}"))
+
+        for j in range(visits_per_patient):
+            v = p * visits_per_patient + j
+            day = day_of(v, total_days, end_date)
+            # Rotate departments so a patient's same-day visits stay distinct
+            department = departments[(p + j) % len(departments)]
+            doctor = rng.choice(doctors) if doctors else None
+            open_visit = day == end_date
+            rows[Visit].append((
+                v + 1,
+                number_for(v, day),
+                p + 1,
+                department,
+                doctor,
+                rng.choice(("pending", "onprogress")) if open_visit else "completed",
+                day,
+                open_visit,
+                "insurance" if insured else "cash",
+            ))
+            created = stamp(day, rng)
+            rows[MedicalHistory].append(
+                (v + 1, p + 1, rng.choice(COMPLAINTS), doctor, created)
+            )
+
+            charged = rng.sample(items, k=min(len(items), rng.randint(1, plan["max_items"])))
+            amount = sum((price for _, price in charged), Decimal("0"))
+            paid = not open_visit
+            rows[Payment].append(
+                (v + 1, v + 1, amount, "completed" if paid else "pending", created)
+            )
+            rows[Invoice].append((v + 1, v + 1, amount, paid, bool(insured), created))
+            for item_id, _ in charged:
+                rows[PaymentItem].append((
+                    v + 1,
+                    item_id,
+                    "completed" if paid else "pending",
+                    created + timedelta(minutes=rng.randint(5, 120)) if paid else None,
+                    created,
+                ))
+                rows[InvoiceItem].append((v + 1, item_id))
+    return rows
+
+
+def column_list(model, fields):
+    # get_field() also resolves attnames such as "patient_id"
+    return ", ".join(
+        connection.ops.quote_name(model._meta.get_field(name).column) for name in fields
+    )
+
+
+def copy_rows(cursor, model, fields, rows):
+    """Stream rows into PostgreSQL with COPY ... FROM STDIN (psycopg 3 or 2)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        connection.ops.quote_name(model._meta.db_table), column_list(model, fields)
+    )
+    raw = cursor.cursor
+    if hasattr(raw, "copy"):
+        with raw.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+    else:
+        buffer.seek(0)
+        raw.copy_expert(sql, buffer)
+
+
+def insert_rows(cursor, model, fields, rows, batch_size):
+    """
+    Batched INSERTs for other backends. bulk_create() is not used because it
+    stamps auto_now_add fields (registration_date, visit_date, created_at)
+    with today, which would flatten the generated history.
+    """
+    model_fields = [model._meta.get_field(name) for name in fields]
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(model._meta.db_table),
+        column_list(model, fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    for i in range(0, len(rows), batch_size):
+        cursor.executemany(
+            sql,
+            [
+                [f.get_db_prep_value(value, connection) for f, value in zip(model_fields, row)]
+                for row in rows[i : i + batch_size]
+            ],
+        )
+
+
+def write_chunk(plan, start, stop):
+    rows = build_chunk(plan, start, stop)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, fields in MODEL_FIELDS:
+            if not rows[model]:
+                continue
+            if connection.vendor == "postgresql":
+                copy_rows(cursor, model, fields, rows[model])
+            else:
+                insert_rows(cursor, model, fields, rows[model], plan["batch_size"])
+    return {model._meta.model_name: len(rows[model]) for model, _ in MODEL_FIELDS}
+
+
+def init_worker():
+    # Under the "spawn" start method the worker starts without Django loaded
+    django.setup()
+
+
+def run_chunk(args):
+    plan, start, stop = args
+    try:
+        return write_chunk(plan, start, stop)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an empty database with deterministic synthetic patients, visits, "
+        "payments, invoices and histories at hospital scale. Uses COPY on "
+        "PostgreSQL (optionally from several worker processes) and batched "
+        "INSERTs elsewhere."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=10_000)
+        parser.add_argument("--visits-per-patient", type=int, default=5)
+        parser.add_argument(
+            "--max-items", type=int, default=4, help="Most items charged per visit."
+        )
+        parser.add_argument("--insured-share", type=float, default=0.3)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--end-date",
+            help="Date of the newest visits (YYYY-MM-DD, defaults to today); the "
+            "history is laid out backwards from it.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Parallel loader processes (PostgreSQL only).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5_000,
+            help="Patients per transaction. Changing it changes the generated data.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1_000)
+
+    def handle(self, *args, **options):
+        end_date = date.today()
+        if options["end_date"]:
+            end_date = parse_date(options["end_date"])
+            if end_date is None:
+                raise CommandError("--end-date must be a date in YYYY-MM-DD format.")
+        if options["patients"] < 1 or options["visits_per_patient"] < 0:
+            raise CommandError("--patients must be positive and --visits-per-patient not negative.")
+
+        occupied = [
+            model.__name__ for model, _ in MODEL_FIELDS if model._base_manager.exists()
+        ]
+        if occupied:
+            # Generated numbers and ids start from scratch and would collide
+            raise CommandError(f"Target tables must be empty: {', '.join(occupied)}.")
+
+        plan = {
+            "seed": options["seed"],
+            "patients": options["patients"],
+            "visits_per_patient": options["visits_per_patient"],
+            "max_items": max(1, options["max_items"]),
+            "insured_share": options["insured_share"],
+            "end_date": end_date,
+            "batch_size": options["batch_size"],
+            **self.reference_data(options["seed"]),
+        }
+        chunk_size = options["chunk_size"]
+        chunks = [
+            (plan, start, min(start + chunk_size, plan["patients"]))
+            for start in range(0, plan["patients"], chunk_size)
+        ]
+
+        workers = min(options["workers"], len(chunks))
+        if connection.vendor != "postgresql" and workers > 1:
+            self.stdout.write(f"{connection.vendor} allows one writer; using a single process.")
+            workers = 1
+
+        totals = {}
+        started = time.perf_counter()
+        if workers > 1:
+            # Forked children must not share the parent's connection
+            connections.close_all()
+            with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+                for counts in pool.imap_unordered(run_chunk, chunks):
+                    self.add_counts(totals, counts)
+        else:
+            for chunk in chunks:
+                self.add_counts(totals, write_chunk(*chunk))
+        self.reset_sequences()
+        elapsed = time.perf_counter() - started
+
+        rows = sum(totals.values())
+        for name, count in totals.items():
+            self.stdout.write(f"{name:<16}{count:>12}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s) "
+                f"with {workers} worker(s). Run backfill_rollups to refresh the dashboard."
+            )
+        )
+
+    def add_counts(self, totals, counts):
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+        self.stdout.write(f"  {totals['patient']} patients loaded")
+
+    def reference_data(self, seed):
+        """Use the existing departments, doctors, items and insurers, creating a few if missing."""
+        rng = random.Random(seed)
+        if not Department.objects.exists():
+            for name, short_name in (("General", "GEN"), ("Paediatrics", "PAED"), ("Dental", "DEN")):
+                Department.objects.create(name=name, short_name=short_name)
+        if not HospitalItem.objects.filter(is_active=True).exists():
+            item_type, _ = ItemType.objects.get_or_create(name="Laboratory")
+            for i in range(20):
+                HospitalItem.objects.create(
+                    name=f"Synthetic item {i:02d}",
+                    price=Decimal(rng.randrange(2_000, 50_000, 500)),
+                    item_type=item_type,
+                )
+        if not InsuranceCompany.objects.exists():
+            for i in range(3):
+                InsuranceCompany.objects.create(name=f"Synthetic insurer {i}")
+
+        return {
+            "departments": list(Department.objects.order_by("pk").values_list("pk", flat=True)),
+            "doctors": list(
+                CustomUser.objects.filter(role="doctor").order_by("pk").values_list("pk", flat=True)
+            ),
+            "items": list(
+                HospitalItem.objects.filter(is_active=True).order_by("pk").values_list("pk", "price")
+            ),
+            "insurers": list(InsuranceCompany.objects.order_by("pk").values_list("pk", flat=True)),
+        }
+
+    def reset_sequences(self):
+        """Move the id sequences past the explicitly assigned ids."""
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [model for model, _ in MODEL_FIELDS]
+        )
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
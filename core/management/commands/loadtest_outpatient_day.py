@@ -0,0 +1,441 @@
+import http.client
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from core.models import HospitalItem, InsuranceCompany, ItemType, Patient
+from users.models import CustomUser, Department
+
+# Seeded patients are tagged through their phone number so they can be removed
+PHONE_PREFIX = "lt"
+STAFF_ROLES = ("receptionist", "cashier", "doctor", "pharmacist")
+# AssignDoctorView looks the item up by exact name, ConsultationPaymentView
+# case-insensitively; this spelling satisfies both
+CONSULTATION_ITEM = "consultation fee"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Client:
+    """Minimal keep-alive JSON client, one per worker thread."""
+
+    def __init__(self, base_url, recorder):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.recorder = recorder
+        self.connection = None
+
+    def request(self, step, method, path, token=None, data=None, expect=(200, 201)):
+        body = json.dumps(data) if data is not None else None
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, self.prefix + path, body, headers)
+            response = self.connection.getresponse()
+            status, payload = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection = None
+            status, payload = 0, b""
+        elapsed = time.perf_counter() - started
+
+        ok = status in expect
+        self.recorder.add(step, elapsed, ok)
+        if not ok:
+            raise StepFailed(step, status, payload[:200])
+        return json.loads(payload) if payload else {}
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, step, elapsed, ok):
+        with self.lock:
+            self.timings[step].append(elapsed)
+            if not ok:
+                self.errors[step] += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a full outpatient day (registration, consultation payment, "
+        "doctor assignment, consultation, tests and their payment, prescriptions, "
+        "dispensing and discharge) with concurrent clients against a running "
+        "server, and report "
+        "throughput and p50/p95/p99 latency per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--patients", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--doctors", type=int, default=5)
+        parser.add_argument("--test-items", type=int, default=20)
+        parser.add_argument("--medicine-items", type=int, default=20)
+        parser.add_argument("--insurers", type=int, default=3)
+        parser.add_argument(
+            "--insured-share",
+            type=float,
+            default=0.3,
+            help="Fraction of patients registered with an insurance policy.",
+        )
+        parser.add_argument("--password", default="loadtest-password")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", help="Also write the results as JSON here.")
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the patients (and their visits) created by load tests.",
+        )
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            deleted, _ = Patient.all_objects.filter(phone__startswith=PHONE_PREFIX).delete()
+            self.stdout.write(f"Deleted {deleted} load-test rows.")
+            return
+
+        rng = random.Random(options["seed"])
+        fixtures = self.seed(options)
+        tokens = self.login(options["base_url"], options["password"])
+
+        # A per-run tag keeps phone numbers unique across runs
+        run = int(time.time()) % 10_000
+        journeys = [
+            {
+                "index": i,
+                "phone": f"{PHONE_PREFIX}{run:04d}{i:07d}",
+                "doctor": rng.choice(fixtures["doctors"]),
+                "test_items": rng.sample(fixtures["test_items"], k=rng.randint(0, 3)),
+                "insurer": (
+                    rng.choice(fixtures["insurers"])
+                    if rng.random() < options["insured_share"]
+                    else None
+                ),
+                "medicines": rng.sample(
+                    fixtures["medicine_items"], k=rng.randint(0, 3)
+                ),
+            }
+            for i in range(options["patients"])
+        ]
+
+        recorder = Recorder()
+        local = threading.local()
+        failures = defaultdict(int)
+        failures_lock = threading.Lock()
+
+        def run_journey(journey):
+            if not hasattr(local, "client"):
+                local.client = Client(options["base_url"], recorder)
+            try:
+                self.journey(local.client, tokens, fixtures, journey)
+            except StepFailed as e:
+                with failures_lock:
+                    failures[f"{e.args[0]} -> {e.args[1]}"] += 1
+                return False
+            return True
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            completed = sum(pool.map(run_journey, journeys))
+        wall = time.perf_counter() - started
+
+        self.report(recorder, completed, len(journeys), wall, failures, options)
+
+    def seed(self, options):
+        """Create (or reuse) the reference data and staff the journeys need."""
+        department, _ = Department.objects.get_or_create(
+            name="Outpatient", defaults={"short_name": "OPD"}
+        )
+        consultation_type, _ = ItemType.objects.get_or_create(name="Consultation")
+        lab_type, _ = ItemType.objects.get_or_create(name="Laboratory")
+        pharmacy_type, _ = ItemType.objects.get_or_create(name="Pharmacy")
+        if not HospitalItem.objects.filter(name__iexact=CONSULTATION_ITEM).exists():
+            HospitalItem.objects.create(
+                name=CONSULTATION_ITEM, price=10_000, item_type=consultation_type
+            )
+
+        test_items = []
+        for i in range(options["test_items"]):
+            item, _ = HospitalItem.objects.get_or_create(
+                name=f"Load test lab {i:03d}",
+                defaults={"price": 5_000 + 500 * i, "item_type": lab_type},
+            )
+            test_items.append(item.id)
+
+        medicine_items = []
+        for i in range(options["medicine_items"]):
+            item, _ = HospitalItem.objects.get_or_create(
+                name=f"Load test medicine {i:03d}",
+                defaults={"price": 1_000 + 250 * i, "item_type": pharmacy_type},
+            )
+            medicine_items.append(item.id)
+
+        insurers = [
+            InsuranceCompany.objects.get_or_create(name=f"Load test insurer {i}")[0].id
+            for i in range(options["insurers"])
+        ]
+
+        staff = {}
+        for role in STAFF_ROLES:
+            count = options["doctors"] if role == "doctor" else 1
+            staff[role] = []
+            for i in range(count):
+                email = f"loadtest-{role}-{i}@hms.test"
+                user = CustomUser.objects.filter(email=email).first()
+                if user is None:
+                    user = CustomUser.objects.create_user(
+                        email=email,
+                        password=options["password"],
+                        role=role,
+                        department=department,
+                    )
+                staff[role].append(user)
+
+        return {
+            "department": department.id,
+            "doctors": [user.id for user in staff["doctor"]],
+            "doctor_emails": {user.id: user.email for user in staff["doctor"]},
+            "staff": {role: users[0].email for role, users in staff.items()},
+            "test_items": test_items,
+            "medicine_items": medicine_items,
+            "insurers": insurers,
+        }
+
+    def login(self, base_url, password):
+        """Log every seeded staff member in once; the journeys reuse the tokens."""
+        emails = set(CustomUser.objects.filter(email__startswith="loadtest-").values_list(
+            "email", flat=True
+        ))
+        client = Client(base_url, Recorder())
+        tokens = {}
+        for email in sorted(emails):
+            try:
+                response = client.request(
+                    "login",
+                    "POST",
+                    "/api/users/login/",
+                    data={"email": email, "password": password},
+                )
+            except StepFailed as e:
+                raise CommandError(f"Could not log in as {email}: {e.args[1:]}")
+            tokens[email] = response["access"]
+        return tokens
+
+    def journey(self, client, tokens, fixtures, journey):
+        reception = tokens[fixtures["staff"]["receptionist"]]
+        cashier = tokens[fixtures["staff"]["cashier"]]
+        pharmacist = tokens[fixtures["staff"]["pharmacist"]]
+        doctor_id = journey["doctor"]
+        doctor = tokens[fixtures["doctor_emails"][doctor_id]]
+
+        patient = client.request(
+            "register patient",
+            "POST",
+            "/api/core/patients/",
+            reception,
+            {
+                "first_name": "Load",
+                "last_name": f"Patient {journey['index']}",
+                "date_of_birth": "1990-01-01",
+                "phone": journey["phone"],
+                "address": "Load test",
+            },
+        )
+        if journey["insurer"]:
+            client.request(
+                "register insurance",
+                "POST",
+                "/api/management/insurance/",
+                reception,
+                {
+                    "policy_number": f"LT-{journey['phone']}",
+                    "patient": patient["id"],
+                    "provider_id": journey["insurer"],
+                },
+            )
+
+        visit = client.request(
+            "create visit",
+            "POST",
+            "/api/core/visits/",
+            reception,
+            {"patient": patient["id"], "department": fixtures["department"]},
+        )
+        visit_id = visit["id"]
+
+        charge = client.request(
+            "consultation payment",
+            "POST",
+            "/api/payments/generate-consultation-payment/",
+            reception,
+            {"visit_id": visit_id},
+        )
+        if not journey["insurer"]:
+            self.collect(client, cashier, visit_id, charge["payment_id"])
+
+        client.request(
+            "assign doctor",
+            "POST",
+            "/api/core/visits/assign-doctor/",
+            reception,
+            {
+                "visit_id": visit_id,
+                "doctor_id": doctor_id,
+                "department_id": fixtures["department"],
+            },
+        )
+        client.request(
+            "doctor consultation",
+            "POST",
+            "/api/core/api/doctor-consultation/",
+            doctor,
+            {
+                "visit_id": visit_id,
+                "doctor_id": doctor_id,
+                "new_history": "Presented with fever; examined and advised.",
+            },
+        )
+
+        for item_id in journey["test_items"]:
+            client.request(
+                "order test",
+                "POST",
+                "/api/core/tests/",
+                doctor,
+                {"visit": visit_id, "item_id": item_id},
+            )
+        if journey["test_items"]:
+            # Insured patients without coverage are billed in cash as well
+            charge = client.request(
+                "test payment",
+                "POST",
+                "/api/payments/generate-test-invoice/",
+                cashier,
+                {"visit_id": visit_id},
+            )
+            if "payment_id" in charge:
+                self.collect(client, cashier, visit_id, charge["payment_id"])
+
+        if journey["medicines"]:
+            client.request(
+                "add prescriptions",
+                "POST",
+                "/api/core/add-prescription/",
+                doctor,
+                {
+                    "visit_id": visit_id,
+                    "prescriptions": [
+                        {
+                            "medicine_name": f"Medicine {item_id}",
+                            "item_id": item_id,
+                            "dosage": "1 tablet",
+                            "quantity": 10,
+                            "frequency": "Twice a day",
+                        }
+                        for item_id in journey["medicines"]
+                    ],
+                },
+            )
+            charge = client.request(
+                "prescription payment",
+                "POST",
+                "/api/payments/generate-prescription-invoice/",
+                cashier,
+                {"visit_id": visit_id},
+            )
+            if "payment_id" in charge:
+                self.collect(client, cashier, visit_id, charge["payment_id"])
+            client.request(
+                "dispense medicines",
+                "POST",
+                "/api/core/dispense-medicines/",
+                pharmacist,
+                {"visit_id": visit_id},
+            )
+
+        client.request(
+            "complete visit",
+            "POST",
+            "/api/core/complete-visit/",
+            reception,
+            {"visit_id": visit_id},
+        )
+
+    def collect(self, client, cashier, visit_id, payment_id):
+        """The cashier lists the visit's items and collects those of the payment."""
+        items = client.request(
+            "list payment items",
+            "GET",
+            f"/api/payments/visits/{visit_id}/payment-items/",
+            cashier,
+        )
+        client.request(
+            "complete payment",
+            "POST",
+            f"/api/payments/visits/{visit_id}/complete-payment/",
+            cashier,
+            {"payment_id": payment_id, "item_ids": [item["id"] for item in items]},
+        )
+
+    def report(self, recorder, completed, total, wall, failures, options):
+        requests = sum(len(t) for t in recorder.timings.values())
+        summary = {
+            "patients": total,
+            "completed_journeys": completed,
+            "concurrency": options["concurrency"],
+            "wall_seconds": round(wall, 3),
+            "journeys_per_second": round(completed / wall, 2) if wall else 0,
+            "requests_per_second": round(requests / wall, 2) if wall else 0,
+            "endpoints": {},
+            "failures": dict(failures),
+        }
+        self.stdout.write(
+            f"{completed}/{total} journeys in {wall:.1f}s "
+            f"({summary['journeys_per_second']} journeys/s, "
+            f"{summary['requests_per_second']} requests/s, "
+            f"concurrency {options['concurrency']})"
+        )
+        self.stdout.write(
+            f"{'endpoint':<24}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        )
+        for step, timings in recorder.timings.items():
+            timings = sorted(timings)
+            stats = {
+                "count": len(timings),
+                "errors": recorder.errors[step],
+                "p50_ms": round(percentile(timings, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(timings, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+            }
+            summary["endpoints"][step] = stats
+            self.stdout.write(
+                f"{step:<24}{stats['count']:>7}{stats['errors']:>8}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+            )
+        for failure, count in sorted(failures.items()):
+            self.stdout.write(f"failed: {failure} ({count}x)")
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(summary, f, indent=2)
@@ -0,0 +1,86 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from core import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the monthly partitions of the partitioned tables: create the "
+        "coming months ahead of time and detach (and optionally archive to "
+        "gzipped CSV or drop) months past the retention period."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=3,
+            help="Create partitions up to this many months after the current one.",
+        )
+        parser.add_argument(
+            "--detach-older-than",
+            type=int,
+            metavar="MONTHS",
+            help="Detach partitions that end more than MONTHS months ago.",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            help="Dump detached partitions here as <partition>.csv.gz, then drop them.",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop detached partitions without archiving them.",
+        )
+        parser.add_argument("--list", action="store_true", help="Only list partitions.")
+        parser.add_argument(
+            "--tables",
+            nargs="+",
+            choices=sorted(partitions.PARTITIONED_TABLES),
+            default=sorted(partitions.PARTITIONED_TABLES),
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError(f"Partitioning needs PostgreSQL, not {connection.vendor}.")
+        if options["drop"] and options["archive_dir"]:
+            raise CommandError("--archive-dir already drops after archiving; pass one of them.")
+
+        this_month = date.today().replace(day=1)
+        for table in options["tables"]:
+            if not partitions.is_partitioned(connection, table):
+                self.stdout.write(f"{table} is not partitioned; run migrate first.")
+                continue
+            if not options["list"]:
+                self.maintain(table, this_month, options)
+            for name, bound, rows, size in partitions.list_partitions(connection, table):
+                self.stdout.write(f"  {name:<32}{bound:<60}~{rows} rows  {size // 1024} kB")
+
+    def maintain(self, table, this_month, options):
+        column = partitions.PARTITIONED_TABLES[table]
+        for offset in range(options["months_ahead"] + 1):
+            month = partitions.add_months(this_month, offset)
+            with transaction.atomic():
+                if partitions.ensure_partition(connection, table, column, month):
+                    self.stdout.write(f"Created {partitions.partition_name(table, month)}")
+
+        if options["detach_older_than"] is None:
+            return
+        cutoff = partitions.add_months(this_month, -options["detach_older_than"])
+        for name, *_ in partitions.list_partitions(connection, table):
+            month = partitions.partition_month(table, name)
+            # A partition is kept while any part of it is inside the retention window
+            if month is None or partitions.add_months(month, 1) > cutoff:
+                continue
+            with transaction.atomic():
+                partitions.detach_partition(connection, table, name)
+                if options["archive_dir"]:
+                    path = partitions.archive_table(connection, name, options["archive_dir"])
+                    self.stdout.write(f"Archived {name} to {path}")
+                elif options["drop"]:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+                    self.stdout.write(f"Dropped {name}")
+                else:
+                    self.stdout.write(f"Detached {name}")
@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core.models import Patient, Visit
+
+
+class Command(BaseCommand):
+    help = (
+        "Permanently delete patients and visits that were soft-deleted more "
+        "than HMS_PURGE_AFTER_DAYS ago, in small batches so each transaction "
+        "holds its locks only briefly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=getattr(settings, "HMS_PURGE_AFTER_DAYS", 30),
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.1,
+            help="Seconds to sleep between batches to let other writers in.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        # Visits first, so purging a patient cascades through as little as possible
+        visits = self.purge(Visit.all_objects.filter(deleted_at__lt=cutoff), options)
+        patients = self.purge(
+            Patient.all_objects.filter(is_active=False, deleted_at__lt=cutoff), options
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Purged {visits} visits and {patients} patients deleted before "
+                f"{cutoff:%Y-%m-%d %H:%M}."
+            )
+        )
+
+    def purge(self, queryset, options):
+        model = queryset.model
+        purged = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    queryset.order_by("pk").values_list("pk", flat=True)[
+                        : options["batch_size"]
+                    ]
+                )
+                if not ids:
+                    return purged
+                model.all_objects.filter(pk__in=ids).delete()
+            purged += len(ids)
+            time.sleep(options["pause"])
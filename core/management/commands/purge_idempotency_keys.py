@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from core.models import IdempotencyKey
+from hms.idempotency import expiry_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored Idempotency-Key responses older than "
+        "HMS_IDEMPOTENCY_KEY_TTL_HOURS, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(created_at__lt=expiry_cutoff())
+        purged = 0
+        while True:
+            ids = list(
+                expired.order_by("pk").values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired idempotency keys."))
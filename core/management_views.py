@@ -5,6 +5,8 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from users.models import CustomUser as User
+from hms.caching import cache_response
+from users.scoping import get_data_scope
 from .models import Insurance, HospitalItem, InsuranceCompany, ItemType, VisitComment
 from .serializers import (
     InsuranceSerializer,
@@ -27,7 +29,9 @@ class InsuranceListView(APIView):
         """
         Retrieve a list of all insurances.
         """
-        insurances = Insurance.objects.all()
+        insurances = get_data_scope(request).patients(
+            Insurance.objects.all(), "patient"
+        )
         serializer = InsuranceSerializer(insurances, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -101,11 +105,12 @@ class HospitalItemListView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @cache_response("hospital-items")
     def get(self, request):
         """
         Retrieve a list of all hospital items.
         """
-        hospital_items = HospitalItem.objects.all()
+        hospital_items = HospitalItemSerializer.eager_load(HospitalItem.objects.all())
         serializer = HospitalItemSerializer(hospital_items, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -142,7 +147,6 @@ class HospitalItemDetailView(APIView):
         """
         Update an entire hospital item record.
         """
-        print(request.data)
         hospital_item = self.get_object(pk)
         serializer = HospitalItemSerializer(hospital_item, data=request.data)
         if serializer.is_valid():
@@ -182,6 +186,7 @@ class ItemTypeListView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @cache_response("item-types")
     def get(self, request):
         """
         Retrieve a list of all item types.
@@ -223,7 +228,6 @@ class ItemTypeDetailView(APIView):
         """
         Update an entire item type record.
         """
-        print(request.data)
         hospital_item = self.get_object(pk)
         serializer = ItemTypeSerializer(hospital_item, data=request.data)
         if serializer.is_valid():
@@ -261,6 +265,7 @@ class InsuranceCompanyListView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @cache_response("insurance-companies")
     def get(self, request):
         """
         Retrieve a list of all insurance companies.
@@ -302,7 +307,6 @@ class InsuranceCompanyDetailView(APIView):
         """
         Update an entire insurance company record.
         """
-        print(request.data)
         insurance_company = self.get_object(pk)
         serializer = InsuranceCompanySerializer(insurance_company, data=request.data)
         if serializer.is_valid():
@@ -440,9 +444,12 @@ class VisitCommentListView(APIView):
 
     def get(self, request, visit_id):
         """Retrieve all comments for a given visit"""
-        comments = VisitComment.objects.filter(visit__id=visit_id).order_by(
-            "-created_at"
-        )
+        comments = get_data_scope(request).visits(
+            VisitComment.objects.filter(visit__id=visit_id).select_related(
+                "visit", "created_by"
+            ),
+            "visit",
+        ).order_by("-created_at")
         serializer = VisitCommentSerializer(comments, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.4 on 2026-10-18 23:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_vitals(apps, schema_editor):
+    Vital = apps.get_model("core", "Vital")
+    vitals = Vital.objects.select_related("visit").only(
+        "id", "blood_pressure", "visit__patient_id"
+    )
+    batch = []
+    for vital in vitals.iterator(chunk_size=2000):
+        vital.patient_id = vital.visit.patient_id
+        try:
+            systolic, diastolic = (
+                int(part) for part in (vital.blood_pressure or "").split("/")
+            )
+        except ValueError:
+            systolic = diastolic = None
+        vital.systolic, vital.diastolic = systolic, diastolic
+        batch.append(vital)
+        if len(batch) >= 2000:
+            Vital.objects.bulk_update(batch, ["patient", "systolic", "diastolic"])
+            batch = []
+    if batch:
+        Vital.objects.bulk_update(batch, ["patient", "systolic", "diastolic"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_alter_visit_department'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vital',
+            name='diastolic',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vital',
+            name='patient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vitals', to='core.patient'),
+        ),
+        migrations.AddField(
+            model_name='vital',
+            name='systolic',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vital',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='vital',
+            index=models.Index(fields=['visit', 'recorded_at'], name='vital_visit_recorded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vital',
+            index=models.Index(fields=['patient', 'recorded_at'], name='vital_patient_recorded_idx'),
+        ),
+        migrations.RunPython(backfill_vitals, migrations.RunPython.noop),
+    ]
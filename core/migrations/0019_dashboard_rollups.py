@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_vital_patient_systolic_diastolic_and_indexes'),
+        ('users', '0004_customuser_gender'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('items', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='users.department')),
+                ('item_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.itemtype')),
+            ],
+            options={
+                'verbose_name': 'Revenue Rollup',
+                'verbose_name_plural': 'Revenue Rollups',
+                'constraints': [models.UniqueConstraint(fields=('date', 'department', 'item_type', 'payment_method'), name='revenue_rollup_unique_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TestRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('tests', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='users.department')),
+                ('item_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.itemtype')),
+            ],
+            options={
+                'verbose_name': 'Test Rollup',
+                'verbose_name_plural': 'Test Rollups',
+                'constraints': [models.UniqueConstraint(fields=('date', 'department', 'item_type'), name='test_rollup_unique_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VisitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('payment_method', models.CharField(max_length=20)),
+                ('visits', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='users.department')),
+            ],
+            options={
+                'verbose_name': 'Visit Rollup',
+                'verbose_name_plural': 'Visit Rollups',
+                'constraints': [models.UniqueConstraint(fields=('date', 'department', 'status', 'payment_method'), name='visit_rollup_unique_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-19 00:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_paymentitem_completed_at_completed_by'),
+        ('users', '0004_customuser_gender'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('is_insurance', True), ('is_paid', False)), fields=['created_at'], name='invoice_open_insurance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalhistory',
+            index=models.Index(fields=['patient', 'created_at'], name='history_patient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['visit', 'status'], name='payment_visit_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentitem',
+            index=models.Index(fields=['payment', 'item'], name='paymentitem_payment_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentitem',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['payment'], name='paymentitem_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['visit', 'status'], name='test_visit_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['patient', 'department', 'visit_date'], name='visit_patient_dept_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:02
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_created_at(apps, schema_editor):
+    # Existing items were charged when their payment was created
+    Payment = apps.get_model("core", "Payment")
+    PaymentItem = apps.get_model("core", "PaymentItem")
+    PaymentItem.objects.update(
+        created_at=Subquery(
+            Payment.objects.filter(pk=OuterRef("payment_id")).values("created_at")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentitem',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+    ]
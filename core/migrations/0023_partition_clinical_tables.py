@@ -0,0 +1,38 @@
+from django.db import migrations
+from core import partitions
+
+# Frozen copy of partitions.PARTITIONED_TABLES at the time of this migration
+TABLES = (
+    ("core_paymentitem", "created_at"),
+    ("core_medicalhistory", "created_at"),
+    ("core_visitcomment", "created_at"),
+)
+
+
+def partition(apps, schema_editor):
+    # Range partitioning is PostgreSQL-only; other backends keep plain tables
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in TABLES:
+        partitions.partition_table(schema_editor.connection, table, column)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, _ in TABLES:
+        partitions.unpartition_table(schema_editor.connection, table)
+
+
+class Migration(migrations.Migration):
+    # Each table is converted in its own transaction (see core.partitions),
+    # so the copy never holds the locks of all three at once
+    atomic = False
+
+    dependencies = [
+        ('core', '0022_paymentitem_created_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-19 00:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_partition_clinical_tables'),
+        ('users', '0004_customuser_gender'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedVisit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.IntegerField(unique=True)),
+                ('visit_number', models.CharField(blank=True, max_length=9, null=True)),
+                ('visit_date', models.DateField()),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('assigned_doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.department')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_visits', to='core.patient')),
+            ],
+            options={
+                'verbose_name': 'Archived Visit',
+                'verbose_name_plural': 'Archived Visits',
+                'indexes': [models.Index(fields=['patient', 'visit_date'], name='archivedvisit_patient_date_idx')],
+            },
+        ),
+    ]
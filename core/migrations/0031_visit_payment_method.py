@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:14
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def backfill_payment_method(apps, schema_editor):
+    # The rollups counted existing visits by the patient's current insurance
+    Insurance = apps.get_model("core", "Insurance")
+    Visit = apps.get_model("core", "Visit")
+    Visit.objects.filter(
+        Exists(Insurance.objects.filter(patient_id=OuterRef("patient_id")))
+    ).update(payment_method="insurance")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_audit_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='payment_method',
+            field=models.CharField(choices=[('cash', 'Cash'), ('insurance', 'Insurance')], db_default='cash', default='cash', editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_payment_method, migrations.RunPython.noop),
+    ]
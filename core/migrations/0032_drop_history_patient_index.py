@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_visit_payment_method'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medicalhistory',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='histories', to='core.patient'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:36
+
+import json
+import zlib
+from collections import defaultdict
+from decimal import Decimal
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+def backfill_rollup(apps, schema_editor):
+    # Recover each archived visit's counts from its payload. Items are
+    # mapped to their current item type and the payment method follows the
+    # patient's current insurance, as migration 0031 did for live visits.
+    ArchivedVisit = apps.get_model("core", "ArchivedVisit")
+    HospitalItem = apps.get_model("core", "HospitalItem")
+    Insurance = apps.get_model("core", "Insurance")
+    item_types = dict(HospitalItem.objects.values_list("pk", "item_type_id"))
+    insured = set(Insurance.objects.values_list("patient_id", flat=True))
+
+    batch = []
+    for archived in ArchivedVisit.objects.iterator(chunk_size=500):
+        graph = json.loads(zlib.decompress(archived.payload))
+        tests = defaultdict(int)
+        for test in graph["tests"]:
+            tests[item_types.get(test["item"]["id"]) if test["item"] else None] += 1
+        revenue = defaultdict(lambda: [Decimal(0), 0])
+        for payment in graph["payments"]:
+            for item in payment["items"]:
+                if item["status"] == "completed":
+                    totals = revenue[item_types.get(item["item"]["id"]) if item["item"] else None]
+                    totals[0] += Decimal(item["item"]["price"]) if item["item"] else 0
+                    totals[1] += 1
+        archived.rollup = {
+            "tests": [[item_type, n] for item_type, n in tests.items()],
+            "revenue": [[item_type, amount, n] for item_type, (amount, n) in revenue.items()],
+        }
+        archived.payment_method = "insurance" if archived.patient_id in insured else "cash"
+        batch.append(archived)
+        if len(batch) == 500:
+            ArchivedVisit.objects.bulk_update(batch, ["rollup", "payment_method"])
+            batch = []
+    ArchivedVisit.objects.bulk_update(batch, ["rollup", "payment_method"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_drop_history_patient_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedvisit',
+            name='payment_method',
+            field=models.CharField(default='cash', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='archivedvisit',
+            name='rollup',
+            field=models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AlterField(
+            model_name='archivedvisit',
+            name='original_id',
+            field=models.PositiveBigIntegerField(unique=True),
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
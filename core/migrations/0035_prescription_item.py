@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_audit_actor_without_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prescription',
+            name='item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.hospitalitem'),
+        ),
+    ]
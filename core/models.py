@@ -1,9 +1,14 @@
+import json
+import zlib
 from datetime import datetime
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.timezone import now
 from users.models import Department
+from .concurrency import VersionedModel
 
 
 def validate_dob(value):
@@ -87,6 +92,20 @@ class HospitalItem(models.Model):
         verbose_name_plural = "Hospital Items"
 
 
+class ActivePatientManager(models.Manager):
+    """Hides soft-deleted patients; Patient.all_objects sees every row."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_active=True)
+
+
+class LiveVisitManager(models.Manager):
+    """Hides soft-deleted visits; Visit.all_objects sees every row."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Patient(models.Model):
     patient_number = models.CharField(
         max_length=9, unique=True, blank=True, null=True, db_index=True
@@ -116,16 +135,34 @@ class Patient(models.Model):
         null=True,
     )
     priority = models.BooleanField(default=False)
-    is_active = models.BooleanField(default=True)
+    is_active = models.BooleanField(default=True)  # False once soft-deleted
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ActivePatientManager()
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ("patient_number",)
+        indexes = [
+            # The default (patient_number ordered) listing only reads active rows
+            models.Index(
+                fields=["patient_number"],
+                condition=models.Q(is_active=True),
+                name="patient_active_number_idx",
+            ),
+            # purge_deleted looks for old soft-deleted rows only
+            models.Index(
+                fields=["deleted_at"],
+                condition=models.Q(is_active=False),
+                name="patient_deleted_idx",
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.patient_number:
             today_str = datetime.today().strftime("%d%m%y")
             last_patient = (
-                Patient.objects.filter(patient_number__startswith=today_str)
+                Patient.all_objects.filter(patient_number__startswith=today_str)
                 .order_by("-id")
                 .first()
             )
@@ -138,6 +175,19 @@ class Patient(models.Model):
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.patient_number})"
 
+    def soft_delete(self):
+        """
+        Hide the patient and their visits instead of cascading a delete
+        through every clinical and billing table; purge_deleted removes the
+        rows later in small batches.
+        """
+        with transaction.atomic():
+            for visit in self.visits.all():
+                visit.soft_delete()
+            self.is_active = False
+            self.deleted_at = now()
+            self.save(update_fields=["is_active", "deleted_at"])
+
     @property
     def payment_method(self):
         return "insurance" if hasattr(self, "insurance") else "cash"
@@ -156,7 +206,7 @@ class Insurance(models.Model):
         return f"{self.patient.first_name} {self.patient.last_name} - {self.provider.name} - {self.policy_number}"
 
 
-class Visit(models.Model):
+class Visit(VersionedModel):
     visit_number = models.CharField(
         max_length=9, unique=True, blank=True, null=True, db_index=True
     )
@@ -197,17 +247,68 @@ class Visit(models.Model):
         default="pending",
     )
     visit_date = models.DateField(auto_now_add=True)
+    # is_active means "still open" (CompleteVisitView clears it), so soft
+    # deletion needs its own marker
     is_active = models.BooleanField(default=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # How the patient was covered when the visit was registered; the
+    # dashboard rollups count the visit and its revenue under it for good
+    payment_method = models.CharField(
+        max_length=20,
+        choices=[("cash", "Cash"), ("insurance", "Insurance")],
+        default="cash",
+        db_default="cash",
+        editable=False,
+    )
+
+    objects = LiveVisitManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # Visit.save()'s one-visit-per-department-per-day check
+            models.Index(
+                fields=["patient", "department", "visit_date"],
+                name="visit_patient_dept_date_idx",
+            ),
+            # Date-range reports and rollup rebuilds over live visits
+            models.Index(
+                fields=["visit_date"],
+                condition=models.Q(deleted_at__isnull=True),
+                name="visit_live_date_idx",
+            ),
+            models.Index(
+                fields=["deleted_at"],
+                condition=models.Q(deleted_at__isnull=False),
+                name="visit_deleted_idx",
+            ),
+            # Open visits only, for active-visit lists and close_stale_visits
+            models.Index(
+                fields=["visit_date"],
+                condition=models.Q(is_active=True, deleted_at__isnull=True),
+                name="visit_open_date_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Visit for {self.patient} to {self.department}"
 
     def save(self, *args, **kwargs):
-        if Visit.objects.filter(
-            patient=self.patient,
-            department=self.department,
-            visit_date=datetime.today(),
-        ).exists():
+        update_fields = kwargs.get("update_fields")
+        # Field-limited saves that leave patient and department alone (the
+        # workflow transitions in core.services) skip the duplicate check
+        if (
+            update_fields is None
+            or {"patient", "department"} & set(update_fields)
+        ) and (
+            Visit.objects.filter(
+                patient_id=self.patient_id,
+                department_id=self.department_id,
+                visit_date=datetime.today(),
+            )
+            .exclude(pk=self.pk)
+            .exists()
+        ):
             raise ValidationError(
                 "Patient already has a visit to this department today."
             )
@@ -215,15 +316,26 @@ class Visit(models.Model):
         if not self.visit_number:
             today_str = datetime.today().strftime("%d%m%y")
             last_visit = (
-                Visit.objects.filter(visit_number__startswith=today_str)
+                Visit.all_objects.filter(visit_number__startswith=today_str)
                 .order_by("-id")
                 .first()
             )
             new_number = int(last_visit.visit_number[-3:]) + 1 if last_visit else 1
             self.visit_number = f"{today_str}{new_number:03d}"
 
+        if self._state.adding:
+            self.payment_method = (
+                "insurance"
+                if Insurance.objects.filter(patient_id=self.patient_id).exists()
+                else "cash"
+            )
+
         super().save(*args, **kwargs)
 
+    def soft_delete(self):
+        self.deleted_at = now()
+        self.save(update_fields=["deleted_at"])
+
 
 class VisitComment(models.Model):
     visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name="comments")
@@ -237,7 +349,7 @@ class VisitComment(models.Model):
         return f"Comment by {self.created_by} on {self.visit.visit_number} - {self.visit.patient.first_name} {self.visit.patient.last_name} "
 
 
-class Payment(models.Model):
+class Payment(VersionedModel):
     """
     This is used to track the total amount of payments in the entire visit
     """
@@ -251,6 +363,12 @@ class Payment(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Outstanding payments of a visit (CompleteVisitView, cashier screens)
+            models.Index(fields=["visit", "status"], name="payment_visit_status_idx"),
+        ]
+
     def __str__(self):
         return f"Payment for {self.visit} - {self.status}"
 
@@ -271,6 +389,19 @@ class PaymentItem(models.Model):
         choices=[("pending", "Pending"), ("completed", "Completed")],
         default="pending",
     )
+    completed_at = models.DateTimeField(
+        null=True, blank=True
+    )  # When the cashier collected the item
+    completed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="collected_payment_items",
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )  # Partition key of the (PostgreSQL) partitioned table
 
     def __str__(self):
         return f"{self.payment.visit.patient.first_name} {self.payment.visit.patient.last_name} - {self.item.name} (${self.item.price})"
@@ -278,30 +409,91 @@ class PaymentItem(models.Model):
     class Meta:
         verbose_name = "Payment Item"
         verbose_name_plural = "Payment Items"
+        indexes = [
+            # Duplicate-charge checks and the consultation fee lookup
+            models.Index(fields=["payment", "item"], name="paymentitem_payment_item_idx"),
+            # Items still to collect; most rows are completed, so the partial
+            # index stays small
+            models.Index(
+                fields=["payment"],
+                condition=models.Q(status="pending"),
+                name="paymentitem_pending_idx",
+            ),
+        ]
+
+
+def parse_blood_pressure(value):
+    """
+    Parse a "systolic/diastolic" reading such as "120/80" into two integers.
+    Returns (None, None) for empty values and raises ValidationError otherwise.
+    """
+    if value in (None, ""):
+        return None, None
+    try:
+        systolic, diastolic = (int(part) for part in str(value).split("/"))
+    except ValueError:
+        raise ValidationError(
+            "Blood pressure must be in the form 'systolic/diastolic', e.g. '120/80'."
+        )
+    if not (0 < diastolic < systolic <= 300):
+        raise ValidationError("Blood pressure reading is out of range.")
+    return systolic, diastolic
 
 
 class Vital(models.Model):
     visit = models.ForeignKey(Visit, on_delete=models.CASCADE)
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name="vitals",
+        null=True,
+        blank=True,
+    )  # Denormalised from the visit so per-patient trends avoid a join
     weight = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     temperature = models.DecimalField(
         max_digits=4, decimal_places=1, null=True, blank=True
     )
     blood_pressure = models.CharField(max_length=20, null=True, blank=True)
+    systolic = models.PositiveSmallIntegerField(null=True, blank=True)
+    diastolic = models.PositiveSmallIntegerField(null=True, blank=True)
     recorded_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True
     )
-    recorded_at = models.DateTimeField(auto_now_add=True)
+    recorded_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["visit", "recorded_at"], name="vital_visit_recorded_idx"),
+            models.Index(
+                fields=["patient", "recorded_at"], name="vital_patient_recorded_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Vitals for {self.visit}"
 
+    def populate_derived_fields(self):
+        """
+        Fill in the patient and the parsed blood pressure. Called from save()
+        and explicitly before bulk_create(), which bypasses save().
+        """
+        if self.patient_id is None and self.visit_id is not None:
+            self.patient_id = self.visit.patient_id
+        self.systolic, self.diastolic = parse_blood_pressure(self.blood_pressure)
+
+    def save(self, *args, **kwargs):
+        self.populate_derived_fields()
+        super().save(*args, **kwargs)
+
 
 class MedicalHistory(models.Model):
     visit = models.ForeignKey(
         "Visit", on_delete=models.CASCADE, related_name="histories"
     )
+    # history_patient_created_idx leads with patient and serves the FK; a
+    # second, smaller patient index only tempts the planner into sorting
     patient = models.ForeignKey(
-        "Patient", on_delete=models.CASCADE, related_name="histories"
+        "Patient", on_delete=models.CASCADE, related_name="histories", db_index=False
     )
     description = models.TextField()
     recorded_by = models.ForeignKey(
@@ -315,6 +507,12 @@ class MedicalHistory(models.Model):
     class Meta:
         verbose_name = "Medical History"
         verbose_name_plural = "Medical Histories"
+        indexes = [
+            # A patient's history in date order without a sort
+            models.Index(
+                fields=["patient", "created_at"], name="history_patient_created_idx"
+            ),
+        ]
 
 
 class Test(models.Model):
@@ -338,6 +536,10 @@ class Test(models.Model):
     class Meta:
         verbose_name = "Test"
         verbose_name_plural = "Tests"
+        indexes = [
+            # Pending tests of a visit when their payment is generated
+            models.Index(fields=["visit", "status"], name="test_visit_status_idx"),
+        ]
 
 
 class TestResult(models.Model):
@@ -358,6 +560,11 @@ class Prescription(models.Model):
         Visit, on_delete=models.CASCADE, related_name="prescriptions"
     )
     medicine_name = models.CharField(max_length=255)
+    # The pharmacy's catalogue entry it is billed as; like tests, prescriptions
+    # without an item are not billed
+    item = models.ForeignKey(
+        HospitalItem, on_delete=models.SET_NULL, blank=True, null=True
+    )
     dosage = models.CharField(max_length=100)  # e.g., "1 tablet twice a day"
     quantity = models.IntegerField()  # e.g., 10 tablets
     frequency = models.CharField(max_length=100)  # e.g., "After meals"
@@ -375,13 +582,25 @@ class Prescription(models.Model):
         return f"{self.medicine_name} for {self.visit.patient} - {self.dosage} ({self.quantity} pcs)"
 
 
-class Invoice(models.Model):
+class Invoice(VersionedModel):
     visit = models.OneToOneField("Visit", on_delete=models.CASCADE)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_paid = models.BooleanField(default=False)
     is_insurance = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # visit is already unique, so (visit, is_insurance, is_paid) would
+            # add nothing; the insurance receivables report scans open
+            # insurance invoices by date instead
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(is_insurance=True, is_paid=False),
+                name="invoice_open_insurance_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"Invoice for {self.visit.patient} - Insurance: {self.is_insurance}"
 
@@ -410,3 +629,241 @@ class InvoiceItem(models.Model):
 
     def __str__(self):
         return f"{self.invoice.visit.patient.first_name} {self.invoice.visit.patient.last_name} - {self.item.name} (${self.item.price})"
+
+
+class ArchivedVisit(models.Model):
+    """
+    A completed visit moved out of the hot tables by the archive_visits
+    command, together with everything recorded against it (histories, tests,
+    prescriptions, payments, invoice, comments and vitals). The graph is kept
+    as zlib-compressed JSON in the same shape the patient timeline returns for
+    live visits; the columns beside it are only what the timeline filters on.
+    """
+
+    original_id = models.PositiveBigIntegerField(unique=True)  # pk the Visit had
+    visit_number = models.CharField(max_length=9, blank=True, null=True)
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name="archived_visits"
+    )
+    department = models.ForeignKey(
+        Department, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    assigned_doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    visit_date = models.DateField()
+    payment_method = models.CharField(max_length=20, default="cash")
+    # The visit's test and revenue counts (rollups.archived_counts()), so
+    # rebuilding the rollups keeps counting it without opening the payload
+    rollup = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Archived Visit"
+        verbose_name_plural = "Archived Visits"
+        indexes = [
+            models.Index(
+                fields=["patient", "visit_date"], name="archivedvisit_patient_date_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Archived visit {self.visit_number} ({self.visit_date})"
+
+    def graph(self):
+        return json.loads(zlib.decompress(self.payload))
+
+
+class StateTransition(models.Model):
+    """
+    One status change of a visit, test, prescription or payment, as made
+    through core.state_machine. Bulk transitions write their rows with a
+    single INSERT ... SELECT, so created_at is set explicitly rather than
+    with auto_now_add.
+    """
+
+    content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, related_name="+"
+    )
+    object_id = models.PositiveBigIntegerField()
+    from_state = models.CharField(max_length=20)
+    to_state = models.CharField(max_length=20)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            # History of one object, oldest first
+            models.Index(
+                fields=["content_type", "object_id", "created_at"],
+                name="transition_object_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id}: {self.from_state} -> {self.to_state}"
+
+
+class AuditLog(models.Model):
+    """
+    One create, update or delete of an audited record (see hms.audit), with
+    the fields it changed as ``{field: [old, new]}``. Rows are written in
+    batches by a background thread, so one can land a moment after the
+    change it describes.
+    """
+
+    ACTIONS = [("create", "Create"), ("update", "Update"), ("delete", "Delete")]
+
+    content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, related_name="+"
+    )
+    object_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    changes = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    # The trail outlives the staff account: deleting a user neither rewrites
+    # nor blocks on their entries, which keep the id
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            # Per-entity and per-actor trails, newest first
+            models.Index(
+                fields=["content_type", "object_id", "-id"], name="audit_entity_idx"
+            ),
+            models.Index(fields=["actor", "-id"], name="audit_actor_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.content_type.model} {self.object_id} by {self.actor_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The first response to a request sent with an Idempotency-Key header,
+    replayed by hms.idempotency.IdempotencyMiddleware when the client retries.
+    """
+
+    # sha256 of user, method, path and key, so keys are scoped per client
+    fingerprint = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    request_hash = models.CharField(max_length=64)  # sha256 of the body
+    status_code = models.PositiveSmallIntegerField(
+        null=True, blank=True
+    )  # None while the first request is still running
+    response_body = models.BinaryField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
+
+
+# --- Dashboard rollups ---
+# Pre-aggregated per-day, per-department counters maintained incrementally by
+# core.signals and rebuilt by the backfill_rollups command. Dimension columns
+# are nullable, so the dashboard always sums rows instead of assuming one row
+# per key.
+
+
+class VisitRollup(models.Model):
+    date = models.DateField()
+    department = models.ForeignKey(
+        Department, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    status = models.CharField(max_length=20)
+    payment_method = models.CharField(max_length=20)  # "cash" or "insurance"
+    visits = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Visit Rollup"
+        verbose_name_plural = "Visit Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "department", "status", "payment_method"],
+                name="visit_rollup_unique_key",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.department} {self.status}: {self.visits}"
+
+
+class RevenueRollup(models.Model):
+    date = models.DateField()
+    department = models.ForeignKey(
+        Department, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    item_type = models.ForeignKey(
+        ItemType, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    payment_method = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    items = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Revenue Rollup"
+        verbose_name_plural = "Revenue Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "department", "item_type", "payment_method"],
+                name="revenue_rollup_unique_key",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.department} {self.item_type}: {self.amount}"
+
+
+class TestRollup(models.Model):
+    date = models.DateField()
+    department = models.ForeignKey(
+        Department, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    item_type = models.ForeignKey(
+        ItemType, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    tests = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Test Rollup"
+        verbose_name_plural = "Test Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "department", "item_type"],
+                name="test_rollup_unique_key",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.department} {self.item_type}: {self.tests}"
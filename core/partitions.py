@@ -0,0 +1,210 @@
+"""
+Monthly range partitioning of the append-mostly clinical and billing tables
+on PostgreSQL.
+
+Each partitioned table is split on its ``created_at`` column into one
+partition per calendar month named ``<table>_pYYYYMM``, plus a DEFAULT
+partition that catches rows outside the prepared months. PostgreSQL requires
+the partition key in every unique constraint, so the physical primary key
+becomes ``(id, created_at)``; Django keeps treating ``id`` alone as the pk,
+which stays unique because it still comes from one identity sequence.
+
+Visit is not partitioned: payments, tests, prescriptions, invoices, vitals and
+histories all reference it, and PostgreSQL only allows foreign keys to a
+partitioned table through a unique key that includes the partition column.
+The partitioned tables are leaves that nothing references.
+
+Converting a table rewrites it, so partition_table() and unpartition_table()
+each run in their own transaction and give up after LOCK_TIMEOUT instead of
+queueing every other query behind their exclusive lock. A conversion that
+fails leaves that table as it was and can simply be run again.
+"""
+
+import gzip
+import os
+from datetime import date
+from django.db import transaction
+
+# Table -> partition column. Migration 0023 keeps its own copy of this list.
+PARTITIONED_TABLES = {
+    "core_paymentitem": "created_at",
+    "core_medicalhistory": "created_at",
+    "core_visitcomment": "created_at",
+}
+
+# How long a conversion waits for the table's lock before failing
+LOCK_TIMEOUT = "5s"
+
+
+def add_months(day, months):
+    year, month = divmod(day.month - 1 + months, 12)
+    return date(day.year + year, month + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def partition_month(table, name):
+    """The month a partition covers, or None for the default partition."""
+    suffix = name[len(table) + 2 :]
+    if not name.startswith(f"{table}_p") or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def _definitions(cursor, table):
+    """Secondary index and foreign key definitions, to recreate after a rebuild."""
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+        "WHERE indrelid = %s::regclass AND NOT indisprimary",
+        [table],
+    )
+    # A partitioned table reports its indexes as "ON ONLY <table>"
+    indexes = [row[0].replace(" ON ONLY ", " ON ") for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return indexes, cursor.fetchall()
+
+
+def _rebuild(connection, table, column=None, months_ahead=3):
+    """
+    Recreate ``table`` as a table partitioned by month on ``column`` or, with
+    no column, as a plain table again, copying the rows across.
+    """
+    qn = connection.ops.quote_name
+    old = f"{table}_rebuild"
+    with connection.cursor() as cursor:
+        indexes, foreign_keys = _definitions(cursor, table)
+        cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+        partition_by = f" PARTITION BY RANGE ({qn(column)})" if column else ""
+        cursor.execute(
+            f"CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS "
+            f"INCLUDING IDENTITY INCLUDING CONSTRAINTS INCLUDING STORAGE){partition_by}"
+        )
+        if column:
+            cursor.execute(f"SELECT min({qn(column)}) FROM {qn(old)}")
+            oldest = cursor.fetchone()[0]
+            first = (oldest.date() if oldest else date.today()).replace(day=1)
+            cursor.execute(f"CREATE TABLE {qn(table + '_default')} PARTITION OF {qn(table)} DEFAULT")
+            month, last = first, add_months(date.today(), months_ahead)
+            while month <= last:
+                cursor.execute(
+                    f"CREATE TABLE {qn(partition_name(table, month))} PARTITION OF "
+                    f"{qn(table)} FOR VALUES FROM (%s) TO (%s)",
+                    [month, add_months(month, 1)],
+                )
+                month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+            f"coalesce(max(id), 0) + 1, false) FROM {qn(table)}",
+            [table],
+        )
+        # Dropping the old table frees its index and constraint names
+        cursor.execute(f"DROP TABLE {qn(old)} CASCADE")
+        key = f"id, {qn(column)}" if column else "id"
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + '_pkey')} PRIMARY KEY ({key})"
+        )
+        for sql in indexes:
+            cursor.execute(sql)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+
+def _rebuild_atomically(connection, table, column=None, months_ahead=3):
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", [LOCK_TIMEOUT])
+        _rebuild(connection, table, column, months_ahead)
+
+
+def partition_table(connection, table, column, months_ahead=3):
+    if not is_partitioned(connection, table):
+        _rebuild_atomically(connection, table, column, months_ahead)
+
+
+def unpartition_table(connection, table):
+    if is_partitioned(connection, table):
+        _rebuild_atomically(connection, table)
+
+
+def list_partitions(connection, table):
+    """(name, bound, estimated rows, bytes) for each partition of ``table``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), "
+            "c.reltuples::bigint, pg_total_relation_size(c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass ORDER BY c.relname",
+            [table],
+        )
+        return cursor.fetchall()
+
+
+def ensure_partition(connection, table, column, month):
+    """
+    Create the partition for ``month`` if it is missing. Rows that already
+    landed in the default partition for that month are moved into it first,
+    otherwise PostgreSQL refuses to attach the new range.
+    """
+    name = partition_name(table, month)
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is not None:
+            return False
+        start, end = month, add_months(month, 1)
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {qn(table + '_default')} "
+            f"WHERE {qn(column)} >= %s AND {qn(column)} < %s RETURNING *) "
+            f"INSERT INTO {qn(name)} SELECT * FROM moved",
+            [start, end],
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+    return True
+
+
+def detach_partition(connection, table, name):
+    """
+    Detach a partition: its rows leave the table (and every Django query) but
+    stay readable as a standalone table until it is archived or dropped.
+    """
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+
+
+def archive_table(connection, name, directory):
+    """Dump a detached partition to ``<directory>/<name>.csv.gz`` and drop it."""
+    qn = connection.ops.quote_name
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+    sql = f"COPY {qn(name)} TO STDOUT WITH (FORMAT csv, HEADER)"
+    with connection.cursor() as cursor, gzip.open(path, "wb") as f:
+        raw = cursor.cursor
+        if hasattr(raw, "copy"):
+            with raw.copy(sql) as copy:
+                for data in copy:
+                    f.write(data)
+        else:
+            raw.copy_expert(sql, f)
+        cursor.execute(f"DROP TABLE {qn(name)}")
+    return path
@@ -2,12 +2,17 @@ import logging
 from decimal import Decimal
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from users.permissions import IsCashier
+from users.scoping import get_data_scope
+from . import concurrency, reports, rollups, services
+from .concurrency import ConcurrentUpdate
 from .models import (
     Visit,
     Insurance,
@@ -31,12 +36,34 @@ from .serializers import (
 logger = logging.getLogger(__name__)
 
 
+def _unbilled(queryset):
+    """
+    The tests or prescriptions of ``queryset`` whose item is on no payment or
+    insurance invoice of their visit yet, so repeating a request bills
+    nothing twice. An item ordered twice in one visit is billed once.
+    """
+    return queryset.exclude(
+        Exists(
+            PaymentItem.objects.filter(
+                payment__visit=OuterRef("visit"), item=OuterRef("item")
+            )
+        )
+    ).exclude(
+        Exists(
+            InvoiceItem.objects.filter(
+                invoice__visit=OuterRef("visit"), item=OuterRef("item")
+            )
+        )
+    )
+
+
 class ConsultationPaymentView(APIView):
+    idempotent = True
+
     def post(self, request):
         """
         Handle consultation payments for both cash and insured patients.
         """
-        print(request.data)
         try:
             # Extract visit ID from request
             visit_id = request.data.get("visit_id")
@@ -91,10 +118,14 @@ class ConsultationPaymentView(APIView):
                             status=status.HTTP_400_BAD_REQUEST,
                         )
 
-                    # Add consultation fee to invoice
-                    InvoiceItem.objects.create(invoice=invoice, item=consultation_item)
-                    invoice.total_amount = consultation_fee
-                    invoice.save()
+                    # Add consultation fee to invoice; a conflicting save
+                    # takes the item back out
+                    with transaction.atomic():
+                        InvoiceItem.objects.create(
+                            invoice=invoice, item=consultation_item
+                        )
+                        invoice.total_amount = consultation_fee
+                        invoice.save()
 
                 return Response(
                     {
@@ -110,15 +141,6 @@ class ConsultationPaymentView(APIView):
                     visit=visit,
                     defaults={"amount": 0, "status": "pending"},
                 )
-                print("payment", payment)
-                print(
-                    "if exist:",
-                    PaymentItem.objects.filter(
-                        payment=payment, item=consultation_item
-                    ).exists(),
-                )
-
-                print("not created", not created)
                 if payment:
                     # Prevent duplicate consultation charge
                     if PaymentItem.objects.filter(
@@ -134,16 +156,12 @@ class ConsultationPaymentView(APIView):
                         )
 
                     # Add consultation fee to payment
-                    PaymentItem.objects.create(payment=payment, item=consultation_item)
-                    print(
-                        "created",
-                        PaymentItem.objects.filter(
+                    with transaction.atomic():
+                        PaymentItem.objects.create(
                             payment=payment, item=consultation_item
-                        ),
-                    )
-
-                    payment.amount = consultation_fee
-                    payment.save()
+                        )
+                        payment.amount = consultation_fee
+                        payment.save()
 
                 return Response(
                     {
@@ -155,6 +173,8 @@ class ConsultationPaymentView(APIView):
                     status=status.HTTP_200_OK,
                 )
 
+        except ConcurrentUpdate:
+            return concurrency.conflict()
         except Exception as e:
             return Response(
                 {"detail": f"An error occurred: {str(e)}"},
@@ -163,6 +183,8 @@ class ConsultationPaymentView(APIView):
 
 
 class GenerateTestPaymentView(APIView):
+    idempotent = True
+
     def post(self, request):
         """
         Generate a payment for assigned tests, handling both cash and insurance patients.
@@ -187,16 +209,24 @@ class GenerateTestPaymentView(APIView):
                     {"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Fetch pending tests associated with the visit
-            tests = Test.objects.filter(visit=visit, status="pending")
-            if not tests.exists():
+            # Fetch pending tests associated with the visit that are not
+            # billed yet. A test stays pending until its result is recorded
+            # (see state_machine.TEST), so billing is told apart by the
+            # invoice and payment items. Tests without an item carry no
+            # price and are not billed
+            tests = list(
+                _unbilled(
+                    Test.objects.filter(visit=visit, status="pending", item__isnull=False)
+                ).select_related("item")
+            )
+            if not tests:
                 return Response(
                     {"detail": "No pending tests to generate payment for."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
             # Calculate the total price for pending tests
-            total_price = sum(test.price for test in tests)
+            total_price = sum(test.item.price for test in tests)
 
             # Check if the patient is insured
             is_insured = visit.patient.payment_method == "insurance"
@@ -209,45 +239,42 @@ class GenerateTestPaymentView(APIView):
 
                 # Classify tests based on insurance coverage
                 for test in tests:
-                    if insurance_coverage >= test.price:
+                    if insurance_coverage >= test.item.price:
                         covered_tests.append(test)
-                        insurance_coverage -= test.price
+                        insurance_coverage -= test.item.price
                     else:
                         uncovered_tests.append(test)
 
-                # Generate invoice for covered tests
-                if covered_tests:
-                    invoice, _ = Invoice.objects.get_or_create(
-                        visit=visit,
-                        defaults={"total_amount": 0, "is_insurance": True},
-                    )
-                    for test in covered_tests:
-                        InvoiceItem.objects.create(
-                            invoice=invoice,
-                            description=test.name,
-                            category="test",
-                            amount=test.price,
+                payment = None
+                with transaction.atomic():
+                    # Generate invoice for covered tests
+                    if covered_tests:
+                        invoice, _ = Invoice.objects.get_or_create(
+                            visit=visit,
+                            defaults={"total_amount": 0, "is_insurance": True},
                         )
-                        test.status = "insurance"  # Mark test as covered by insurance
-                        test.save()
-
-                    invoice.total_amount += sum(test.price for test in covered_tests)
-                    invoice.save()
-
-                # Generate payment for uncovered tests
-                if uncovered_tests:
-                    payment = Payment.objects.create(
-                        visit=visit,
-                        amount=remaining_cost,
-                        status="pending",
-                    )
-                    for test in uncovered_tests:
-                        PaymentItem.objects.create(
-                            payment=payment,
-                            description=test.name,
-                            type="test",
-                            price=test.price,
+                        InvoiceItem.objects.bulk_create(
+                            InvoiceItem(invoice=invoice, item=test.item)
+                            for test in covered_tests
+                        )
+                        invoice.total_amount += sum(
+                            test.item.price for test in covered_tests
+                        )
+                        invoice.save()
+
+                    # Generate payment for uncovered tests
+                    if uncovered_tests:
+                        payment = Payment.objects.create(
+                            visit=visit,
+                            amount=remaining_cost,
+                            status="pending",
                         )
+                        PaymentItem.objects.bulk_create(
+                            PaymentItem(payment=payment, item=test.item)
+                            for test in uncovered_tests
+                        )
+
+                if payment is not None:
                     return Response(
                         {
                             "detail": "Payment generated successfully for uncovered tests.",
@@ -267,20 +294,15 @@ class GenerateTestPaymentView(APIView):
                 )
             else:
                 # Handle cash payment
-                payment = Payment.objects.create(
-                    visit=visit,
-                    amount=total_price,
-                    status="pending",
-                )
-                for test in tests:
-                    PaymentItem.objects.create(
-                        payment=payment,
-                        description=test.name,
-                        type="test",
-                        price=test.price,
+                with transaction.atomic():
+                    payment = Payment.objects.create(
+                        visit=visit,
+                        amount=total_price,
+                        status="pending",
+                    )
+                    PaymentItem.objects.bulk_create(
+                        PaymentItem(payment=payment, item=test.item) for test in tests
                     )
-                    test.status = "pending_payment"
-                    test.save()
 
                 return Response(
                     {
@@ -291,6 +313,8 @@ class GenerateTestPaymentView(APIView):
                     status=status.HTTP_200_OK,
                 )
 
+        except ConcurrentUpdate:
+            return concurrency.conflict()
         except Exception as e:
             return Response(
                 {"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -298,6 +322,8 @@ class GenerateTestPaymentView(APIView):
 
 
 class GeneratePrescriptionPaymentView(APIView):
+    idempotent = True
+
     def post(self, request):
         """
         Generate a payment for prescribed medicines, handling both cash and insurance patients.
@@ -322,16 +348,21 @@ class GeneratePrescriptionPaymentView(APIView):
                     {"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Fetch prescriptions for the visit
-            prescriptions = Prescription.objects.filter(visit=visit)
-            if not prescriptions.exists():
+            # Medicines are billed as their catalogue item, once; prescriptions
+            # without an item carry no price and are not billed
+            prescriptions = list(
+                _unbilled(
+                    Prescription.objects.filter(visit=visit, item__isnull=False)
+                ).select_related("item")
+            )
+            if not prescriptions:
                 return Response(
                     {"detail": "No prescriptions to generate payment."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
             # Calculate the total price for all prescriptions
-            total_price = sum(prescription.price for prescription in prescriptions)
+            total_price = sum(prescription.item.price for prescription in prescriptions)
 
             # Check if the patient has insurance
             is_insured = visit.patient.payment_method == "insurance"
@@ -344,44 +375,42 @@ class GeneratePrescriptionPaymentView(APIView):
 
                 # Classify prescriptions based on insurance coverage
                 for prescription in prescriptions:
-                    if insurance_coverage >= prescription.price:
+                    if insurance_coverage >= prescription.item.price:
                         covered_medicines.append(prescription)
-                        insurance_coverage -= prescription.price
+                        insurance_coverage -= prescription.item.price
                     else:
                         uncovered_medicines.append(prescription)
 
-                # Generate invoice for covered medicines
-                if covered_medicines:
-                    invoice, _ = Invoice.objects.get_or_create(
-                        visit=visit,
-                        defaults={"total_amount": 0, "is_insurance": True},
-                    )
-                    for prescription in covered_medicines:
-                        InvoiceItem.objects.create(
-                            invoice=invoice,
-                            description=f"Medicine: {prescription.medicine_name}",
-                            category="medicine",
-                            amount=prescription.price,
+                payment = None
+                with transaction.atomic():
+                    # Generate invoice for covered medicines
+                    if covered_medicines:
+                        invoice, _ = Invoice.objects.get_or_create(
+                            visit=visit,
+                            defaults={"total_amount": 0, "is_insurance": True},
                         )
-                    invoice.total_amount += sum(
-                        prescription.price for prescription in covered_medicines
-                    )
-                    invoice.save()
-
-                # Generate payment for uncovered medicines
-                if uncovered_medicines:
-                    payment = Payment.objects.create(
-                        visit=visit,
-                        amount=remaining_cost,
-                        status="pending",
-                    )
-                    for prescription in uncovered_medicines:
-                        PaymentItem.objects.create(
-                            payment=payment,
-                            description=f"Medicine: {prescription.medicine_name}",
-                            type="prescription",
-                            price=prescription.price,
+                        InvoiceItem.objects.bulk_create(
+                            InvoiceItem(invoice=invoice, item=prescription.item)
+                            for prescription in covered_medicines
                         )
+                        invoice.total_amount += sum(
+                            prescription.item.price for prescription in covered_medicines
+                        )
+                        invoice.save()
+
+                    # Generate payment for uncovered medicines
+                    if uncovered_medicines:
+                        payment = Payment.objects.create(
+                            visit=visit,
+                            amount=remaining_cost,
+                            status="pending",
+                        )
+                        PaymentItem.objects.bulk_create(
+                            PaymentItem(payment=payment, item=prescription.item)
+                            for prescription in uncovered_medicines
+                        )
+
+                if payment is not None:
                     return Response(
                         {
                             "detail": "Payment generated successfully for uncovered medicines.",
@@ -401,17 +430,15 @@ class GeneratePrescriptionPaymentView(APIView):
                 )
             else:
                 # Handle cash payment
-                payment = Payment.objects.create(
-                    visit=visit,
-                    amount=total_price,
-                    status="pending",
-                )
-                for prescription in prescriptions:
-                    PaymentItem.objects.create(
-                        payment=payment,
-                        description=f"Medicine: {prescription.medicine_name}",
-                        type="prescription",
-                        price=prescription.price,
+                with transaction.atomic():
+                    payment = Payment.objects.create(
+                        visit=visit,
+                        amount=total_price,
+                        status="pending",
+                    )
+                    PaymentItem.objects.bulk_create(
+                        PaymentItem(payment=payment, item=prescription.item)
+                        for prescription in prescriptions
                     )
 
                 return Response(
@@ -423,6 +450,8 @@ class GeneratePrescriptionPaymentView(APIView):
                     status=status.HTTP_200_OK,
                 )
 
+        except ConcurrentUpdate:
+            return concurrency.conflict()
         except Exception as e:
             return Response(
                 {"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -437,15 +466,13 @@ class CompletePaymentView(APIView):
     permission_classes = [IsCashier]
 
     def post(self, request, visit_id):
-        print(request.data)
         try:
             # Step 1: Validate input
             payment_id = request.data.get("payment_id")
             item_ids = request.data.get(
                 "item_ids", []
             )  # Expecting a list of payment item IDs
-            print("paymentId:", payment_id)
-            print("item ids:", item_ids)
+            logger.debug(f"Completing payment {payment_id} items {item_ids}")
 
             if not payment_id:
                 return Response(
@@ -462,6 +489,9 @@ class CompletePaymentView(APIView):
                     status=status.HTTP_404_NOT_FOUND,
                 )
 
+            if not concurrency.if_match(request, payment):
+                return concurrency.precondition_failed(payment)
+
             # Step 3: Check payment status
             if payment.status == "completed":
                 return Response(
@@ -471,9 +501,20 @@ class CompletePaymentView(APIView):
 
             # Step 4: Update provided paymentItems to "completed"
             with transaction.atomic():
-                updated_count = PaymentItem.objects.filter(
-                    id__in=item_ids, payment=payment
-                ).update(status="completed")
+                completed_ids = list(
+                    PaymentItem.objects.filter(
+                        id__in=item_ids, payment=payment, status="pending"
+                    ).values_list("id", flat=True)
+                )
+                updated_count = PaymentItem.objects.filter(id__in=completed_ids).update(
+                    status="completed",
+                    completed_at=timezone.now(),
+                    completed_by=request.user,
+                )
+                # queryset.update() skips model signals, so feed the rollups
+                # and drop the cached reports directly
+                rollups.record_revenue(PaymentItem.objects.filter(id__in=completed_ids))
+                reports.invalidate_reports()
 
                 # Step 5: Check if all paymentItems for this payment are completed
                 all_completed = not PaymentItem.objects.filter(
@@ -481,17 +522,23 @@ class CompletePaymentView(APIView):
                 ).exists()
 
                 if all_completed:
-                    payment.status = "completed"
-                    payment.save()
+                    # Fails (and rolls the items back) if another cashier
+                    # changed the payment since it was read above
+                    services.complete_payment(payment, request.user)
 
-            return Response(
-                {
-                    "detail": f"{updated_count} Payment Item(s) updated successfully.",
-                    "payment_status": "completed" if all_completed else "pending",
-                },
-                status=status.HTTP_200_OK,
+            return concurrency.with_etag(
+                Response(
+                    {
+                        "detail": f"{updated_count} Payment Item(s) updated successfully.",
+                        "payment_status": "completed" if all_completed else "pending",
+                    },
+                    status=status.HTTP_200_OK,
+                ),
+                payment,
             )
 
+        except ConcurrentUpdate:
+            return concurrency.conflict()
         except Exception as e:
             return Response(
                 {"detail": f"Error completing payment {payment_id}: {str(e)}"},
@@ -525,39 +572,26 @@ class SubmitToInsuranceView(APIView):
                     {"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Fetch all unpaid insurance-related invoices for the visit
-            invoices = Invoice.objects.filter(
-                visit=visit, is_insurance=True, is_paid=False
-            )
+            # Mark all unpaid insurance-related invoices for the visit as
+            # submitted (simulated: submission counts as payment)
+            invoice_ids = services.submit_insurance_invoices(visit)
 
-            if not invoices.exists():
+            if not invoice_ids:
                 return Response(
                     {"detail": "No pending insurance invoices found."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            # Simulate submission to the insurance provider
-            for invoice in invoices:
-                # Simulate an API call or submission process
-                logger.info(
-                    f"Submitting Invoice {invoice.id} for Visit {visit.id} to insurance provider."
-                )
-
-                # Mark invoice as paid after submission (simulate successful submission)
-                invoice.is_paid = True
-                invoice.save()
-
-                # Log the action
-                logger.info(
-                    f"Invoice {invoice.id} for Visit {visit.id} marked as paid."
-                )
+            logger.info(
+                f"Invoices {invoice_ids} for Visit {visit.id} submitted to insurance provider and marked as paid."
+            )
 
             # Return success response
             return Response(
                 {
                     "detail": "All pending insurance invoices submitted successfully.",
                     "visit_id": visit_id,
-                    "submitted_invoices": invoices.count(),
+                    "submitted_invoices": len(invoice_ids),
                 },
                 status=status.HTTP_200_OK,
             )
@@ -588,7 +622,12 @@ class VisitPaymentItemListView(generics.ListAPIView):
 
     def get_queryset(self):
         visit_id = self.kwargs.get("visit_id")
-        return PaymentItem.objects.filter(payment__visit_id=visit_id)
+        return get_data_scope(self.request).visits(
+            PaymentItemSerializer.eager_load(
+                PaymentItem.objects.filter(payment__visit_id=visit_id)
+            ),
+            "payment__visit",
+        )
 
 
 class VisitPaymentDetailView(generics.RetrieveAPIView):
@@ -606,9 +645,12 @@ class VisitPaymentDetailView(generics.RetrieveAPIView):
 
 class PaymentListView(APIView):
     # permission_classes = [IsCashier]
+    use_read_replica = True
 
     def get(self, request):
-        invoices = Payment.objects.all()
+        invoices = get_data_scope(request).visits(
+            PaymentSerializer.eager_load(Payment.objects.all()), "visit"
+        )
         serializer = PaymentSerializer(invoices, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -622,14 +664,18 @@ class PaymentDetailView(APIView):
     def get(self, request, pk):
         invoice = self.get_object(pk)
         serializer = PaymentSerializer(invoice)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return concurrency.with_etag(
+            Response(serializer.data, status=status.HTTP_200_OK), invoice
+        )
 
 
 class PaymentItemListView(APIView):
     # permission_classes = [IsCashier]
 
     def get(self, request):
-        invoices = PaymentItem.objects.all()
+        invoices = get_data_scope(request).visits(
+            PaymentItemSerializer.eager_load(PaymentItem.objects.all()), "payment__visit"
+        )
         serializer = PaymentItemSerializer(invoices, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -649,9 +695,12 @@ class PaymentItemDetailView(APIView):
 # Invoice Views
 class InvoiceListView(APIView):
     # permission_classes = [IsCashier]
+    use_read_replica = True
 
     def get(self, request):
-        invoices = Invoice.objects.all()
+        invoices = get_data_scope(request).visits(
+            InvoiceSerializer.eager_load(Invoice.objects.all()), "visit"
+        )
         serializer = InvoiceSerializer(invoices, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -672,14 +721,18 @@ class InvoiceDetailView(APIView):
     def get(self, request, pk):
         invoice = self.get_object(pk)
         serializer = InvoiceSerializer(invoice)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return concurrency.with_etag(
+            Response(serializer.data, status=status.HTTP_200_OK), invoice
+        )
 
 
 class InvoiceItemListView(APIView):
     # permission_classes = [IsCashier]
 
     def get(self, request):
-        invoices = InvoiceItem.objects.all()
+        invoices = get_data_scope(request).visits(
+            InvoiceItemSerializer.eager_load(InvoiceItem.objects.all()), "invoice__visit"
+        )
         serializer = InvoiceItemSerializer(invoices, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
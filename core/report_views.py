@@ -0,0 +1,145 @@
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from users.permissions import IsFinanceStaff
+from . import reports
+
+
+class ReportView(ABC, APIView):
+    """
+    Abstract base view for the financial reports, open to cashiers and
+    admins. Results are cached per parameter set; pass ``export=csv`` to
+    stream the rows as a CSV file instead of JSON.
+    """
+
+    use_read_replica = True
+    permission_classes = [IsFinanceStaff]
+    report_name = None
+    # Column order of the CSV export
+    columns = ()
+
+    @abstractmethod
+    def get_params(self, request):
+        """Return the report parameters or raise ValueError."""
+
+    @abstractmethod
+    def compute(self, **params):
+        """Return the report rows for the parameters get_params() returned."""
+
+    def get(self, request):
+        try:
+            params = self.get_params(request)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = reports.cached_report(
+            self.report_name, params, lambda: self.compute(**params)
+        )
+
+        if request.query_params.get("export") == "csv":
+            response = StreamingHttpResponse(
+                reports.stream_csv(rows, self.columns), content_type="text/csv"
+            )
+            response["Content-Disposition"] = (
+                f'attachment; filename="{self.report_name}.csv"'
+            )
+            return response
+
+        return Response({**params, "rows": rows}, status=status.HTTP_200_OK)
+
+    def get_date_range(self, request, default_days=30):
+        end = self.parse_date(request, "end") or timezone.localdate()
+        start = self.parse_date(request, "start") or end - timedelta(
+            days=default_days - 1
+        )
+        if start > end:
+            raise ValueError("start must not be after end.")
+        return {"start": start, "end": end}
+
+    @staticmethod
+    def parse_date(request, name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise ValueError(f"{name} must be a date in YYYY-MM-DD format.")
+        return parsed
+
+
+class RevenueReportView(ReportView):
+    """
+    Revenue by day, department and item type.
+    """
+
+    report_name = "revenue"
+    columns = (
+        "day",
+        "department",
+        "department_name",
+        "item_type",
+        "item_type_name",
+        "revenue",
+        "items",
+        "running_revenue",
+        "day_revenue",
+    )
+
+    def get_params(self, request):
+        return self.get_date_range(request)
+
+    def compute(self, start, end):
+        return reports.revenue_report(start, end)
+
+
+class ReceivablesAgingReportView(ReportView):
+    """
+    Aging of unpaid insurance invoices per insurance company.
+    """
+
+    report_name = "receivables-aging"
+    columns = (
+        "company",
+        "company_name",
+        "bucket",
+        "bucket_order",
+        "amount",
+        "invoices",
+        "company_outstanding",
+        "total_outstanding",
+    )
+
+    def get_params(self, request):
+        return {"as_of": self.parse_date(request, "as_of") or timezone.localdate()}
+
+    def compute(self, as_of):
+        return reports.receivables_aging_report(as_of)
+
+
+class CashierShiftReportView(ReportView):
+    """
+    Collections per cashier and shift.
+    """
+
+    report_name = "cashier-shifts"
+    columns = (
+        "shift_date",
+        "shift",
+        "cashier",
+        "cashier_email",
+        "amount",
+        "items",
+        "shift_total",
+        "shift_rank",
+    )
+
+    def get_params(self, request):
+        return self.get_date_range(request, default_days=7)
+
+    def compute(self, start, end):
+        return reports.cashier_shift_report(start, end)
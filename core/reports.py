@@ -0,0 +1,251 @@
+"""
+Financial reports computed in the database.
+
+Each report builds its grouped rows with the ORM and wraps that query in one
+outer SELECT carrying the window functions (running totals, shares, ranks),
+so every report is a single round trip. Django cannot put a window over an
+aggregate directly, which is why the outer query is written by hand; it only
+refers to the column aliases of the inner query and is portable across
+PostgreSQL and SQLite.
+
+Cached results are keyed on a version that invalidate_reports() replaces
+whenever payments, their items or invoices change, so a report never
+outlives the rows it was computed from.
+"""
+
+import csv
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import (
+    Case,
+    CharField,
+    Count,
+    DateField,
+    F,
+    IntegerField,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, ExtractHour, TruncDate
+from hms.caching import invalidate_views, namespace_version
+from .models import Invoice, PaymentItem
+
+CACHE_NAMESPACE = "reports"
+
+# (name, first hour, end hour) in local time; a shift may wrap past midnight
+DEFAULT_CASHIER_SHIFTS = [
+    ("morning", 6, 14),
+    ("evening", 14, 22),
+    ("night", 22, 6),
+]
+
+# (label, minimum age in days) ordered from newest to oldest
+AGING_BUCKETS = [
+    ("0-30", 0),
+    ("31-60", 31),
+    ("61-90", 61),
+    ("90+", 91),
+]
+
+
+def _run(queryset, select, order_by):
+    """
+    Execute ``SELECT <select> FROM (<queryset>) AS report ORDER BY <order_by>``
+    and return the rows as dicts.
+    """
+    inner, params = queryset.query.sql_with_params()
+    sql = f"SELECT {select} FROM ({inner}) AS report ORDER BY {order_by}"
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def cached_report(name, params, compute):
+    """
+    Return the cached result of ``compute()`` for this report and parameter
+    set, computing and storing it on a miss.
+    """
+    digest = hashlib.md5(
+        json.dumps(params, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    version = namespace_version(CACHE_NAMESPACE)
+    timeout = getattr(settings, "HMS_REPORT_CACHE_TIMEOUT", 300)
+    return cache.get_or_set(f"reports:{name}:{version}:{digest}", compute, timeout)
+
+
+def invalidate_reports():
+    """
+    Drop every cached report once the current transaction commits, so a
+    report computed meanwhile from the old rows is not cached as new.
+    """
+    transaction.on_commit(lambda: invalidate_views(CACHE_NAMESPACE))
+
+
+def revenue_report(start, end):
+    """
+    Revenue from collected payment items by day, department and item type,
+    with a running total per department/item type and the day's total.
+    """
+    rows = (
+        PaymentItem.objects.filter(
+            status="completed", payment__visit__deleted_at__isnull=True
+        )
+        .annotate(
+            collected_at=Coalesce("completed_at", "payment__created_at"),
+        )
+        .annotate(day=TruncDate("collected_at"))
+        .filter(day__gte=start, day__lte=end)
+        .annotate(
+            department=F("payment__visit__department"),
+            department_name=F("payment__visit__department__name"),
+            item_type=F("item__item_type"),
+            item_type_name=F("item__item_type__name"),
+        )
+        .values("day", "department", "department_name", "item_type", "item_type_name")
+        .annotate(revenue=Sum("item__price"), items=Count("id"))
+        .order_by()
+    )
+    return _run(
+        rows,
+        """
+        day, department, department_name, item_type, item_type_name, revenue, items,
+        SUM(revenue) OVER (
+            PARTITION BY department, item_type ORDER BY day
+            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        ) AS running_revenue,
+        SUM(revenue) OVER (PARTITION BY day) AS day_revenue
+        """,
+        "day, department_name, item_type_name",
+    )
+
+
+def receivables_aging_report(as_of):
+    """
+    Unpaid insurance invoices per insurance company split into age buckets,
+    with each company's outstanding total and the total across companies.
+    """
+    bucket_label = Case(
+        *[
+            When(created_at__date__lte=as_of - timedelta(days=days), then=Value(label))
+            for label, days in reversed(AGING_BUCKETS[1:])
+        ],
+        default=Value(AGING_BUCKETS[0][0]),
+        output_field=CharField(),
+    )
+    bucket_order = Case(
+        *[
+            When(created_at__date__lte=as_of - timedelta(days=days), then=Value(index))
+            for index, (_, days) in reversed(list(enumerate(AGING_BUCKETS))[1:])
+        ],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rows = (
+        Invoice.objects.filter(
+            is_paid=False,
+            is_insurance=True,
+            created_at__date__lte=as_of,
+            visit__deleted_at__isnull=True,
+        )
+        .annotate(
+            company=F("visit__patient__insurance__provider"),
+            company_name=F("visit__patient__insurance__provider__name"),
+            bucket=bucket_label,
+            bucket_order=bucket_order,
+        )
+        .values("company", "company_name", "bucket", "bucket_order")
+        .annotate(amount=Sum("total_amount"), invoices=Count("id"))
+        .order_by()
+    )
+    return _run(
+        rows,
+        """
+        company, company_name, bucket, bucket_order, amount, invoices,
+        SUM(amount) OVER (PARTITION BY company) AS company_outstanding,
+        SUM(amount) OVER () AS total_outstanding
+        """,
+        "company_outstanding DESC, company_name, bucket_order",
+    )
+
+
+def cashier_shift_report(start, end):
+    """
+    Collections per cashier and shift, ranked within each shift. Items
+    collected after midnight in a wrapping shift count towards the shift
+    that started the previous day.
+    """
+    shifts = getattr(settings, "HMS_CASHIER_SHIFTS", DEFAULT_CASHIER_SHIFTS)
+    shift_name = []
+    carry_over_hours = []
+    for name, first_hour, end_hour in shifts:
+        if first_hour < end_hour:
+            shift_name.append(
+                When(hour__gte=first_hour, hour__lt=end_hour, then=Value(name))
+            )
+        else:
+            shift_name.append(When(hour__gte=first_hour, then=Value(name)))
+            shift_name.append(When(hour__lt=end_hour, then=Value(name)))
+            carry_over_hours.append(end_hour)
+
+    shift_date = TruncDate("completed_at")
+    if carry_over_hours:
+        shift_date = Case(
+            When(
+                hour__lt=max(carry_over_hours),
+                then=TruncDate(F("completed_at") - timedelta(days=1)),
+            ),
+            default=TruncDate("completed_at"),
+            output_field=DateField(),
+        )
+
+    rows = (
+        PaymentItem.objects.filter(
+            status="completed",
+            completed_at__isnull=False,
+            payment__visit__deleted_at__isnull=True,
+        )
+        .annotate(hour=ExtractHour("completed_at"))
+        .annotate(
+            shift_date=shift_date,
+            shift=Case(*shift_name, default=Value("other"), output_field=CharField()),
+            cashier=F("completed_by"),
+            cashier_email=F("completed_by__email"),
+        )
+        .filter(shift_date__gte=start, shift_date__lte=end)
+        .values("shift_date", "shift", "cashier", "cashier_email")
+        .annotate(amount=Sum("item__price"), items=Count("id"))
+        .order_by()
+    )
+    return _run(
+        rows,
+        """
+        shift_date, shift, cashier, cashier_email, amount, items,
+        SUM(amount) OVER (PARTITION BY shift_date, shift) AS shift_total,
+        RANK() OVER (PARTITION BY shift_date, shift ORDER BY amount DESC) AS shift_rank
+        """,
+        "shift_date, shift, shift_rank, cashier_email",
+    )
+
+
+class Echo:
+    """A file-like object whose write() hands the value straight back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, columns):
+    """
+    Yield a CSV document for a list of report rows, one line at a time. The
+    header is written from ``columns`` even when there are no rows.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([row[column] for column in columns])
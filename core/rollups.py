@@ -0,0 +1,270 @@
+"""
+Incremental maintenance of the dashboard rollup tables.
+
+Each rollup row is keyed by day and department (plus a small set of extra
+dimensions) and holds counters that are adjusted with F() expressions, so a
+change to a visit, test or payment item touches a single row instead of
+re-aggregating the source tables. The same grouped queries used by the
+backfill command are reused for bulk changes made with queryset.update().
+
+Visits and their revenue are counted under the payment method stored on
+the visit when it was registered, so a patient gaining or losing insurance
+later moves nothing and every decrement hits the row the increment did.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from .models import (
+    ArchivedVisit,
+    PaymentItem,
+    RevenueRollup,
+    Test,
+    TestRollup,
+    Visit,
+    VisitRollup,
+)
+
+
+def bump(model, keys, **deltas):
+    """
+    Add ``deltas`` to the counters of the rollup row identified by ``keys``,
+    creating the row if it does not exist yet.
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    with transaction.atomic():
+        if model.objects.filter(**keys).update(**updates):
+            return
+        try:
+            with transaction.atomic():
+                model.objects.create(**keys, **deltas)
+        except IntegrityError:
+            # Another writer created the row between our UPDATE and INSERT
+            model.objects.filter(**keys).update(**updates)
+
+
+def visit_state(visit):
+    """The rollup key a visit currently counts towards (None once soft-deleted)."""
+    if visit.deleted_at is not None:
+        return None
+    return {
+        "date": visit.visit_date,
+        "department_id": visit.department_id,
+        "status": visit.status,
+        "payment_method": visit.payment_method,
+    }
+
+
+def record_visit_change(visit, previous_state=None, deleted=False):
+    """
+    Move a visit between VisitRollup rows. ``previous_state`` is the
+    visit_state() captured when the instance was loaded (None for new visits).
+    """
+    current_state = None if deleted else visit_state(visit)
+    if previous_state == current_state:
+        return
+
+    if previous_state is not None:
+        bump(VisitRollup, previous_state, visits=-1)
+    if current_state is not None:
+        bump(VisitRollup, current_state, visits=1)
+
+
+def record_visit_transitions(visits, status):
+    """
+    Move the visits of a queryset to ``status`` in the rollups, ahead of a
+    bulk queryset.update() of their status. One grouped query, then one
+    pair of bumps per rollup row affected.
+    """
+    rows = (
+        visits.filter(deleted_at__isnull=True)
+        .exclude(status=status)
+        .values("visit_date", "department", "status", "payment_method")
+        .annotate(visits=Count("id"))
+        .order_by()
+    )
+    for row in rows:
+        keys = {
+            "date": row["visit_date"],
+            "department_id": row["department"],
+            "payment_method": row["payment_method"],
+        }
+        bump(VisitRollup, {**keys, "status": row["status"]}, visits=-row["visits"])
+        bump(VisitRollup, {**keys, "status": status}, visits=row["visits"])
+
+
+def record_test_change(test, delta):
+    """Count a created (``delta=1``) or deleted (``delta=-1``) test."""
+    item_type_id = test.item.item_type_id if test.item_id else None
+    bump(
+        TestRollup,
+        {
+            "date": test.visit.visit_date,
+            "department_id": test.visit.department_id,
+            "item_type_id": item_type_id,
+        },
+        tests=delta,
+    )
+
+
+def revenue_rows(payment_items):
+    """
+    Group completed payment items by rollup key in a single query.
+    """
+    return (
+        payment_items.values(
+            "payment__visit__visit_date",
+            "payment__visit__department",
+            "item__item_type",
+            "payment__visit__payment_method",
+        )
+        .annotate(amount=Sum("item__price"), items=Count("id"))
+        .order_by()
+    )
+
+
+def record_revenue(payment_items, sign=1):
+    """
+    Add newly completed payment items (a queryset) to the revenue rollups,
+    or with ``sign=-1`` take back items that stopped counting.
+    """
+    for row in revenue_rows(payment_items):
+        bump(
+            RevenueRollup,
+            {
+                "date": row["payment__visit__visit_date"],
+                "department_id": row["payment__visit__department"],
+                "item_type_id": row["item__item_type"],
+                "payment_method": row["payment__visit__payment_method"],
+            },
+            amount=sign * (row["amount"] or 0),
+            items=sign * row["items"],
+        )
+
+
+def archived_counts(visit):
+    """
+    What ``visit`` adds to the test and revenue rollups, in the shape
+    ArchivedVisit.rollup keeps it so rebuild() can still count the visit
+    once it is archived. Reads the tests and payment items (with their
+    items) that archive.graph_queryset() prefetches.
+    """
+    tests = defaultdict(int)
+    for test in visit.tests.all():
+        tests[test.item.item_type_id if test.item else None] += 1
+    revenue = defaultdict(lambda: [Decimal(0), 0])
+    for payment in visit.payment_set.all():
+        for item in payment.items.all():
+            if item.status == "completed":
+                totals = revenue[item.item.item_type_id if item.item else None]
+                totals[0] += item.item.price if item.item else 0
+                totals[1] += 1
+    return {
+        "tests": [[item_type, n] for item_type, n in tests.items()],
+        "revenue": [[item_type, amount, n] for item_type, (amount, n) in revenue.items()],
+    }
+
+
+def rebuild(start=None, end=None):
+    """
+    Recompute all rollups for visit dates in [start, end] from the source
+    tables and the archived visits. Returns the number of rollup rows
+    written per table.
+    """
+    date_range = {}
+    if start:
+        date_range["gte"] = start
+    if end:
+        date_range["lte"] = end
+
+    def in_range(queryset, field):
+        return queryset.filter(
+            **{f"{field}__{lookup}": value for lookup, value in date_range.items()}
+        )
+
+    visits = defaultdict(int)
+    for row in (
+        in_range(Visit.objects.all(), "visit_date")
+        .values("visit_date", "department", "status", "payment_method")
+        .annotate(visits=Count("id"))
+        .order_by()
+    ):
+        key = (row["visit_date"], row["department"], row["status"], row["payment_method"])
+        visits[key] += row["visits"]
+
+    tests = defaultdict(int)
+    for row in (
+        in_range(Test.objects.all(), "visit__visit_date")
+        .values("visit__visit_date", "visit__department", "item__item_type")
+        .annotate(tests=Count("id"))
+        .order_by()
+    ):
+        key = (row["visit__visit_date"], row["visit__department"], row["item__item_type"])
+        tests[key] += row["tests"]
+
+    revenue = defaultdict(lambda: [Decimal(0), 0])
+    for row in revenue_rows(
+        in_range(PaymentItem.objects.filter(status="completed"), "payment__visit__visit_date")
+    ):
+        totals = revenue[
+            (
+                row["payment__visit__visit_date"],
+                row["payment__visit__department"],
+                row["item__item_type"],
+                row["payment__visit__payment_method"],
+            )
+        ]
+        totals[0] += row["amount"] or 0
+        totals[1] += row["items"]
+
+    # Archived visits left the tables above but still happened
+    archived = in_range(ArchivedVisit.objects.all(), "visit_date").values_list(
+        "visit_date", "department", "payment_method", "rollup"
+    )
+    for day, department, payment_method, counts in archived.iterator():
+        visits[(day, department, "completed", payment_method)] += 1
+        for item_type, n in counts.get("tests", []):
+            tests[(day, department, item_type)] += n
+        for item_type, amount, n in counts.get("revenue", []):
+            totals = revenue[(day, department, item_type, payment_method)]
+            totals[0] += Decimal(amount)
+            totals[1] += n
+
+    with transaction.atomic():
+        for model in (VisitRollup, TestRollup, RevenueRollup):
+            in_range(model.objects.all(), "date").delete()
+
+        counts = {}
+        counts["visits"] = len(
+            VisitRollup.objects.bulk_create(
+                VisitRollup(
+                    date=day,
+                    department_id=department,
+                    status=status,
+                    payment_method=payment_method,
+                    visits=n,
+                )
+                for (day, department, status, payment_method), n in visits.items()
+            )
+        )
+        counts["tests"] = len(
+            TestRollup.objects.bulk_create(
+                TestRollup(date=day, department_id=department, item_type_id=item_type, tests=n)
+                for (day, department, item_type), n in tests.items()
+            )
+        )
+        counts["revenue"] = len(
+            RevenueRollup.objects.bulk_create(
+                RevenueRollup(
+                    date=day,
+                    department_id=department,
+                    item_type_id=item_type,
+                    payment_method=payment_method,
+                    amount=amount,
+                    items=n,
+                )
+                for (day, department, item_type, payment_method), (amount, n) in revenue.items()
+            )
+        )
+    return counts
@@ -1,4 +1,7 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Prefetch
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from users.models import Department, CustomUser as User
 from users.serializers import DepartmentSerializer, UserSerializer
 from .models import (
@@ -17,6 +20,8 @@ from .models import (
     Insurance,
     ItemType,
     VisitComment,
+    StateTransition,
+    parse_blood_pressure,
 )
 
 
@@ -62,6 +67,13 @@ class HospitalItemSerializer(serializers.ModelSerializer):
             "updated_at",
         ]
 
+    @staticmethod
+    def eager_load(queryset, prefix=""):
+        """Fetch the nested item type and insurance companies up front."""
+        return queryset.select_related(f"{prefix}item_type").prefetch_related(
+            f"{prefix}insurance_companies"
+        )
+
     def update(self, instance, validated_data):
         insurance_company_ids = validated_data.pop("insurance_company_ids", None)
         item_type_id = validated_data.pop("item_type_id", None)
@@ -100,6 +112,14 @@ class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = "__all__"
+        # Deleting goes through soft_delete(), which also stamps deleted_at
+        read_only_fields = ["is_active", "deleted_at"]
+        # Soft-deleted patients still hold their phone number
+        extra_kwargs = {
+            "phone": {
+                "validators": [UniqueValidator(queryset=Patient.all_objects.all())]
+            }
+        }
 
 
 class InsuranceSerializer(serializers.ModelSerializer):
@@ -155,7 +175,18 @@ class VisitSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             "patient": {"write_only": True},  # Ensure patient ID is accepted in input
         }
-        read_only_fields = ["visit_date"]
+        # Status (and is_active, which follows it) only moves through
+        # core.state_machine; deleting goes through soft_delete()
+        read_only_fields = ["visit_date", "status", "is_active", "deleted_at"]
+
+    @staticmethod
+    def eager_load(queryset, prefix=""):
+        """Join the nested department, doctor (and their department) and patient."""
+        return queryset.select_related(
+            f"{prefix}department",
+            f"{prefix}assigned_doctor__department",
+            f"{prefix}patient",
+        )
 
 
 class VisitCommentSerializer(serializers.ModelSerializer):
@@ -185,10 +216,29 @@ class VisitCommentSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class VitalListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        """Insert a batch of vitals with a single bulk_create."""
+        vitals = [Vital(**item) for item in validated_data]
+        for vital in vitals:
+            vital.patient_id = vital.visit.patient_id
+            vital.populate_derived_fields()
+        return Vital.objects.bulk_create(vitals)
+
+
 class VitalSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vital
         fields = "__all__"
+        read_only_fields = ["patient", "systolic", "diastolic"]
+        list_serializer_class = VitalListSerializer
+
+    def validate_blood_pressure(self, value):
+        try:
+            parse_blood_pressure(value)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return value
 
 
 class MedicalHistorySerializer(serializers.ModelSerializer):
@@ -206,12 +256,18 @@ class TestSerializer(serializers.ModelSerializer):
     class Meta:
         model = Test
         fields = ["id", "visit", "item", "item_id", "status"]
+        read_only_fields = ["status"]  # Moved by core.state_machine.TEST
+
+    @staticmethod
+    def eager_load(queryset):
+        return HospitalItemSerializer.eager_load(queryset, "item__")
 
 
 class PrescriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Prescription
         fields = "__all__"
+        read_only_fields = ["status"]  # Moved by core.state_machine.PRESCRIPTION
 
 
 class PaymentItemSerializer(serializers.ModelSerializer):
@@ -233,6 +289,10 @@ class PaymentItemSerializer(serializers.ModelSerializer):
             "status",
         ]
 
+    @staticmethod
+    def eager_load(queryset, prefix=""):
+        return queryset.select_related(f"{prefix}item__item_type")
+
 
 class PaymentSerializer(serializers.ModelSerializer):
     items = PaymentItemSerializer(many=True, read_only=True)
@@ -247,9 +307,16 @@ class PaymentSerializer(serializers.ModelSerializer):
             "amount",
             "status",
             "created_at",
+            "version",
             "items",
         ]
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related("visit").prefetch_related(
+            Prefetch("items", PaymentItemSerializer.eager_load(PaymentItem.objects.all()))
+        )
+
 
 class InvoiceSerializer(serializers.ModelSerializer):
     visit = VisitSerializer(read_only=True)
@@ -261,6 +328,10 @@ class InvoiceSerializer(serializers.ModelSerializer):
         model = Invoice
         fields = "__all__"
 
+    @staticmethod
+    def eager_load(queryset):
+        return VisitSerializer.eager_load(queryset, "visit__")
+
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
     item = HospitalItemSerializer(read_only=True)
@@ -271,3 +342,34 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = InvoiceItem
         fields = ["id", "invoice", "item", "item_id"]
+
+    @staticmethod
+    def eager_load(queryset):
+        return HospitalItemSerializer.eager_load(queryset, "item__")
+
+
+class StateTransitionSerializer(serializers.ModelSerializer):
+    user_email = serializers.EmailField(source="user.email", read_only=True)
+
+    class Meta:
+        model = StateTransition
+        fields = [
+            "id",
+            "from_state",
+            "to_state",
+            "user",
+            "user_email",
+            "reason",
+            "created_at",
+        ]
+
+
+class VisitBulkTransitionSerializer(serializers.Serializer):
+    visit_ids = serializers.ListField(child=serializers.IntegerField(min_value=1))
+    status = serializers.CharField()
+    reason = serializers.CharField(
+        max_length=StateTransition._meta.get_field("reason").max_length,
+        required=False,
+        allow_blank=True,
+        default="",
+    )
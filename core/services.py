@@ -0,0 +1,106 @@
+"""
+State transitions of the clinical workflow.
+
+Each transition goes through the workflow declared in core.state_machine,
+which refuses moves the workflow does not allow, writes only the columns
+involved (one UPDATE of the table per transition, however many rows) and
+records the move in StateTransition.
+
+Once the surrounding transaction commits, each transition sends a domain
+event so other parts of the system can react without the views knowing
+about them.
+"""
+
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal
+from . import reports
+from .models import Invoice, Prescription, TestResult
+from .state_machine import PAYMENT, PRESCRIPTION, TEST, VISIT
+
+# sender is the model class; receivers also get the instance(s) involved
+doctor_assigned = Signal()  # visit
+visit_completed = Signal()  # visit
+test_result_recorded = Signal()  # test, result
+prescriptions_dispensed = Signal()  # visit, prescription_ids
+insurance_invoices_submitted = Signal()  # visit, invoice_ids
+payment_completed = Signal()  # payment
+
+
+def _send_on_commit(signal, sender, **kwargs):
+    transaction.on_commit(lambda: signal.send(sender=sender, **kwargs))
+
+
+def assign_doctor(visit, doctor, department, user=None):
+    VISIT.transition(
+        visit, "onprogress", user, assigned_doctor=doctor, department=department
+    )
+    _send_on_commit(doctor_assigned, type(visit), visit=visit)
+
+
+def complete_visit(visit, user=None):
+    VISIT.transition(visit, "completed", user)
+    _send_on_commit(visit_completed, type(visit), visit=visit)
+
+
+def record_test_result(test, result_details, user=None):
+    """Store the result and move the test from pending to completed."""
+    with transaction.atomic():
+        TEST.transition(test, "completed", user)
+        result = TestResult.objects.create(test=test, result_details=result_details)
+    _send_on_commit(test_result_recorded, type(test), test=test, result=result)
+    return result
+
+
+def complete_payment(payment, user=None):
+    PAYMENT.transition(payment, "completed", user)
+    _send_on_commit(payment_completed, type(payment), payment=payment)
+
+
+def dispense_prescriptions(visit, user=None):
+    """
+    Mark the visit's pending prescriptions dispensed. Returns the medicine
+    names dispensed now and those dispensed before.
+    """
+    with transaction.atomic():
+        prescriptions = list(
+            Prescription.objects.filter(visit=visit).values_list(
+                "pk", "medicine_name", "status"
+            )
+        )
+        pending_ids = [pk for pk, _, state in prescriptions if state == "pending"]
+        if pending_ids:
+            PRESCRIPTION.bulk_transition(
+                Prescription.objects.filter(pk__in=pending_ids), "dispensed", user
+            )
+            _send_on_commit(
+                prescriptions_dispensed,
+                Prescription,
+                visit=visit,
+                prescription_ids=pending_ids,
+            )
+    dispensed = [name for _, name, state in prescriptions if state == "pending"]
+    already = [name for _, name, state in prescriptions if state == "dispensed"]
+    return dispensed, already
+
+
+def submit_insurance_invoices(visit):
+    """Mark the visit's open insurance invoices paid; returns their ids."""
+    with transaction.atomic():
+        open_invoices = Invoice.objects.filter(
+            visit=visit, is_insurance=True, is_paid=False
+        )
+        invoice_ids = list(open_invoices.values_list("pk", flat=True))
+        if invoice_ids:
+            # queryset.update() bypasses VersionedModel.save(), so bump here
+            Invoice.objects.filter(pk__in=invoice_ids, is_paid=False).update(
+                is_paid=True, version=F("version") + 1
+            )
+            reports.invalidate_reports()
+            _send_on_commit(
+                insurance_invoices_submitted,
+                Invoice,
+                visit=visit,
+                invoice_ids=invoice_ids,
+            )
+    return invoice_ids
@@ -0,0 +1,198 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from hms import audit
+from hms.caching import invalidate_views
+from . import archive, reports, rollups
+from .models import (
+    HospitalItem,
+    Insurance,
+    InsuranceCompany,
+    Invoice,
+    ItemType,
+    MedicalHistory,
+    Patient,
+    Payment,
+    PaymentItem,
+    Prescription,
+    Test,
+    Visit,
+)
+
+
+# --- Dashboard rollups ---
+
+
+ROLLUP_VISIT_FIELDS = {
+    "visit_date",
+    "department_id",
+    "status",
+    "payment_method",
+    "deleted_at",
+}
+
+
+@receiver(post_init, sender=Visit)
+def remember_visit_state(sender, instance, **kwargs):
+    # Snapshot the rollup key as loaded so post_save can tell what moved.
+    # Instances loaded with deferred fields are left untracked rather than
+    # triggering a refresh query here.
+    if instance.pk and ROLLUP_VISIT_FIELDS <= instance.__dict__.keys():
+        instance._rollup_state = rollups.visit_state(instance)
+    else:
+        instance._rollup_state = None
+
+
+@receiver(post_save, sender=Visit)
+def update_visit_rollup(sender, instance, created, **kwargs):
+    if kwargs.get("raw"):
+        return
+    if created:
+        rollups.record_visit_change(instance)
+    elif instance._rollup_state is not None:
+        rollups.record_visit_change(instance, instance._rollup_state)
+    instance._rollup_state = rollups.visit_state(instance)
+
+
+@receiver(post_delete, sender=Visit)
+def remove_visit_from_rollup(sender, instance, **kwargs):
+    # Archived visits still happened; their counts stay in the rollups
+    if archive.in_progress():
+        return
+    if instance._rollup_state is not None:
+        rollups.record_visit_change(instance, instance._rollup_state, deleted=True)
+
+
+@receiver(post_save, sender=Test)
+def update_test_rollup(sender, instance, created, **kwargs):
+    if created and not kwargs.get("raw"):
+        rollups.record_test_change(instance, 1)
+
+
+@receiver(post_delete, sender=Test)
+def remove_test_from_rollup(sender, instance, **kwargs):
+    if not archive.in_progress():
+        rollups.record_test_change(instance, -1)
+
+
+@receiver(post_init, sender=PaymentItem)
+def remember_payment_item_status(sender, instance, **kwargs):
+    instance._rollup_status = instance.__dict__.get("status") if instance.pk else None
+
+
+@receiver(post_save, sender=PaymentItem)
+def update_revenue_rollup(sender, instance, created, **kwargs):
+    if kwargs.get("raw"):
+        return
+    was_completed = instance._rollup_status == "completed"
+    if (instance.status == "completed") != was_completed:
+        rollups.record_revenue(
+            PaymentItem.objects.filter(pk=instance.pk), -1 if was_completed else 1
+        )
+    instance._rollup_status = instance.status
+
+
+@receiver(pre_delete, sender=PaymentItem)
+def remove_revenue_from_rollup(sender, instance, **kwargs):
+    # pre_delete, while the row (and its visit) can still be grouped
+    if instance.status == "completed" and not archive.in_progress():
+        rollups.record_revenue(PaymentItem.objects.filter(pk=instance.pk), -1)
+
+
+# --- Cached reference views ---
+
+
+# Hospital items embed their item type and insurance companies
+CACHED_VIEWS = {
+    HospitalItem: ("hospital-items",),
+    ItemType: ("item-types", "hospital-items"),
+    InsuranceCompany: ("insurance-companies", "hospital-items"),
+}
+
+
+@receiver(post_save, sender=HospitalItem)
+@receiver(post_save, sender=ItemType)
+@receiver(post_save, sender=InsuranceCompany)
+@receiver(post_delete, sender=HospitalItem)
+@receiver(post_delete, sender=ItemType)
+@receiver(post_delete, sender=InsuranceCompany)
+def drop_cached_views(sender, **kwargs):
+    invalidate_views(*CACHED_VIEWS[sender])
+
+
+@receiver(m2m_changed, sender=HospitalItem.insurance_companies.through)
+def drop_cached_hospital_items(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_views("hospital-items")
+
+
+# --- Cached financial reports ---
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=PaymentItem)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Insurance)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=PaymentItem)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Insurance)
+def drop_cached_reports(sender, **kwargs):
+    # Insurance decides which company a receivable is aged under
+    reports.invalidate_reports()
+
+
+@receiver(post_save, sender=Visit)
+def drop_reports_of_deleted_visit(sender, instance, update_fields=None, **kwargs):
+    # Reports leave out soft-deleted visits and their billing
+    if update_fields and "deleted_at" in update_fields:
+        reports.invalidate_reports()
+
+
+# --- Audit trail ---
+
+
+@receiver(post_init, sender=Patient)
+@receiver(post_init, sender=MedicalHistory)
+@receiver(post_init, sender=Prescription)
+@receiver(post_init, sender=Payment)
+@receiver(post_init, sender=get_user_model())
+def remember_audited_values(sender, instance, **kwargs):
+    instance._audit_values = audit.snapshot(instance) if instance.pk else {}
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalHistory)
+@receiver(post_save, sender=Prescription)
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=get_user_model())
+def audit_save(sender, instance, created, update_fields=None, **kwargs):
+    if kwargs.get("raw"):
+        return
+    before = {} if created else instance._audit_values
+    changes = audit.diff(instance, before, update_fields)
+    if changes or created:
+        audit.record(instance, "create" if created else "update", changes)
+    instance._audit_values = audit.snapshot(instance)
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalHistory)
+@receiver(post_delete, sender=Prescription)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=get_user_model())
+def audit_delete(sender, instance, **kwargs):
+    # Archiving moves visit graphs to cold storage; nothing is lost
+    if archive.in_progress():
+        return
+    audit.record(
+        instance,
+        "delete",
+        {name: [value, None] for name, value in instance._audit_values.items()},
+    )
@@ -0,0 +1,245 @@
+"""
+Declared status workflows of visits, tests, prescriptions and payments.
+
+Each StateMachine lists which status may follow which; every other change
+is refused with InvalidTransition, and every accepted one is written to
+StateTransition. States are checked against the field's choices when the
+module loads, so a workflow cannot drift from the model.
+
+transition() moves one instance and writes only the columns involved.
+bulk_transition() moves a whole queryset with one INSERT ... SELECT for the
+history (and one for the audit trail of audited models) and one UPDATE for
+the rows, however many rows there are.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils.timezone import now
+from hms import audit
+from . import rollups
+from .concurrency import VersionedModel
+from .models import AuditLog, Payment, Prescription, StateTransition, Test, Visit
+
+
+class InvalidTransition(Exception):
+    """The object is not in a state the requested transition starts from."""
+
+
+class StateMachine:
+    def __init__(
+        self, model, transitions, field="status", on_enter=None, before_bulk_update=None
+    ):
+        """
+        ``transitions`` maps each state to the states it may move to.
+        ``on_enter`` maps a state to other field values set on entering it.
+        ``before_bulk_update(queryset, target)`` runs ahead of a bulk UPDATE,
+        for the bookkeeping model signals would otherwise have done.
+        """
+        self.model = model
+        self.field = field
+        self.transitions = {state: frozenset(targets) for state, targets in transitions.items()}
+        self.on_enter = on_enter or {}
+        self.before_bulk_update = before_bulk_update
+
+        choices = {value for value, _ in model._meta.get_field(field).choices}
+        declared = set(self.transitions).union(*self.transitions.values())
+        if declared - choices:
+            raise ImproperlyConfigured(
+                f"{model.__name__}.{field} has no choice for {sorted(declared - choices)}."
+            )
+
+    def sources(self, target):
+        """States that may move to ``target``."""
+        return {state for state, targets in self.transitions.items() if target in targets}
+
+    def check(self, source, target):
+        if target not in self.transitions.get(source, ()):
+            raise InvalidTransition(
+                f"{self.model._meta.verbose_name.capitalize()} cannot go from "
+                f"{source!r} to {target!r}."
+            )
+
+    def changes(self, target, changes):
+        return {**self.on_enter.get(target, {}), **changes, self.field: target}
+
+    def transition(self, instance, target, user=None, reason="", **changes):
+        """
+        Move ``instance`` to ``target``, also setting ``changes``. Versioned
+        models are saved with update_fields (their version guards against a
+        concurrent change and their signals run); the others are moved with
+        an UPDATE guarded on the status they were read in, and audited here.
+        """
+        source = getattr(instance, self.field)
+        self.check(source, target)
+        changes = self.changes(target, changes)
+
+        with transaction.atomic():
+            if isinstance(instance, VersionedModel):
+                for name, value in changes.items():
+                    setattr(instance, name, value)
+                instance.save(update_fields=list(changes))
+            else:
+                moved = self.model._base_manager.filter(
+                    pk=instance.pk, **{self.field: source}
+                ).update(**changes)
+                if not moved:
+                    raise InvalidTransition(
+                        f"{self.model._meta.verbose_name.capitalize()} {instance.pk} "
+                        f"is no longer {source!r}."
+                    )
+                for name, value in changes.items():
+                    setattr(instance, name, value)
+                if self.model in audit.AUDITED_MODELS:
+                    audit.record_update(
+                        instance, list(changes), getattr(user, "pk", None)
+                    )
+            StateTransition.objects.create(
+                content_type=ContentType.objects.get_for_model(self.model),
+                object_id=instance.pk,
+                from_state=source,
+                to_state=target,
+                user_id=getattr(user, "pk", None),
+                reason=reason,
+            )
+
+    def bulk_transition(self, queryset, target, user=None, reason="", **changes):
+        """
+        Move every row of ``queryset`` that may go to ``target`` there, in
+        set-based SQL. Rows in other states are left alone. Model save()
+        and its signals are bypassed. Returns the number of rows moved.
+        """
+        sources = self.sources(target)
+        if not sources:
+            raise InvalidTransition(
+                f"No {self.model._meta.verbose_name} state may move to {target!r}."
+            )
+        rows = queryset.filter(**{f"{self.field}__in": sources})
+        changes = self.changes(target, changes)
+        if issubclass(self.model, VersionedModel):
+            changes["version"] = F("version") + 1
+
+        using = router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            if self.before_bulk_update:
+                self.before_bulk_update(rows, target)
+            self.record_bulk(rows, target, getattr(user, "pk", None), reason, using)
+            if self.model in audit.AUDITED_MODELS:
+                self.audit_bulk(rows, target, getattr(user, "pk", None), using)
+            return rows.using(using).update(**changes)
+
+    def _ids_sql(self, rows, using):
+        return rows.values("pk").query.get_compiler(using=using).as_sql()
+
+    def record_bulk(self, rows, target, user_id, reason, using):
+        """INSERT ... SELECT one StateTransition per row of ``rows``."""
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        ids_sql, ids_params = self._ids_sql(rows, using)
+        opts = self.model._meta
+        history = StateTransition._meta
+        created_at = history.get_field("created_at").get_db_prep_value(
+            now(), connection
+        )
+        columns = ", ".join(
+            qn(history.get_field(name).column)
+            for name in (
+                "content_type",
+                "object_id",
+                "from_state",
+                "to_state",
+                "user",
+                "reason",
+                "created_at",
+            )
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {qn(history.db_table)} ({columns}) "
+                f"SELECT %s, {qn(opts.pk.column)}, {qn(opts.get_field(self.field).column)}, "
+                f"%s, %s, %s, %s FROM {qn(opts.db_table)} "
+                f"WHERE {qn(opts.pk.column)} IN ({ids_sql})",
+                [
+                    ContentType.objects.db_manager(using).get_for_model(self.model).pk,
+                    target,
+                    user_id,
+                    reason,
+                    created_at,
+                    *ids_params,
+                ],
+            )
+
+    def audit_bulk(self, rows, target, user_id, using):
+        """
+        INSERT ... SELECT one AuditLog "update" per row of ``rows``, with the
+        status move as its changes. Unlike entries from model signals these
+        are written with the rows, in the same transaction.
+        """
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        ids_sql, ids_params = self._ids_sql(rows, using)
+        opts = self.model._meta
+        log = AuditLog._meta
+        changes_field = log.get_field("changes")
+        status_column = qn(opts.get_field(self.field).column)
+        sources = sorted(self.sources(target))
+        columns = ", ".join(
+            qn(log.get_field(name).column)
+            for name in (
+                "content_type",
+                "object_id",
+                "action",
+                "changes",
+                "actor",
+                "created_at",
+            )
+        )
+        # Each source state carries its own {field: [source, target]}
+        changes_sql = "CASE {} {} END".format(
+            status_column, " ".join("WHEN %s THEN %s" for _ in sources)
+        )
+        changes_params = []
+        for source in sources:
+            changes_params += [
+                source,
+                changes_field.get_db_prep_value(
+                    {self.field: [source, target]}, connection
+                ),
+            ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {qn(log.db_table)} ({columns}) "
+                f"SELECT %s, {qn(opts.pk.column)}, %s, {changes_sql}, %s, %s "
+                f"FROM {qn(opts.db_table)} "
+                f"WHERE {qn(opts.pk.column)} IN ({ids_sql})",
+                [
+                    ContentType.objects.db_manager(using).get_for_model(self.model).pk,
+                    "update",
+                    *changes_params,
+                    user_id if user_id is not None else audit.current_actor_id(),
+                    log.get_field("created_at").get_db_prep_value(now(), connection),
+                    *ids_params,
+                ],
+            )
+
+
+VISIT = StateMachine(
+    Visit,
+    {
+        # onprogress -> onprogress is a doctor being reassigned
+        "pending": {"onprogress", "completed"},
+        "onprogress": {"onprogress", "completed"},
+        "completed": set(),
+    },
+    on_enter={"completed": {"is_active": False}},
+    before_bulk_update=rollups.record_visit_transitions,
+)
+
+TEST = StateMachine(Test, {"pending": {"completed"}, "completed": set()})
+
+PRESCRIPTION = StateMachine(
+    Prescription, {"pending": {"dispensed"}, "dispensed": set()}
+)
+
+PAYMENT = StateMachine(Payment, {"pending": {"completed"}, "completed": set()})
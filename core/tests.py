@@ -1,3 +1,1766 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, time, timedelta
+from unittest import mock, skipUnless
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+from hms import audit, db_routers, metrics, profiling
+from hms.middleware import QueryBudgetExceeded, ReplicaRoutingMiddleware
+from hms.testing import QueryBudgetMixin
+from users.models import CustomUser as User, Department
+from . import partitions, rollups, services, state_machine
+from .concurrency import ConcurrentUpdate, VersionedModel
+from .models import (
+    ArchivedVisit,
+    AuditLog,
+    HospitalItem,
+    IdempotencyKey,
+    Insurance,
+    InsuranceCompany,
+    Invoice,
+    InvoiceItem,
+    ItemType,
+    MedicalHistory,
+    Patient,
+    Payment,
+    PaymentItem,
+    Prescription,
+    RevenueRollup,
+    StateTransition,
+    Test,
+    TestRollup,
+    Visit,
+    VisitRollup,
+    Vital,
+    parse_blood_pressure,
+)
+from .report_views import ReportView
+from .serializers import PrescriptionSerializer, TestSerializer
 
-# Create your tests here.
+
+def create_patient(**kwargs):
+    defaults = {
+        "first_name": "Amina",
+        "last_name": "Juma",
+        "date_of_birth": date(1990, 1, 1),
+        "phone": f"0700{Patient.objects.count():06d}",
+        "address": "Dar es Salaam",
+    }
+    defaults.update(kwargs)
+    return Patient.objects.create(**defaults)
+
+
+# Audit entries are written as their transaction commits, on the test's own
+# connection, rather than by the writer thread outside the test transaction
+@override_settings(HMS_AUDIT_ASYNC=False)
+class APITestCase(QueryBudgetMixin, TestCase):
+    role = "nurse"
+
+    def setUp(self):
+        super().setUp()
+        self.department = Department.objects.create(name="General", short_name="GEN")
+        self.user = User.objects.create_user(
+            email=f"{self.role}@hms.test",
+            password="secret",
+            role=self.role,
+            department=self.department,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class BloodPressureParsingTests(TestCase):
+    def test_parses_systolic_and_diastolic(self):
+        self.assertEqual(parse_blood_pressure("120/80"), (120, 80))
+        self.assertEqual(parse_blood_pressure(" 135 / 85 "), (135, 85))
+        self.assertEqual(parse_blood_pressure(None), (None, None))
+
+    def test_rejects_malformed_readings(self):
+        for value in ("120", "abc/80", "80/120", "120/80/60"):
+            with self.assertRaises(ValidationError):
+                parse_blood_pressure(value)
+
+
+class VitalAPITests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient()
+        self.visit = Visit.objects.create(patient=self.patient)
+
+    def test_batch_submission_stores_parsed_readings(self):
+        payload = [
+            {"visit": self.visit.id, "blood_pressure": "120/80", "weight": "70.50"},
+            {"visit": self.visit.id, "blood_pressure": "130/85", "temperature": "37.2"},
+        ]
+        response = self.client.post(reverse("vital-batch"), payload, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        vitals = Vital.objects.order_by("systolic")
+        self.assertEqual(
+            [(v.patient_id, v.systolic, v.diastolic) for v in vitals],
+            [(self.patient.id, 120, 80), (self.patient.id, 130, 85)],
+        )
+        self.assertTrue(all(v.recorded_by == self.user for v in vitals))
+
+    def test_batch_submission_rejects_invalid_blood_pressure(self):
+        payload = [{"visit": self.visit.id, "blood_pressure": "high"}]
+        response = self.client.post(reverse("vital-batch"), payload, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Vital.objects.exists())
+
+    def test_trend_is_downsampled_per_day(self):
+        now = timezone.now().replace(hour=12)
+        for days_ago, bp in ((1, "120/80"), (1, "140/90"), (3, "110/70")):
+            Vital.objects.create(
+                visit=self.visit,
+                blood_pressure=bp,
+                recorded_at=now - timedelta(days=days_ago),
+            )
+
+        response = self.client.get(
+            reverse("patient-vital-trend", args=[self.patient.id]),
+            {"interval": "day"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        series = response.data["series"]
+        self.assertEqual([point["readings"] for point in series], [1, 2])
+        self.assertEqual(series[1]["systolic"], 130)
+        self.assertEqual(series[1]["diastolic"], 85)
+
+    def test_list_is_paged_newest_first(self):
+        now = timezone.now()
+        # The nurse sees their own department's visits
+        visit = Visit.objects.create(patient=self.patient, department=self.department)
+        readings = [
+            Vital.objects.create(
+                visit=visit, weight="70.00", recorded_at=now - timedelta(hours=hours)
+            )
+            for hours in range(3)
+        ]
+        url = reverse("vital-list")
+
+        first = self.client.get(url, {"visit": visit.id, "limit": 2}).data
+        self.assertEqual([v["id"] for v in first], [readings[0].id, readings[1].id])
+        rest = self.client.get(url, {"limit": 2, "before": first[-1]["recorded_at"]})
+        self.assertEqual([v["id"] for v in rest.data], [readings[2].id])
+
+        for params in ({"visit": "abc"}, {"limit": "all"}, {"before": "yesterday"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_trend_rejects_invalid_range_bounds(self):
+        url = reverse("patient-vital-trend", args=[self.patient.id])
+        for params in ({"start": "yesterday"}, {"end": "2024-02-30T00:00:00"}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+
+
+class RollupTests(APITestCase):
+    role = "cashier"
+
+    def setUp(self):
+        super().setUp()
+        self.lab = ItemType.objects.create(name="Laboratory")
+        self.item = HospitalItem.objects.create(
+            name="Malaria test", price="5000.00", item_type=self.lab
+        )
+        self.patient = create_patient()
+        self.visit = Visit.objects.create(patient=self.patient, department=self.department)
+
+    def visit_counts(self):
+        return {
+            (row.status, row.payment_method): row.visits
+            for row in VisitRollup.objects.filter(visits__gt=0)
+        }
+
+    def test_visit_counts_follow_status_changes(self):
+        self.assertEqual(self.visit_counts(), {("pending", "cash"): 1})
+
+        self.visit.status = "onprogress"
+        self.visit.save()
+
+        self.assertEqual(self.visit_counts(), {("onprogress", "cash"): 1})
+
+        self.visit.delete()
+        self.assertEqual(self.visit_counts(), {})
+
+    def test_insured_patients_are_counted_as_insurance(self):
+        insured = create_patient()
+        company = InsuranceCompany.objects.create(name="NHIF")
+        Insurance.objects.create(patient=insured, provider=company, policy_number="P1")
+        Visit.objects.create(patient=insured, department=self.department)
+
+        self.assertEqual(
+            self.visit_counts(), {("pending", "cash"): 1, ("pending", "insurance"): 1}
+        )
+
+    def test_visits_stay_under_the_payment_method_they_were_counted_as(self):
+        company = InsuranceCompany.objects.create(name="NHIF")
+        Insurance.objects.create(patient=self.patient, provider=company, policy_number="P1")
+
+        services.complete_visit(self.visit)
+        other = Visit.objects.create(patient=create_patient(), department=self.department)
+        Insurance.objects.create(patient=other.patient, provider=company, policy_number="P2")
+        state_machine.VISIT.bulk_transition(Visit.objects.filter(pk=other.pk), "completed")
+
+        self.assertEqual(self.visit_counts(), {("completed", "cash"): 2})
+        rollups.rebuild()
+        self.assertEqual(self.visit_counts(), {("completed", "cash"): 2})
+
+    def test_removed_tests_and_revenue_are_taken_back(self):
+        test = Test.objects.create(visit=self.visit, item=self.item)
+        payment = Payment.objects.create(visit=self.visit, amount="5000.00")
+        refunded = PaymentItem.objects.create(
+            payment=payment, item=self.item, status="completed"
+        )
+        deleted = PaymentItem.objects.create(
+            payment=payment, item=self.item, status="completed"
+        )
+
+        test.delete()
+        refunded.status = "pending"
+        refunded.save()
+        deleted.delete()
+
+        self.assertEqual(TestRollup.objects.get().tests, 0)
+        revenue = RevenueRollup.objects.get()
+        self.assertEqual((revenue.amount, revenue.items), (0, 0))
+
+    def test_complete_payment_adds_revenue_once(self):
+        Test.objects.create(visit=self.visit, item=self.item)
+        payment = Payment.objects.create(visit=self.visit, amount="5000.00")
+        item = PaymentItem.objects.create(payment=payment, item=self.item)
+        url = reverse("complete-payment", args=[self.visit.id])
+
+        for _ in range(2):
+            self.client.post(
+                url, {"payment_id": payment.id, "item_ids": [item.id]}, format="json"
+            )
+
+        revenue = RevenueRollup.objects.get()
+        self.assertEqual((revenue.amount, revenue.items), (5000, 1))
+        self.assertEqual(revenue.item_type, self.lab)
+        self.assertEqual(TestRollup.objects.get().tests, 1)
+
+    def test_backfill_matches_incremental_rollups(self):
+        Test.objects.create(visit=self.visit, item=self.item)
+        payment = Payment.objects.create(visit=self.visit, amount="5000.00")
+        PaymentItem.objects.create(payment=payment, item=self.item, status="completed")
+        incremental = self.dashboard()
+
+        rollups.rebuild()
+
+        self.assertEqual(self.dashboard(), incremental)
+
+    def test_dashboard_reads_rollups(self):
+        response = self.client.get(reverse("dashboard"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["status"], row["count"]) for row in response.data["visits"]],
+            [("pending", 1)],
+        )
+        self.assertEqual(response.data["payment_mix"][0]["payment_method"], "cash")
+        self.assertEqual(response.data["revenue"], [])
+
+    def test_dashboard_rejects_invalid_parameters(self):
+        for params in (
+            {"start": "2024-02-30"},
+            {"end": "yesterday"},
+            {"department": "dental"},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(reverse("dashboard"), params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_dashboard_revenue_is_for_finance_staff(self):
+        self.user.role = "nurse"
+        self.user.save()
+
+        response = self.client.get(reverse("dashboard"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("revenue", response.data)
+        self.assertIn("visits", response.data)
+
+    def dashboard(self):
+        data = self.client.get(reverse("dashboard")).data
+        return {key: data[key] for key in ("visits", "payment_mix", "revenue", "tests")}
+
+
+class ReportTests(APITestCase):
+    role = "cashier"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.lab = ItemType.objects.create(name="Laboratory")
+        self.pharmacy = ItemType.objects.create(name="Pharmacy")
+        self.patient = create_patient()
+        self.visit = Visit.objects.create(patient=self.patient, department=self.department)
+        self.payment = Payment.objects.create(visit=self.visit, amount="0.00")
+
+    def collect(self, price, item_type, completed_at):
+        item = HospitalItem.objects.create(name="Item", price=price, item_type=item_type)
+        return PaymentItem.objects.create(
+            payment=self.payment,
+            item=item,
+            status="completed",
+            completed_at=completed_at,
+            completed_by=self.user,
+        )
+
+    def test_revenue_report_has_running_totals(self):
+        today = timezone.now().replace(hour=10)
+        self.collect("100.00", self.lab, today - timedelta(days=1))
+        self.collect("50.00", self.lab, today)
+        self.collect("30.00", self.pharmacy, today)
+
+        response = self.client.get(reverse("revenue-report"))
+
+        self.assertEqual(response.status_code, 200)
+        lab_rows = [r for r in response.data["rows"] if r["item_type"] == self.lab.id]
+        self.assertEqual([float(r["revenue"]) for r in lab_rows], [100, 50])
+        self.assertEqual([float(r["running_revenue"]) for r in lab_rows], [100, 150])
+        self.assertEqual(float(lab_rows[1]["day_revenue"]), 80)
+
+    def test_receivables_are_aged_per_company(self):
+        company = InsuranceCompany.objects.create(name="NHIF")
+        Insurance.objects.create(
+            patient=self.patient, provider=company, policy_number="P1"
+        )
+        invoice = Invoice.objects.create(
+            visit=self.visit, total_amount="400.00", is_insurance=True
+        )
+        Invoice.objects.filter(pk=invoice.pk).update(
+            created_at=timezone.now() - timedelta(days=45)
+        )
+
+        response = self.client.get(reverse("receivables-aging-report"))
+
+        [row] = response.data["rows"]
+        self.assertEqual((row["company_name"], row["bucket"]), ("NHIF", "31-60"))
+        self.assertEqual(float(row["company_outstanding"]), 400)
+
+    def test_cashier_night_shift_wraps_past_midnight(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        self.collect("20.00", self.lab, yesterday.replace(hour=23))
+        self.collect("30.00", self.lab, timezone.now().replace(hour=2))
+
+        rows = self.client.get(reverse("cashier-shift-report")).data["rows"]
+
+        self.assertEqual(
+            [(str(r["shift_date"]), r["shift"], float(r["amount"])) for r in rows],
+            [(str(yesterday.date()), "night", 50)],
+        )
+
+    def test_csv_export_streams_rows(self):
+        self.collect("100.00", self.lab, timezone.now())
+
+        response = self.client.get(reverse("revenue-report"), {"export": "csv"})
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith("day,department,"))
+        self.assertEqual(len(lines), 2)
+
+    def test_csv_export_of_empty_report_has_header(self):
+        response = self.client.get(reverse("revenue-report"), {"export": "csv"})
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith("day,department,"))
+
+    def test_cached_report_is_refreshed_when_payments_change(self):
+        today = timezone.now().replace(hour=10)
+        self.collect("100.00", self.lab, today)
+        url = reverse("revenue-report")
+        self.assertEqual(len(self.client.get(url).data["rows"]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collect("30.00", self.pharmacy, today)
+
+        self.assertEqual(len(self.client.get(url).data["rows"]), 2)
+
+    def test_reports_leave_out_deleted_visits(self):
+        self.collect("100.00", self.lab, timezone.now().replace(hour=10))
+        url = reverse("revenue-report")
+        self.assertEqual(len(self.client.get(url).data["rows"]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.soft_delete()
+
+        self.assertEqual(self.client.get(url).data["rows"], [])
+
+    def test_report_views_must_say_how_to_compute_the_report(self):
+        class Incomplete(ReportView):
+            report_name = "incomplete"
+
+            def get_params(self, request):
+                return {}
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_reports_are_limited_to_finance_staff(self):
+        self.user.role = "nurse"
+        self.user.save()
+
+        response = self.client.get(reverse("revenue-report"))
+
+        self.assertEqual(response.status_code, 403)
+
+
+class DataScopeTests(TestCase):
+    def setUp(self):
+        self.general = Department.objects.create(name="General", short_name="GEN")
+        self.dental = Department.objects.create(name="Dental", short_name="DEN")
+        self.doctor = User.objects.create_user(
+            email="doctor@hms.test", password="x", role="doctor", department=self.general
+        )
+        other_doctor = User.objects.create_user(
+            email="other@hms.test", password="x", role="doctor", department=self.general
+        )
+        self.mine = Visit.objects.create(
+            patient=create_patient(), department=self.dental, assigned_doctor=self.doctor
+        )
+        self.queued = Visit.objects.create(
+            patient=create_patient(), department=self.general
+        )
+        self.others = Visit.objects.create(
+            patient=create_patient(),
+            department=self.general,
+            assigned_doctor=other_doctor,
+        )
+        self.dental_queue = Visit.objects.create(
+            patient=create_patient(), department=self.dental
+        )
+        for visit in Visit.objects.all():
+            Test.objects.create(visit=visit)
+
+    def get_ids(self, user, url_name, key="id"):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return sorted(row[key] for row in client.get(reverse(url_name)).data)
+
+    def test_doctor_sees_assigned_visits_and_department_queue(self):
+        expected = sorted([self.mine.id, self.queued.id])
+
+        self.assertEqual(self.get_ids(self.doctor, "visit-list"), expected)
+        self.assertEqual(self.get_ids(self.doctor, "test_list", "visit"), expected)
+        self.assertEqual(
+            self.get_ids(self.doctor, "patient_list"),
+            sorted([self.mine.patient_id, self.queued.patient_id]),
+        )
+
+    def test_nurse_sees_department_visits(self):
+        nurse = User.objects.create_user(
+            email="nurse@hms.test", password="x", role="nurse", department=self.dental
+        )
+
+        self.assertEqual(
+            self.get_ids(nurse, "visit-list"),
+            sorted([self.mine.id, self.dental_queue.id]),
+        )
+
+    def test_unscoped_roles_and_anonymous_users(self):
+        cashier = User.objects.create_user(
+            email="cashier@hms.test", password="x", role="cashier"
+        )
+
+        self.assertEqual(len(self.get_ids(cashier, "visit-list")), 4)
+        self.assertEqual(self.get_ids(None, "visit-list"), [])
+
+
+class ReplicaRoutingTests(TestCase):
+    class ReplicaView(APIView):
+        use_read_replica = True
+
+    class PrimaryView(APIView):
+        pass
+
+    def setUp(self):
+        cache.clear()
+        self.router = db_routers.PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        patcher = mock.patch.object(db_routers, "replica_configured", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, method, view, token="a"):
+        """Run a request through the middleware and return the read alias seen."""
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view.as_view(), (), {})
+            seen.append(self.router.db_for_read(Patient))
+            return HttpResponse(status=201 if method == "post" else 200)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = getattr(self.factory, method)(
+            "/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+        middleware(request)
+        return seen[0]
+
+    def test_router(self):
+        self.assertIsNone(self.router.db_for_read(Patient))
+        with db_routers.read_from_replica():
+            self.assertEqual(self.router.db_for_read(Patient), "replica")
+            self.assertEqual(self.router.db_for_write(Patient), "default")
+        self.assertIsNone(self.router.db_for_read(Patient))
+        self.assertFalse(self.router.allow_migrate("replica", "core"))
+
+    def test_only_marked_views_read_from_replica(self):
+        self.assertEqual(self.serve("get", self.ReplicaView), "replica")
+        self.assertIsNone(self.serve("get", self.PrimaryView))
+        self.assertIsNone(self.serve("post", self.ReplicaView))
+        # The context is reset once the response is produced
+        self.assertIsNone(self.router.db_for_read(Patient))
+
+    def test_client_is_pinned_to_primary_after_write(self):
+        self.serve("post", self.PrimaryView, token="writer")
+        self.assertIsNone(self.serve("get", self.ReplicaView, token="writer"))
+        self.assertEqual(self.serve("get", self.ReplicaView, token="other"), "replica")
+
+        cache.clear()  # Sticky window elapsed
+        self.assertEqual(self.serve("get", self.ReplicaView, token="writer"), "replica")
+
+
+class QueryBudgetTests(APITestCase):
+    role = "admin"
+
+    LIST_URLS = [
+        "visit-list",
+        "test_list",
+        "payment_list",
+        "payment-item-list",
+        "invoice_list",
+        "invoice-item-list",
+        "hospital-item-list",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = User.objects.create_user(
+            email="doctor@hms.test",
+            password="secret",
+            role="doctor",
+            department=self.department,
+        )
+        self.company = InsuranceCompany.objects.create(name="NHIF")
+        self.item_type = ItemType.objects.create(name="Laboratory")
+
+    def add_visit(self):
+        item = HospitalItem.objects.create(
+            name="Malaria test", price="5000.00", item_type=self.item_type
+        )
+        item.insurance_companies.add(self.company)
+        visit = Visit.objects.create(
+            patient=create_patient(),
+            department=self.department,
+            assigned_doctor=self.doctor,
+        )
+        Test.objects.create(visit=visit, item=item)
+        payment = Payment.objects.create(visit=visit, amount="5000.00")
+        PaymentItem.objects.create(payment=payment, item=item)
+        invoice = Invoice.objects.create(visit=visit, total_amount="5000.00")
+        InvoiceItem.objects.create(invoice=invoice, item=item)
+
+    def query_counts(self):
+        counts = {}
+        for name in self.LIST_URLS:
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = response.query_count
+        return counts
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        self.add_visit()
+        baseline = self.query_counts()
+        for _ in range(3):
+            self.add_visit()
+        self.assertEqual(self.query_counts(), baseline)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("visit-list"))
+        self.assertRegex(
+            response["Server-Timing"],
+            rf'^db;dur=[0-9.]+;desc="{response.query_count} queries", total;dur=[0-9.]+$',
+        )
+
+    def test_exceeding_a_budget_fails(self):
+        with self.settings(HMS_QUERY_BUDGETS={"visit-list": 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("visit-list"))
+
+    def test_queries_are_counted_without_budget_logging(self):
+        metrics.registry.clear()
+        with (
+            self.settings(HMS_QUERY_BUDGET_LOGGING=False, HMS_QUERY_BUDGETS={"visit-list": 0}),
+            self.assertNoLogs("hms.queries"),
+        ):
+            response = self.client.get(reverse("visit-list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.query_count, 0)
+        [series] = metrics.registry.snapshot()
+        self.assertEqual(series["queries"], response.query_count)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = self.settings(HMS_METRICS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def scrape(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_api_requests_by_route(self):
+        patient = create_patient()
+        self.client.get(reverse("patient_detail", args=[patient.pk]))
+        self.client.get(reverse("patient_detail", args=[patient.pk + 100]))
+
+        body = self.scrape()
+        labels = 'route="api/core/patients/<int:pk>/",method="GET"'
+        self.assertIn(f"hms_request_duration_seconds_count{{{labels}}} 2", body)
+        self.assertIn(f'hms_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'hms_requests_total{{{labels},status="404"}} 1', body)
+        self.assertIn(f"hms_request_errors_total{{{labels}}} 0", body)
+        # The scrape itself is not an APIView and is not recorded
+        self.assertNotIn('route="metrics"', body)
+
+    def test_merges_other_worker_processes(self):
+        self.client.get(reverse("patient_list"))
+        worker = metrics.registry.snapshot()
+        with open(os.path.join(self.directory, "metrics-999999.json"), "w") as f:
+            json.dump(worker, f)
+
+        body = self.scrape()
+        labels = 'route="api/core/patients/",method="GET"'
+        self.assertIn(f"hms_request_duration_seconds_count{{{labels}}} 2", body)
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        profiling.clear()
+        self.addCleanup(profiling.clear)
+        self.user.is_staff = True
+        self.user.save()
+
+    def profiles(self, **params):
+        response = self.client.get(reverse("profile-list"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_unsampled_requests_are_not_profiled(self):
+        self.client.get(reverse("patient_list"))
+        self.assertEqual(self.profiles()["profiles"], [])
+
+    def test_sampled_request_keeps_frames_and_sql_per_route(self):
+        create_patient()
+        with self.settings(HMS_PROFILE_SAMPLE_RATE=1, HMS_PROFILE_BUFFER_SIZE=2):
+            for _ in range(3):
+                self.client.get(reverse("patient_list"))
+        data = self.profiles(route="api/core/patients/")
+
+        self.assertIn("api/core/patients/", data["routes"])
+        # The ring buffer only keeps the newest two
+        self.assertEqual(len(data["profiles"]), 2)
+        profile = data["profiles"][0]
+        self.assertEqual((profile["method"], profile["status"]), ("GET", 200))
+        self.assertEqual(profile["reason"], "sampled")
+        self.assertGreater(profile["queries"], 0)
+        self.assertIn("core_patient", profile["sql"][0]["sql"])
+        self.assertTrue(any("core/views.py" in f["function"] for f in profile["frames"]))
+
+    def test_signed_header_forces_profiling(self):
+        token = self.client.post(reverse("profile-list")).data["token"]
+        self.client.get(reverse("patient_list"), HTTP_X_HMS_PROFILE=token)
+        self.client.get(reverse("patient_list"), HTTP_X_HMS_PROFILE=token + "x")
+
+        profiles = self.profiles()["profiles"]
+        self.assertEqual([p["reason"] for p in profiles], ["header"])
+
+    def test_only_admins_can_read_profiles(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("profile-list")).status_code, 403)
+
+
+class SyntheticDataTests(TestCase):
+    def generate(self, **options):
+        call_command(
+            "generate_synthetic_data",
+            patients=1200,
+            visits_per_patient=2,
+            seed=7,
+            end_date="2024-03-31",
+            chunk_size=500,
+            stdout=io.StringIO(),
+            **options,
+        )
+        return list(
+            Visit.objects.order_by("pk").values_list(
+                "visit_number", "visit_date", "patient__patient_number", "department_id"
+            )
+        )
+
+    def test_numbers_keep_daily_format_and_history_is_laid_out_backwards(self):
+        visits = self.generate()
+
+        self.assertEqual(Patient.objects.count(), 1200)
+        self.assertEqual(len(visits), 2400)
+        self.assertEqual(visits[0][0], "290324001")
+        self.assertEqual(visits[-1][:2], ("310324402", date(2024, 3, 31)))
+        self.assertEqual(
+            Patient.objects.order_by("pk").last().patient_number, "300324201"
+        )
+        for visit_number, visit_date, _, _ in visits:
+            self.assertEqual(visit_number[:6], visit_date.strftime("%d%m%y"))
+        # Every visit is charged and invoiced for the same amount
+        payment = Payment.objects.order_by("pk").first()
+        self.assertEqual(
+            sum(i.item.price for i in payment.items.select_related("item")),
+            payment.amount,
+        )
+        self.assertEqual(payment.visit.invoice.total_amount, payment.amount)
+        # Sequences continue after the explicit ids
+        self.assertEqual(create_patient(phone="0799999999").pk, 1201)
+
+    def test_same_seed_generates_the_same_data(self):
+        first = self.generate()
+        Patient.objects.all().delete()
+        self.assertEqual(self.generate(), first)
+
+    def test_refuses_to_write_into_populated_tables(self):
+        create_patient()
+        with self.assertRaises(CommandError):
+            self.generate()
+
+
+class QueryPlanTests(TestCase):
+    """
+    The hot lookups must be answered from the indexes added in migration 0021
+    once the tables hold a realistic amount of data and planner statistics.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "generate_synthetic_data",
+            patients=1500,
+            visits_per_patient=3,
+            end_date="2024-06-30",
+            chunk_size=1500,
+            stdout=io.StringIO(),
+        )
+        item = HospitalItem.objects.order_by("pk").first()
+        Test.objects.bulk_create(
+            Test(visit_id=pk, item=item, status="pending" if pk % 10 == 0 else "completed")
+            for pk in Visit.objects.values_list("pk", flat=True)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.visit = Visit.objects.order_by("pk")[2000]
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        # Each partition of a partitioned table has its own copy of the index
+        names = [index_name, *partition_indexes(index_name)]
+        self.assertTrue(
+            any(name in plan for name in names), f"{index_name} not used:\n{plan}"
+        )
+
+    def test_duplicate_visit_check(self):
+        self.assertUsesIndex(
+            Visit.objects.filter(
+                patient=self.visit.patient_id,
+                department=self.visit.department_id,
+                visit_date=self.visit.visit_date,
+            ).exclude(pk=self.visit.pk),
+            "visit_patient_dept_date_idx",
+        )
+
+    def test_pending_payments_of_visit(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(visit=self.visit, status="pending"),
+            "payment_visit_status_idx",
+        )
+
+    def test_pending_payment_items(self):
+        self.assertUsesIndex(
+            PaymentItem.objects.filter(payment_id=self.visit.pk, status="pending"),
+            "paymentitem_pending_idx",
+        )
+
+    def test_payment_item_by_item(self):
+        item = PaymentItem.objects.filter(payment_id=self.visit.pk).first().item_id
+        self.assertUsesIndex(
+            PaymentItem.objects.filter(payment_id=self.visit.pk, item=item),
+            "paymentitem_payment_item_idx",
+        )
+
+    def test_pending_tests_of_visit(self):
+        self.assertUsesIndex(
+            Test.objects.filter(visit=self.visit, status="pending"),
+            "test_visit_status_idx",
+        )
+
+    def test_patient_history_in_date_order(self):
+        self.assertUsesIndex(
+            MedicalHistory.objects.filter(patient=self.visit.patient_id).order_by(
+                "created_at"
+            ),
+            "history_patient_created_idx",
+        )
+
+    def test_open_insurance_invoices(self):
+        self.assertUsesIndex(
+            Invoice.objects.filter(
+                is_insurance=True, is_paid=False, created_at__lte=timezone.now()
+            ),
+            "invoice_open_insurance_idx",
+        )
+
+
+def partition_indexes(index_name):
+    """Names of the per-partition copies of a partitioned index."""
+    if connection.vendor != "postgresql":
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [index_name],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PartitionTests(TestCase):
+    def test_month_arithmetic_and_names(self):
+        self.assertEqual(partitions.add_months(date(2024, 11, 15), 3), date(2025, 2, 1))
+        self.assertEqual(partitions.add_months(date(2024, 1, 31), -1), date(2023, 12, 1))
+        name = partitions.partition_name("core_paymentitem", date(2024, 2, 1))
+        self.assertEqual(name, "core_paymentitem_p202402")
+        self.assertEqual(
+            partitions.partition_month("core_paymentitem", name), date(2024, 2, 1)
+        )
+        self.assertIsNone(
+            partitions.partition_month("core_paymentitem", "core_paymentitem_default")
+        )
+
+    def table_state(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {table} ORDER BY id")
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes "
+                "WHERE tablename = %s AND indexname <> %s ORDER BY 1",
+                [table, f"{table}_pkey"],
+            )
+            # A partitioned table reports its indexes as "ON ONLY <table>"
+            indexes = [(name, sql.replace(" ON ONLY ", " ON ")) for name, sql in cursor]
+            cursor.execute(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = %s::regclass AND contype = 'f' ORDER BY 1",
+                [table],
+            )
+            foreign_keys = cursor.fetchall()
+        return {"ids": ids, "indexes": indexes, "foreign_keys": foreign_keys}
+
+    @skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL")
+    def test_rebuilds_keep_rows_indexes_foreign_keys_and_sequence(self):
+        table = "core_medicalhistory"
+        patient = create_patient()
+        visit = Visit.objects.create(patient=patient)
+        for description in ("Fever", "Follow-up"):
+            MedicalHistory.objects.create(
+                patient=patient, visit=visit, description=description
+            )
+        # Fire the deferred FK checks; a table with pending ones cannot be altered
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        before = self.table_state(table)
+
+        partitions.unpartition_table(connection, table)
+        self.assertFalse(partitions.is_partitioned(connection, table))
+        self.assertEqual(self.table_state(table), before)
+        plain = MedicalHistory.objects.create(patient=patient, visit=visit, description="A")
+        self.assertGreater(plain.pk, max(before["ids"]))
+
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        after_plain = self.table_state(table)
+        partitions.partition_table(connection, table, "created_at")
+        self.assertTrue(partitions.is_partitioned(connection, table))
+        self.assertEqual(self.table_state(table), after_plain)
+        partitioned = MedicalHistory.objects.create(
+            patient=patient, visit=visit, description="B"
+        )
+        self.assertGreater(partitioned.pk, plain.pk)
+
+    @skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL")
+    def test_new_partition_takes_its_rows_from_the_default(self):
+        table = "core_medicalhistory"
+        month = partitions.add_months(date.today(), 24)
+        patient = create_patient()
+        history = MedicalHistory.objects.create(
+            patient=patient, visit=Visit.objects.create(patient=patient), description="Late"
+        )
+        MedicalHistory.objects.filter(pk=history.pk).update(
+            created_at=timezone.make_aware(datetime.combine(month, time(12)))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        self.assertTrue(partitions.ensure_partition(connection, table, "created_at", month))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {table} WHERE id = %s", [history.pk]
+            )
+            self.assertEqual(cursor.fetchone()[0], partitions.partition_name(table, month))
+
+    def test_commands_need_postgresql(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("Only meaningful on other backends")
+        for command in ("manage_partitions", "benchmark_partitions"):
+            with self.assertRaises(CommandError):
+                call_command(command, stdout=io.StringIO())
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient()
+        self.item = HospitalItem.objects.create(name="Malaria test", price="5000.00")
+        self.old = self.make_visit(date.today() - timedelta(days=400))
+        self.recent = Visit.objects.create(patient=self.patient, department=self.department)
+
+    def make_visit(self, visit_date, department=None):
+        visit = Visit.objects.create(
+            patient=self.patient, department=department or self.department
+        )
+        MedicalHistory.objects.create(
+            visit=visit, patient=self.patient, description="Malaria, treated."
+        )
+        Test.objects.create(visit=visit, item=self.item, status="completed")
+        payment = Payment.objects.create(visit=visit, amount="5000.00", status="completed")
+        PaymentItem.objects.create(payment=payment, item=self.item, status="completed")
+        invoice = Invoice.objects.create(visit=visit, total_amount="5000.00", is_paid=True)
+        InvoiceItem.objects.create(invoice=invoice, item=self.item)
+        visit.status, visit.is_active = "completed", False
+        visit.save()
+        # visit_date is auto_now_add, so backdate it with an update
+        Visit.objects.filter(pk=visit.pk).update(visit_date=visit_date)
+        return visit
+
+    def test_moves_old_closed_visits_out_of_the_hot_tables(self):
+        rollup_total = sum(VisitRollup.objects.values_list("visits", flat=True))
+        call_command("archive_visits", stdout=io.StringIO())
+
+        self.assertFalse(Visit.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(PaymentItem.objects.filter(payment__visit=self.old.pk).exists())
+        self.assertTrue(Visit.objects.filter(pk=self.recent.pk).exists())
+        archived = ArchivedVisit.objects.get()
+        self.assertEqual(archived.original_id, self.old.pk)
+        graph = archived.graph()
+        self.assertEqual(graph["payments"][0]["items"][0]["item"]["name"], "Malaria test")
+        self.assertEqual(graph["invoice"]["total_amount"], "5000.00")
+        self.assertEqual(graph["histories"][0]["description"], "Malaria, treated.")
+        # Archived visits still count on the dashboard
+        self.assertEqual(
+            sum(VisitRollup.objects.values_list("visits", flat=True)), rollup_total
+        )
+
+    def test_unsettled_visits_stay_in_the_hot_tables(self):
+        long_ago = date.today() - timedelta(days=400)
+        unpaid = self.make_visit(
+            long_ago, Department.objects.create(name="Dental", short_name="DEN")
+        )
+        Invoice.objects.filter(visit=unpaid).update(is_paid=False)
+        pending = self.make_visit(
+            long_ago, Department.objects.create(name="Eye", short_name="EYE")
+        )
+        PaymentItem.objects.create(payment=pending.payment_set.get(), item=self.item)
+
+        call_command("archive_visits", stdout=io.StringIO())
+
+        self.assertEqual(
+            list(ArchivedVisit.objects.values_list("original_id", flat=True)),
+            [self.old.pk],
+        )
+        self.assertEqual(Visit.objects.filter(pk__in=[unpaid.pk, pending.pk]).count(), 2)
+
+    def test_rebuilt_rollups_still_count_archived_visits(self):
+        def rollup_rows():
+            return [
+                sorted(model.objects.values_list(*fields))
+                for model, fields in (
+                    (VisitRollup, ("date", "department", "status", "visits")),
+                    (TestRollup, ("date", "department", "item_type", "tests")),
+                    (RevenueRollup, ("date", "department", "item_type", "amount")),
+                )
+            ]
+
+        rollups.rebuild()
+        before = rollup_rows()
+        call_command("archive_visits", stdout=io.StringIO())
+        rollups.rebuild()
+
+        self.assertEqual(rollup_rows(), before)
+        self.assertEqual(len(before[2]), 1)  # The old visit's revenue
+
+    def test_timeline_merges_live_and_archived_visits(self):
+        call_command("archive_visits", stdout=io.StringIO())
+        other = Department.objects.create(name="Dental", short_name="DEN")
+        self.make_visit(date.today() - timedelta(days=10), department=other)
+
+        response = self.client.get(reverse("patient-timeline", args=[self.patient.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        visits = response.data["visits"]
+        # The nurse only sees their own department's visits
+        self.assertEqual([v["id"] for v in visits], [self.recent.pk, self.old.pk])
+        self.assertEqual([v["archived"] for v in visits], [False, True])
+        self.assertEqual(visits[0].keys(), visits[1].keys())
+        self.assertEqual(visits[1]["tests"][0]["status"], "completed")
+
+
+class SoftDeleteTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient()
+        self.visit = Visit.objects.create(patient=self.patient, department=self.department)
+
+    def test_deleting_a_patient_hides_them_and_their_visits(self):
+        response = self.client.delete(reverse("patient_detail", args=[self.patient.pk]))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Patient.objects.filter(pk=self.patient.pk).exists())
+        self.assertFalse(Visit.objects.filter(pk=self.visit.pk).exists())
+        self.assertIsNotNone(Visit.all_objects.get(pk=self.visit.pk).deleted_at)
+        self.assertEqual(
+            self.client.get(reverse("patient_detail", args=[self.patient.pk])).status_code,
+            404,
+        )
+        # The visit no longer counts on the dashboard
+        self.assertEqual(sum(VisitRollup.objects.values_list("visits", flat=True)), 0)
+
+    def test_numbers_of_deleted_rows_are_not_reused(self):
+        self.client.delete(reverse("visit-detail", args=[self.visit.pk]))
+        self.patient.soft_delete()
+
+        patient = create_patient(phone="0711111111")
+        visit = Visit.objects.create(patient=patient, department=self.department)
+        self.assertNotEqual(patient.patient_number, self.patient.patient_number)
+        self.assertNotEqual(visit.visit_number, self.visit.visit_number)
+
+    def test_purge_removes_old_soft_deleted_rows_only(self):
+        self.patient.soft_delete()
+        call_command("purge_deleted", pause=0, stdout=io.StringIO())
+        self.assertTrue(Patient.all_objects.filter(pk=self.patient.pk).exists())
+
+        Patient.all_objects.filter(pk=self.patient.pk).update(
+            deleted_at=timezone.now() - timedelta(days=31)
+        )
+        Visit.all_objects.filter(pk=self.visit.pk).update(
+            deleted_at=timezone.now() - timedelta(days=31)
+        )
+        call_command("purge_deleted", pause=0, stdout=io.StringIO())
+        self.assertFalse(Patient.all_objects.filter(pk=self.patient.pk).exists())
+        self.assertFalse(Visit.all_objects.exists())
+
+    def test_phone_of_a_deleted_patient_is_not_reused(self):
+        self.patient.soft_delete()
+
+        response = self.client.post(
+            reverse("patient_list"),
+            {
+                "first_name": "Baraka",
+                "last_name": "Mosha",
+                "date_of_birth": "1985-05-05",
+                "phone": self.patient.phone,
+                "address": "Arusha",
+            },
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("phone", response.data)
+
+    def test_patients_are_only_deleted_through_soft_delete(self):
+        response = self.client.patch(
+            reverse("patient_detail", args=[self.patient.pk]),
+            {"is_active": False, "deleted_at": timezone.now().isoformat()},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.patient.refresh_from_db()
+        self.assertTrue(self.patient.is_active)
+        self.assertIsNone(self.patient.deleted_at)
+
+    def test_records_of_deleted_patients_are_not_listed(self):
+        company = InsuranceCompany.objects.create(name="NHIF")
+        Insurance.objects.create(patient=self.patient, provider=company, policy_number="P1")
+        Payment.objects.create(visit=self.visit, amount="5000.00")
+        Invoice.objects.create(visit=self.visit, total_amount="5000.00")
+        MedicalHistory.objects.create(
+            visit=self.visit, patient=self.patient, description="Asthma"
+        )
+        Vital.objects.create(visit=self.visit, patient=self.patient, weight="70.00")
+        lists = [
+            "insurance-list",
+            "payment_list",
+            "invoice_list",
+            "medical_history_list",
+            "vital-list",
+        ]
+        for name in lists:
+            self.assertEqual(len(self.client.get(reverse(name)).data), 1, name)
+
+        self.patient.soft_delete()
+
+        for name in lists:
+            self.assertEqual(self.client.get(reverse(name)).data, [], name)
+
+
+
+class IdempotencyTests(APITestCase):
+    role = "receptionist"
+
+    def setUp(self):
+        super().setUp()
+        HospitalItem.objects.create(name="Consultation Fee", price=10000)
+        self.visit = Visit.objects.create(
+            patient=create_patient(), department=self.department
+        )
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def pay(self, key=None, **data):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        return self.client.post(
+            reverse("generate-consultation-payment"),
+            {"visit_id": self.visit.pk, **data},
+            format="json",
+            **headers,
+        )
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.pay("abc")
+        retry = self.pay("abc")
+
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_key_reused_with_a_different_body_is_rejected(self):
+        self.pay("abc")
+        self.assertEqual(self.pay("abc", note="changed").status_code, 422)
+
+    def test_requests_without_a_key_are_not_stored(self):
+        self.pay()
+        second = self.pay()
+        self.assertNotIn("Idempotent-Replayed", second)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_conflicting_charge_is_a_409_that_can_be_retried(self):
+        stale = ConcurrentUpdate("Payment is no longer at version 1.")
+        with mock.patch.object(VersionedModel, "_do_update", side_effect=stale):
+            response = self.pay("abc")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(PaymentItem.objects.exists())
+        retry = self.pay("abc")
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", retry)
+        self.assertEqual(PaymentItem.objects.count(), 1)
+
+    def prescribe(self, **prescription):
+        medicine = HospitalItem.objects.create(name="Amoxicillin", price=3000)
+        response = self.client.post(
+            reverse("add-prescription"),
+            {
+                "visit_id": self.visit.pk,
+                "prescriptions": [
+                    {
+                        "medicine_name": "Amoxicillin",
+                        "item_id": medicine.pk,
+                        "dosage": "500mg",
+                        "quantity": 21,
+                        "frequency": "3x daily",
+                        **prescription,
+                    }
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return medicine
+
+    def bill_prescriptions(self, key=None):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        return self.client.post(
+            reverse("generate-prescription-invoice"),
+            {"visit_id": self.visit.pk},
+            format="json",
+            **headers,
+        )
+
+    def test_prescriptions_are_billed_once_at_the_item_price(self):
+        medicine = self.prescribe()
+        self.assertEqual(Prescription.objects.get().price, 3000)
+
+        first = self.bill_prescriptions()
+        self.assertEqual(first.status_code, 200, first.content)
+        self.assertEqual(self.bill_prescriptions().status_code, 400)
+
+        payment = Payment.objects.get()
+        self.assertEqual(payment.amount, 3000)
+        self.assertEqual(payment.pk, first.data["payment_id"])
+        self.assertEqual(
+            list(PaymentItem.objects.values_list("payment", "item")),
+            [(payment.pk, medicine.pk)],
+        )
+
+    def test_prescription_payment_retry_is_replayed(self):
+        self.prescribe()
+        first = self.bill_prescriptions("rx-1")
+        retry = self.bill_prescriptions("rx-1")
+
+        self.assertEqual(first.status_code, 200, first.content)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(PaymentItem.objects.count(), 1)
+
+    def test_failed_prescription_payment_leaves_nothing_behind(self):
+        self.prescribe()
+        with mock.patch.object(
+            PaymentItem.objects, "bulk_create", side_effect=RuntimeError("db down")
+        ):
+            self.assertEqual(self.bill_prescriptions("rx-1").status_code, 500)
+        self.assertFalse(Payment.objects.exists())
+
+        self.assertEqual(self.bill_prescriptions("rx-1").status_code, 200)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_tests_are_billed_once(self):
+        scan = HospitalItem.objects.create(name="X-Ray", price=25000)
+        Test.objects.create(visit=self.visit, item=scan)
+
+        def bill():
+            return self.client.post(
+                reverse("generate-test-invoice"),
+                {"visit_id": self.visit.pk},
+                format="json",
+            )
+
+        self.assertEqual(bill().status_code, 200)
+        self.assertEqual(bill().status_code, 400)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Test.objects.get().status, "pending")
+
+    def test_unknown_prescription_item_is_rejected(self):
+        response = self.client.post(
+            reverse("add-prescription"),
+            {
+                "visit_id": self.visit.pk,
+                "prescriptions": [
+                    {
+                        "medicine_name": "Amoxicillin",
+                        "item_id": 999,
+                        "dosage": "500mg",
+                        "quantity": 21,
+                        "frequency": "3x daily",
+                    }
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Prescription.objects.exists())
+
+    def test_unanswered_claim_is_taken_over_after_its_lease(self):
+        self.pay("abc")
+        # The worker died after claiming the key, its charge rolled back
+        Payment.objects.all().delete()
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        self.assertEqual(self.pay("abc").status_code, 409)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        retry = self.pay("abc")
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", retry)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 200)
+
+    def test_purge_removes_expired_keys(self):
+        self.pay("abc")
+        call_command("purge_idempotency_keys", stdout=io.StringIO())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        call_command("purge_idempotency_keys", stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class ConcurrencyTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.visit = Visit.objects.create(
+            patient=create_patient(), department=self.department
+        )
+
+    def test_save_from_a_stale_read_raises(self):
+        first = Visit.objects.get(pk=self.visit.pk)
+        second = Visit.objects.get(pk=self.visit.pk)
+
+        first.status = "onprogress"
+        first.save()
+        self.assertEqual(first.version, 2)
+
+        second.status = "completed"
+        with self.assertRaises(ConcurrentUpdate), transaction.atomic():
+            second.save()
+        self.assertEqual(Visit.objects.get(pk=self.visit.pk).status, "onprogress")
+
+    def test_detail_sends_version_as_etag(self):
+        response = self.client.get(reverse("visit-detail", args=[self.visit.pk]))
+        self.assertEqual(response["ETag"], '"1"')
+
+        self.visit.soft_delete()
+        self.assertEqual(self.visit.version, 2)
+
+    def test_stale_if_match_is_rejected(self):
+        Visit.objects.get(pk=self.visit.pk).save()  # Another desk bumps it to 2
+
+        response = self.client.post(
+            reverse("complete-visit"), {"visit_id": self.visit.pk}, HTTP_IF_MATCH='"1"'
+        )
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response["ETag"], '"2"')
+        self.assertEqual(Visit.objects.get(pk=self.visit.pk).status, "pending")
+
+        response = self.client.post(
+            reverse("complete-visit"), {"visit_id": self.visit.pk}, HTTP_IF_MATCH='"2"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], '"3"')
+
+
+class TransitionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.visit = Visit.objects.create(
+            patient=create_patient(), department=self.department
+        )
+
+    def updates_of(self, table, transition, *args):
+        """Run ``transition`` and return the UPDATE statements it sent to ``table``."""
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                transition(*args)
+        return [
+            q["sql"] for q in queries if q["sql"].startswith(f'UPDATE "{table}"')
+        ]
+
+    def test_each_transition_issues_one_update(self):
+        doctor = User.objects.create_user(
+            email="doctor@hms.test", password="secret", role="doctor"
+        )
+        updates = self.updates_of(
+            "core_visit", services.assign_doctor, self.visit, doctor, self.department
+        )
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"patient_id"', updates[0])
+
+        test = Test.objects.create(visit=self.visit)
+        self.assertEqual(
+            len(self.updates_of("core_test", services.record_test_result, test, "ok")), 1
+        )
+
+        for name in ("Paracetamol", "Amoxicillin"):
+            Prescription.objects.create(
+                visit=self.visit,
+                medicine_name=name,
+                dosage="1 tablet",
+                quantity=10,
+                frequency="3 times a day",
+                price=100,
+            )
+        self.assertEqual(
+            len(self.updates_of(
+                "core_prescription", services.dispense_prescriptions, self.visit
+            )),
+            1,
+        )
+
+        Invoice.objects.create(visit=self.visit, total_amount=100, is_insurance=True)
+        self.assertEqual(
+            len(self.updates_of(
+                "core_invoice", services.submit_insurance_invoices, self.visit
+            )),
+            1,
+        )
+        self.assertEqual(Invoice.objects.get().version, 2)
+
+        self.assertEqual(
+            len(self.updates_of("core_visit", services.complete_visit, self.visit)), 1
+        )
+        self.visit.refresh_from_db()
+        self.assertEqual((self.visit.status, self.visit.version), ("completed", 3))
+
+    def test_transitions_are_guarded_and_announced(self):
+        events = []
+
+        def receiver(sender, test, result, **kwargs):
+            events.append(test.pk)
+
+        services.test_result_recorded.connect(receiver)
+        self.addCleanup(services.test_result_recorded.disconnect, receiver)
+        test = Test.objects.create(visit=self.visit)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.record_test_result(test, "ok")
+        with self.assertRaises(state_machine.InvalidTransition):
+            services.record_test_result(test, "again")
+        self.assertEqual(events, [test.pk])
+
+
+class StateMachineTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.visits = [
+            Visit.objects.create(patient=create_patient(), department=self.department)
+            for _ in range(3)
+        ]
+
+    def rollup(self):
+        return dict(VisitRollup.objects.filter(visits__gt=0).values_list("status", "visits"))
+
+    def test_transition_is_validated_and_recorded(self):
+        visit = self.visits[0]
+        state_machine.VISIT.transition(visit, "completed", self.user, reason="left")
+        self.assertFalse(Visit.objects.get(pk=visit.pk).is_active)
+
+        with self.assertRaises(state_machine.InvalidTransition):
+            state_machine.VISIT.transition(visit, "onprogress")
+
+        response = self.client.get(reverse("visit-transitions", args=[visit.pk]))
+        self.assertEqual(
+            [(t["from_state"], t["to_state"], t["user"], t["reason"]) for t in response.data],
+            [("pending", "completed", self.user.pk, "left")],
+        )
+
+    def test_bulk_transition_is_set_based(self):
+        services.assign_doctor(self.visits[1], None, self.department)
+        services.complete_visit(self.visits[2])
+
+        with CaptureQueriesContext(connection) as queries:
+            moved = state_machine.VISIT.bulk_transition(
+                Visit.objects.all(), "completed", reason="end of day"
+            )
+        self.assertEqual(moved, 2)
+        self.assertEqual(
+            len([q for q in queries if q["sql"].startswith('UPDATE "core_visit"')]), 1
+        )
+        self.assertEqual(
+            set(StateTransition.objects.filter(reason="end of day").values_list(
+                "object_id", "from_state", "to_state"
+            )),
+            {
+                (self.visits[0].pk, "pending", "completed"),
+                (self.visits[1].pk, "onprogress", "completed"),
+            },
+        )
+        self.assertFalse(Visit.objects.filter(is_active=True).exists())
+        self.assertEqual(Visit.objects.get(pk=self.visits[1].pk).version, 3)
+        self.assertEqual(self.rollup(), {"completed": 3})
+
+    def test_bulk_transition_endpoint_is_for_admins(self):
+        url = reverse("visit-bulk-transition")
+        data = {"visit_ids": [v.pk for v in self.visits], "status": "completed"}
+        self.assertEqual(self.client.post(url, data, format="json").status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.data["transitioned"], 3)
+        response = self.client.post(url, {**data, "status": "pending"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_transition_endpoint_validates_its_input(self):
+        self.user.is_staff = True
+        self.user.save()
+        url = reverse("visit-bulk-transition")
+        for data in (
+            {"visit_ids": ["one", "two"], "status": "completed"},
+            {"visit_ids": [self.visits[0].pk, None], "status": "completed"},
+            {"visit_ids": self.visits[0].pk, "status": "completed"},
+            {"visit_ids": [self.visits[0].pk]},
+            {"visit_ids": [self.visits[0].pk], "status": "completed", "reason": "x" * 256},
+        ):
+            with self.subTest(data=data):
+                response = self.client.post(url, data, format="json")
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Visit.objects.filter(status="completed").exists())
+
+    def test_status_is_not_writable_through_the_serializers(self):
+        visit = self.visits[0]
+        response = self.client.put(
+            reverse("visit-detail", args=[visit.pk]),
+            {"patient": visit.patient_id, "status": "completed", "is_active": False},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        test = Test.objects.create(visit=visit)
+        serializer = TestSerializer(test, data={"status": "completed"}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        visit.refresh_from_db()
+        self.assertEqual((visit.status, visit.is_active), ("pending", True))
+        self.assertEqual(Test.objects.get(pk=test.pk).status, "pending")
+        self.assertTrue(PrescriptionSerializer().fields["status"].read_only)
+        self.assertFalse(StateTransition.objects.exists())
+
+
+class CloseStaleVisitsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = Visit.objects.create(patient=create_patient(), department=self.department)
+        self.pending, self.onprogress, self.completed = [
+            Visit.objects.create(patient=create_patient(), department=self.department)
+            for _ in range(3)
+        ]
+        services.assign_doctor(self.onprogress, None, self.department)
+        services.complete_visit(self.completed)
+        Visit.objects.exclude(pk=self.today.pk).update(
+            visit_date=date.today() - timedelta(days=3)
+        )
+        # Rollup keys follow the visit date
+        call_command("backfill_rollups", stdout=io.StringIO())
+
+    def close(self, *args):
+        out = io.StringIO()
+        call_command("close_stale_visits", *args, chunk_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_reports_without_changing(self):
+        self.assertIn("Would close 2 visits", self.close("--dry-run"))
+        self.assertEqual(Visit.objects.filter(is_active=True).count(), 3)
+
+    def test_closes_old_open_visits_only(self):
+        self.assertIn("Closed 2 stale visits", self.close())
+
+        self.assertEqual(
+            set(Visit.objects.filter(is_active=True).values_list("pk", flat=True)),
+            {self.today.pk},
+        )
+        self.assertEqual(
+            StateTransition.objects.filter(reason="Closed by close_stale_visits").count(), 2
+        )
+        self.assertEqual(
+            dict(
+                VisitRollup.objects.filter(
+                    date=date.today() - timedelta(days=3), visits__gt=0
+                ).values_list("status", "visits")
+            ),
+            {"completed": 3},
+        )
+        self.assertIn("No open visits", self.close())
+
+    def test_flag_leaves_status_for_review(self):
+        self.close("--flag")
+        self.pending.refresh_from_db()
+        self.assertEqual((self.pending.status, self.pending.is_active), ("pending", False))
+
+
+class AuditTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = create_patient()
+
+    def test_api_changes_are_attributed_with_field_diffs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse("patient_detail", args=[self.patient.pk]),
+                {"address": "Arusha"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        entry = AuditLog.objects.get(action="update")
+        self.assertEqual(entry.actor, self.user)
+        self.assertEqual(entry.object_id, self.patient.pk)
+        self.assertEqual(entry.changes, {"address": ["Dar es Salaam", "Arusha"]})
+
+    def test_passwords_are_masked(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("changed")
+            self.user.save()
+        entry = AuditLog.objects.get(object_id=self.user.pk, action="update")
+        self.assertEqual(entry.changes["password"], [audit.MASK, audit.MASK])
+        self.assertIsNone(entry.actor)  # Not made in a request
+
+    def test_rolled_back_changes_are_not_audited(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.patient.address = "Mwanza"
+                self.patient.save()
+                raise RuntimeError
+        self.assertFalse(AuditLog.objects.filter(action="update").exists())
+
+    def test_writer_inserts_queued_entries_in_one_batch(self):
+        writer = audit.AuditWriter()
+        for address in ("Arusha", "Mwanza", "Dodoma"):
+            writer.queue.put(
+                AuditLog(
+                    content_type=ContentType.objects.get_for_model(Patient),
+                    object_id=self.patient.pk,
+                    action="update",
+                    changes={"address": [None, address]},
+                )
+            )
+        with CaptureQueriesContext(connection) as queries:
+            writer.flush()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(AuditLog.objects.filter(action="update").count(), 3)
+
+    @override_settings(HMS_AUDIT_FLUSH_INTERVAL=0)
+    def test_writer_gives_up_on_a_failing_batch_row_by_row(self):
+        writer = audit.AuditWriter()
+        entries = [
+            AuditLog(
+                content_type=ContentType.objects.get_for_model(Patient),
+                object_id=self.patient.pk,
+                action=action,
+                changes={"address": [None, "Arusha"]},
+            )
+            for action in ("update", "delete")
+        ]
+        with (
+            mock.patch.object(
+                AuditLog.objects, "bulk_create", side_effect=RuntimeError
+            ) as bulk_create,
+            mock.patch.object(AuditLog, "save", autospec=True) as save,
+            self.assertLogs("hms.audit", "ERROR") as logs,
+        ):
+            save.side_effect = [None, RuntimeError]  # The second row is refused
+            writer.write(entries)
+
+        self.assertEqual(bulk_create.call_count, 3)
+        self.assertEqual(save.call_count, 2)
+        self.assertIn("Dropped audit entry: delete", logs.output[-1])
+        self.assertTrue(writer.queue.empty())
+
+    def test_state_machine_transitions_are_audited(self):
+        visit = Visit.objects.create(patient=self.patient, department=self.department)
+        prescriptions = [
+            Prescription.objects.create(
+                visit=visit,
+                medicine_name=name,
+                dosage="1x2",
+                quantity=10,
+                frequency="After meals",
+                price="1000.00",
+            )
+            for name in ("Amoxicillin", "Paracetamol")
+        ]
+        AuditLog.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.dispense_prescriptions(visit, self.user)
+        entries = AuditLog.objects.filter(action="update").order_by("object_id")
+        self.assertEqual(
+            [(e.object_id, e.changes, e.actor_id) for e in entries],
+            [
+                (p.pk, {"status": ["pending", "dispensed"]}, self.user.pk)
+                for p in prescriptions
+            ],
+        )
+
+        AuditLog.objects.all().delete()
+        other = Prescription.objects.create(
+            visit=visit,
+            medicine_name="Ibuprofen",
+            dosage="1x1",
+            quantity=5,
+            frequency="After meals",
+            price="500.00",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            state_machine.PRESCRIPTION.transition(other, "dispensed", self.user)
+        entry = AuditLog.objects.get(action="update")
+        self.assertEqual(
+            (entry.object_id, entry.changes, entry.actor_id),
+            (other.pk, {"status": ["pending", "dispensed"]}, self.user.pk),
+        )
+
+    def test_trail_outlives_the_actor(self):
+        self.user.is_staff = True
+        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse("patient_detail", args=[self.patient.pk]),
+                {"address": "Arusha"},
+                format="json",
+            )
+        gone = self.user.pk
+        admin = User.objects.create_user(
+            email="admin@hms.test", password="secret", is_staff=True
+        )
+        self.client.force_authenticate(admin)
+        self.user.delete()
+
+        [entry] = self.client.get(
+            reverse("audit-entity", args=["patient", self.patient.pk])
+        ).data
+        self.assertEqual((entry["actor"], entry["actor_email"]), (gone, None))
+
+    def test_trails_are_for_admins(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("patient_detail", args=[self.patient.pk]))
+        entity = reverse("audit-entity", args=["patient", self.patient.pk])
+        self.assertEqual(self.client.get(entity).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(entity)
+        self.assertEqual([e["action"] for e in response.data], ["update"])
+        self.assertEqual(
+            self.client.get(reverse("audit-actor", args=[self.user.pk])).data[0]["entity"],
+            "patient",
+        )
+        self.assertEqual(
+            self.client.get(reverse("audit-entity", args=["visit", 1])).status_code, 404
+        )
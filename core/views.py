@@ -4,7 +4,8 @@ from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from django.contrib.contenttypes.models import ContentType
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from .models import (
     Visit,
     MedicalHistory,
@@ -16,14 +17,22 @@ from .models import (
     PaymentItem,
     Insurance,
     HospitalItem,
+    StateTransition,
 )
+from . import concurrency, services
+from .archive import graph_queryset, visit_graph
+from .concurrency import ConcurrentUpdate
+from .state_machine import VISIT, InvalidTransition
 from users.models import CustomUser as User
+from users.scoping import get_data_scope
 from .serializers import (
     VisitSerializer,
     MedicalHistorySerializer,
     TestSerializer,
     PrescriptionSerializer,
     PatientSerializer,
+    StateTransitionSerializer,
+    VisitBulkTransitionSerializer,
 )
 
 
@@ -36,13 +45,14 @@ class PatientListView(APIView):
     Handles GET and POST requests for the list of patients.
     """
 
+    use_read_replica = True
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         """
         Retrieve a list of all patients.
         """
-        patients = Patient.objects.all()
+        patients = get_data_scope(request).patients(Patient.objects.all())
         serializer = PatientSerializer(patients, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -99,10 +109,10 @@ class PatientDetailView(APIView):
 
     def delete(self, request, pk):
         """
-        Delete a patient record.
+        Soft-delete a patient record (and their visits).
         """
         patient = self.get_object(pk)
-        patient.delete()
+        patient.soft_delete()
         return Response(
             {"detail": "Patient record deleted successfully"},
             status=status.HTTP_204_NO_CONTENT,
@@ -115,7 +125,9 @@ class VisitListView(APIView):
     """
 
     def get(self, request):
-        visits = Visit.objects.all()
+        visits = get_data_scope(request).visits(
+            VisitSerializer.eager_load(Visit.objects.all())
+        )
         serializer = VisitSerializer(visits, many=True)
         return Response(serializer.data)
 
@@ -142,7 +154,8 @@ class VisitDetailView(APIView):
         visit = self.get_object(visit_id)  # Get the specific visit
         if visit is not None:
             serializer = VisitSerializer(visit)
-            return Response(serializer.data)  # Return visit data
+            # Return visit data, with its version for If-Match
+            return concurrency.with_etag(Response(serializer.data), visit)
         return Response(
             {"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND
         )  # Handle if visit doesn't exist
@@ -150,25 +163,88 @@ class VisitDetailView(APIView):
     def put(self, request, visit_id):
         visit = self.get_object(visit_id)
         if visit is not None:
+            if not concurrency.if_match(request, visit):
+                return concurrency.precondition_failed(visit)
             serializer = VisitSerializer(
                 visit, data=request.data, partial=False
             )  # Deserialize and validate the data
             if serializer.is_valid():
-                serializer.save()  # Save the updated visit
-                return Response(serializer.data)  # Return the updated visit data
+                try:
+                    serializer.save()  # Save the updated visit
+                except ConcurrentUpdate:
+                    return concurrency.conflict()
+                # Return the updated visit data
+                return concurrency.with_etag(Response(serializer.data), visit)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
 
     def delete(self, request, visit_id):
         visit = self.get_object(visit_id)
         if visit is not None:
-            visit.delete()  # Delete the visit
+            if not concurrency.if_match(request, visit):
+                return concurrency.precondition_failed(visit)
+            try:
+                visit.soft_delete()  # Hidden now, purged later by purge_deleted
+            except ConcurrentUpdate:
+                return concurrency.conflict()
             return Response(
                 status=status.HTTP_204_NO_CONTENT
             )  # Return 204 No Content status
         return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
 
 
+class VisitTransitionListView(APIView):
+    """
+    Status history of a visit, oldest first.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, visit_id):
+        visit = get_object_or_404(
+            get_data_scope(request).visits(Visit.objects.all()), pk=visit_id
+        )
+        transitions = (
+            StateTransition.objects.filter(
+                content_type=ContentType.objects.get_for_model(Visit),
+                object_id=visit.pk,
+            )
+            .select_related("user")
+            .order_by("created_at", "pk")
+        )
+        serializer = StateTransitionSerializer(transitions, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class VisitBulkTransitionView(APIView):
+    """
+    Move many visits to one status in a single set-based update, e.g. to
+    close the day's stale visits. Visits whose status may not move there
+    are skipped.
+    """
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def post(self, request):
+        serializer = VisitBulkTransitionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        target = serializer.validated_data["status"]
+        try:
+            moved = VISIT.bulk_transition(
+                Visit.objects.filter(pk__in=serializer.validated_data["visit_ids"]),
+                target,
+                request.user,
+                reason=serializer.validated_data["reason"],
+            )
+        except InvalidTransition as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"detail": f"{moved} visit(s) moved to {target}.", "transitioned": moved},
+            status=status.HTTP_200_OK,
+        )
+
+
 class AssignDoctorView(APIView):
     def post(self, request):
         """
@@ -206,6 +282,9 @@ class AssignDoctorView(APIView):
                     status=status.HTTP_404_NOT_FOUND,
                 )
 
+            if not concurrency.if_match(request, visit):
+                return concurrency.precondition_failed(visit)
+
             # Check if the patient is insured
             is_insured = Insurance.objects.filter(patient=patient).exists()
 
@@ -243,16 +322,20 @@ class AssignDoctorView(APIView):
                         status=status.HTTP_404_NOT_FOUND,
                     )
 
-                visit.assigned_doctor = doctor
-                visit.department = department
-                visit.status = "onprogress"
-                visit.save()
+                services.assign_doctor(visit, doctor, department, request.user)
 
-            return Response(
-                {"detail": "Doctor assigned successfully."},
-                status=status.HTTP_200_OK,
+            return concurrency.with_etag(
+                Response(
+                    {"detail": "Doctor assigned successfully."},
+                    status=status.HTTP_200_OK,
+                ),
+                visit,
             )
 
+        except ConcurrentUpdate:
+            return concurrency.conflict()
+        except InvalidTransition as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {"detail": f"An error occurred: {str(e)}"},
@@ -332,12 +415,43 @@ class DoctorConsultationView(APIView):
             )
 
 
+class PatientTimelineView(APIView):
+    """
+    A patient's visits, newest first, each with its histories, tests,
+    prescriptions, payments, invoice, comments and vitals. Archived visits
+    are read from cold storage and merged in, flagged with ``archived``.
+    """
+
+    use_read_replica = True
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        patient = get_object_or_404(Patient, pk=pk)
+        scope = get_data_scope(request)
+
+        visits = [
+            {**visit_graph(visit), "archived": False}
+            for visit in graph_queryset(scope.visits(patient.visits.all()))
+        ]
+        visits += [
+            {**archived.graph(), "archived": True}
+            for archived in scope.visits(patient.archived_visits.all())
+        ]
+        visits.sort(key=lambda v: (v["visit_date"], v["id"]), reverse=True)
+        return Response(
+            {"patient": patient.id, "visits": visits}, status=status.HTTP_200_OK
+        )
+
+
 # --- Medical History ---
 class MedicalHistoryListView(APIView):
+    use_read_replica = True
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        histories = MedicalHistory.objects.all()
+        histories = get_data_scope(request).patients(
+            MedicalHistory.objects.all(), "patient"
+        )
         serializer = MedicalHistorySerializer(histories, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -456,23 +570,11 @@ class RecordTestResultView(APIView):
             # Fetch the test object
             test = Test.objects.get(id=test_id)
 
-            # Check if the test is pending
-            if test.status != "pending":
-                return Response(
-                    {"detail": "Test already completed or not in pending state."},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            # Use a transaction to ensure atomicity for both the result creation and status update
-            with transaction.atomic():
-                # Record the test result
-                test_result = TestResult.objects.create(
-                    test=test, result_details=result_details
-                )
-
-                # Update the test status to 'completed'
-                test.status = "completed"
-                test.save()
+            # Record the result; refused unless the test is still pending
+            try:
+                services.record_test_result(test, result_details, request.user)
+            except InvalidTransition as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
             return Response(
                 {"detail": "Test result recorded successfully."},
@@ -484,8 +586,7 @@ class RecordTestResultView(APIView):
                 {"detail": "Test not found."}, status=status.HTTP_404_NOT_FOUND
             )
         except Exception as e:
-            # Log the error for further analysis (optional)
-            print(f"Error: {e}")
+            logger.exception(f"Error recording test result: {e}")
             return Response(
                 {"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
@@ -495,7 +596,9 @@ class TestAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, visit_id):
-        tests = Test.objects.filter(visit_id=visit_id)
+        tests = get_data_scope(request).visits(
+            TestSerializer.eager_load(Test.objects.filter(visit_id=visit_id)), "visit"
+        )
         serializer = TestSerializer(tests, many=True)
         return Response(serializer.data)
 
@@ -531,7 +634,9 @@ class TestListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        tests = Test.objects.all()
+        tests = get_data_scope(request).visits(
+            TestSerializer.eager_load(Test.objects.all()), "visit"
+        )
         serializer = TestSerializer(tests, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -568,7 +673,9 @@ class PrescriptionListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        prescriptions = Prescription.objects.all()
+        prescriptions = get_data_scope(request).visits(
+            Prescription.objects.all(), "visit"
+        )
         serializer = PrescriptionSerializer(prescriptions, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -616,20 +723,26 @@ class AddPrescriptionView(APIView):
                     {"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND
                 )
 
+            # The catalogue items medicines are billed as (optional)
+            items = HospitalItem.objects.in_bulk(
+                {p["item_id"] for p in prescriptions if p.get("item_id")}
+            )
+
             # Start a transaction for atomic operation
             with transaction.atomic():
                 for prescription_data in prescriptions:
-                    # Validate each prescription entry
+                    item = items.get(prescription_data.get("item_id"))
+                    if prescription_data.get("item_id") and item is None:
+                        return Response(
+                            {"detail": f"Item {prescription_data['item_id']} not found."},
+                            status=status.HTTP_400_BAD_REQUEST,
+                        )
+                    # Validate each prescription entry; the price defaults
+                    # to the item's
                     if not all(
                         key in prescription_data
-                        for key in [
-                            "medicine_name",
-                            "dosage",
-                            "quantity",
-                            "frequency",
-                            "price",
-                        ]
-                    ):
+                        for key in ["medicine_name", "dosage", "quantity", "frequency"]
+                    ) or ("price" not in prescription_data and item is None):
                         return Response(
                             {"detail": "Missing required fields in prescription."},
                             status=status.HTTP_400_BAD_REQUEST,
@@ -639,10 +752,11 @@ class AddPrescriptionView(APIView):
                     Prescription.objects.create(
                         visit=visit,
                         medicine_name=prescription_data["medicine_name"],
+                        item=item,
                         dosage=prescription_data["dosage"],
                         quantity=prescription_data["quantity"],
                         frequency=prescription_data["frequency"],
-                        price=prescription_data["price"],
+                        price=prescription_data.get("price", getattr(item, "price", None)),
                     )
 
             return Response(
@@ -651,8 +765,7 @@ class AddPrescriptionView(APIView):
             )
 
         except Exception as e:
-            # Optionally log the exception
-            print(f"Error: {str(e)}")  # Replace with a proper logging mechanism
+            logger.exception(f"Error adding prescriptions: {e}")
             return Response(
                 {"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
@@ -667,65 +780,52 @@ class DispenseMedicinesView(APIView):
             visit_id = request.data.get("visit_id")
             visit = Visit.objects.get(id=visit_id)
 
-            # Fetch all prescriptions for the visit that are either pending or already dispensed
-            prescriptions = Prescription.objects.filter(visit=visit)
-            if not prescriptions.exists():
+            # Dispense the pending prescriptions, noting those dispensed before
+            medicines_dispensed, medicines_already_dispensed = (
+                services.dispense_prescriptions(visit, request.user)
+            )
+            if not (medicines_dispensed or medicines_already_dispensed):
                 return Response(
                     {"detail": "No prescriptions found."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            # Begin a transaction to ensure atomicity
-            with transaction.atomic():
-                medicines_dispensed = []
-                medicines_already_dispensed = []
-
-                for prescription in prescriptions:
-                    if prescription.status == "pending":
-                        # Mark as dispensed
-                        prescription.status = "dispensed"
-                        prescription.save()
-                        medicines_dispensed.append(prescription.medicine_name)
-                    elif prescription.status == "dispensed":
-                        # If already dispensed, keep track for logging or error handling
-                        medicines_already_dispensed.append(prescription.medicine_name)
-
-                # Log the results of dispensing
-                if medicines_dispensed:
-                    logger.info(
-                        f"Medicines dispensed for visit {visit_id}: {', '.join(medicines_dispensed)}"
-                    )
-                if medicines_already_dispensed:
-                    logger.info(
-                        f"Medicines already dispensed for visit {visit_id}: {', '.join(medicines_already_dispensed)}"
-                    )
+            # Log the results of dispensing
+            if medicines_dispensed:
+                logger.info(
+                    f"Medicines dispensed for visit {visit_id}: {', '.join(medicines_dispensed)}"
+                )
+            if medicines_already_dispensed:
+                logger.info(
+                    f"Medicines already dispensed for visit {visit_id}: {', '.join(medicines_already_dispensed)}"
+                )
 
-                # Prepare response based on the dispensing outcome
-                if medicines_dispensed and medicines_already_dispensed:
-                    return Response(
-                        {
-                            "detail": "Medicines dispensed successfully, some were already dispensed.",
-                            "dispensed_medicines": medicines_dispensed,
-                            "already_dispensed_medicines": medicines_already_dispensed,
-                        },
-                        status=status.HTTP_200_OK,
-                    )
-                elif medicines_dispensed:
-                    return Response(
-                        {
-                            "detail": "Medicines dispensed successfully.",
-                            "dispensed_medicines": medicines_dispensed,
-                        },
-                        status=status.HTTP_200_OK,
-                    )
-                else:
-                    return Response(
-                        {
-                            "detail": "All medicines were already dispensed.",
-                            "already_dispensed_medicines": medicines_already_dispensed,
-                        },
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
+            # Prepare response based on the dispensing outcome
+            if medicines_dispensed and medicines_already_dispensed:
+                return Response(
+                    {
+                        "detail": "Medicines dispensed successfully, some were already dispensed.",
+                        "dispensed_medicines": medicines_dispensed,
+                        "already_dispensed_medicines": medicines_already_dispensed,
+                    },
+                    status=status.HTTP_200_OK,
+                )
+            elif medicines_dispensed:
+                return Response(
+                    {
+                        "detail": "Medicines dispensed successfully.",
+                        "dispensed_medicines": medicines_dispensed,
+                    },
+                    status=status.HTTP_200_OK,
+                )
+            else:
+                return Response(
+                    {
+                        "detail": "All medicines were already dispensed.",
+                        "already_dispensed_medicines": medicines_already_dispensed,
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
         except Visit.DoesNotExist:
             logger.error(f"Visit with ID {visit_id} not found.")
@@ -762,6 +862,9 @@ class CompleteVisitView(APIView):
                     {"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND
                 )
 
+            if not concurrency.if_match(request, visit):
+                return concurrency.precondition_failed(visit)
+
             # Check if the patient is insured or not
             is_insured = (
                 visit.patient.payment_method == "insurance"
@@ -779,19 +882,21 @@ class CompleteVisitView(APIView):
                         status=status.HTTP_400_BAD_REQUEST,
                     )
 
-            # Begin a transaction to ensure atomicity
-            with transaction.atomic():
-                visit.status = "completed"
-                visit.is_active = False
-                visit.save()
+            services.complete_visit(visit, request.user)
+            logger.info(f"Visit {visit_id} marked as completed.")
 
-                # Log completion
-                logger.info(f"Visit {visit_id} marked as completed.")
-
-            return Response(
-                {"detail": "Visit marked as completed."}, status=status.HTTP_200_OK
+            return concurrency.with_etag(
+                Response(
+                    {"detail": "Visit marked as completed."}, status=status.HTTP_200_OK
+                ),
+                visit,
             )
 
+        except ConcurrentUpdate:
+            logger.warning(f"Visit {visit_id} was changed while being completed.")
+            return concurrency.conflict()
+        except InvalidTransition as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error completing visit {visit_id}: {str(e)}")
             return Response(
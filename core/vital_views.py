@@ -0,0 +1,235 @@
+import logging
+from datetime import timedelta
+from django.db.models import Avg, Count
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from users.scoping import get_data_scope
+from .models import Patient, Visit, Vital
+from .serializers import VitalSerializer
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bucket functions used to downsample vitals for charts
+TREND_INTERVALS = {
+    "hour": TruncHour,
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+# Maximum number of readings accepted in a single batch submission
+MAX_BATCH_SIZE = 500
+
+# Readings returned per page of the vitals list, by default and at most
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+
+
+def _parse_datetime(value):
+    """None when ``value`` is empty; ValueError when it is not a datetime."""
+    if not value:
+        return None
+    # parse_datetime returns None for malformed input and raises
+    # ValueError for well-formed but impossible values
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"{value!r} is not a datetime.")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def pick_trend_interval(start, end):
+    """
+    Choose a bucket size that keeps a chart series to a few hundred points.
+    """
+    span = end - start
+    if span <= timedelta(days=2):
+        return "hour"
+    if span <= timedelta(days=180):
+        return "day"
+    if span <= timedelta(days=730):
+        return "week"
+    return "month"
+
+
+class VitalListView(APIView):
+    """
+    Handles GET and POST requests for vitals.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Retrieve vitals, optionally filtered by visit (newest first).
+        ``?limit=`` caps the page; ``?before=`` a datetime pages back.
+        """
+        try:
+            visit_id = request.query_params.get("visit")
+            visit_id = int(visit_id) if visit_id else None
+            limit = int(request.query_params.get("limit", DEFAULT_LIST_LIMIT))
+            before = _parse_datetime(request.query_params.get("before"))
+        except ValueError:
+            return Response(
+                {
+                    "detail": "visit and limit must be integers and before an "
+                    "ISO-8601 datetime."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        vitals = get_data_scope(request).visits(
+            Vital.objects.order_by("-recorded_at", "-pk"), "visit"
+        )
+        if visit_id is not None:
+            vitals = vitals.filter(visit_id=visit_id)
+        if before is not None:
+            vitals = vitals.filter(recorded_at__lt=before)
+        vitals = vitals[: max(1, min(limit, MAX_LIST_LIMIT))]
+        serializer = VitalSerializer(vitals, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """
+        Record a single set of vitals.
+        """
+        serializer = VitalSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(recorded_by=request.user)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VitalBatchView(APIView):
+    """
+    Accepts a list of readings from triage devices and stores them in one insert.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not isinstance(request.data, list) or not request.data:
+            return Response(
+                {"detail": "Expected a non-empty list of vitals."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(request.data) > MAX_BATCH_SIZE:
+            return Response(
+                {"detail": f"A batch may contain at most {MAX_BATCH_SIZE} vitals."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = VitalSerializer(data=request.data, many=True)
+        if serializer.is_valid():
+            serializer.save(recorded_by=request.user)
+            logger.info(f"Stored a batch of {len(serializer.data)} vitals.")
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VisitVitalListView(APIView):
+    """
+    Lists the vitals recorded during a visit in chronological order.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, visit_id):
+        visit = get_object_or_404(Visit, pk=visit_id)
+        vitals = get_data_scope(request).visits(
+            Vital.objects.filter(visit=visit), "visit"
+        ).order_by("recorded_at")
+        serializer = VitalSerializer(vitals, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class PatientVitalTrendView(APIView):
+    """
+    Returns a downsampled series of a patient's vitals for charting.
+
+    Query parameters:
+      - start / end: ISO-8601 datetimes (defaults to the last 30 days)
+      - interval: hour, day, week or month (picked from the range if omitted)
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        patient = get_object_or_404(Patient, pk=pk)
+
+        try:
+            end = _parse_datetime(request.query_params.get("end")) or timezone.now()
+            start = _parse_datetime(
+                request.query_params.get("start")
+            ) or end - timedelta(days=30)
+        except ValueError:
+            return Response(
+                {"detail": "start and end must be ISO-8601 datetimes."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if start >= end:
+            return Response(
+                {"detail": "start must be before end."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        interval = request.query_params.get("interval") or pick_trend_interval(
+            start, end
+        )
+        if interval not in TREND_INTERVALS:
+            return Response(
+                {
+                    "detail": f"Invalid interval. Must be one of: {', '.join(TREND_INTERVALS)}."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # One grouped query served by the (patient, recorded_at) index
+        buckets = (
+            Vital.objects.filter(
+                patient=patient, recorded_at__gte=start, recorded_at__lt=end
+            )
+            .annotate(period=TREND_INTERVALS[interval]("recorded_at"))
+            .values("period")
+            .annotate(
+                readings=Count("id"),
+                weight=Avg("weight"),
+                temperature=Avg("temperature"),
+                systolic=Avg("systolic"),
+                diastolic=Avg("diastolic"),
+            )
+            .order_by("period")
+        )
+
+        return Response(
+            {
+                "patient": patient.id,
+                "interval": interval,
+                "start": start,
+                "end": end,
+                "series": [
+                    {
+                        "period": bucket["period"],
+                        "readings": bucket["readings"],
+                        "weight": self._round(bucket["weight"], 2),
+                        "temperature": self._round(bucket["temperature"], 1),
+                        "systolic": self._round(bucket["systolic"], 0),
+                        "diastolic": self._round(bucket["diastolic"], 0),
+                    }
+                    for bucket in buckets
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @staticmethod
+    def _round(value, digits):
+        return None if value is None else round(float(value), digits)
@@ -0,0 +1,320 @@
+"""
+Audit trail of who changed patients, medical histories, prescriptions,
+payments and staff accounts.
+
+Model signals (see core.signals) diff each saved instance against the
+values it was loaded with and queue an unsaved AuditLog once the
+transaction commits, so rolled-back changes are never audited. A daemon
+thread drains the queue and writes it with one bulk INSERT per batch;
+the request only pays for the diff and a queue put.
+
+Status changes made through core.state_machine are audited too: the
+single-row path with record_update(), the set-based path with one
+INSERT ... SELECT inside the transition's transaction. Other changes made
+with queryset.update() bypass model signals and are not audited.
+
+Entries still queued when the process is killed outright are lost; a
+normal shutdown flushes them. A batch the database keeps refusing is
+retried HMS_AUDIT_WRITE_ATTEMPTS times, then written row by row; rows that
+still fail are logged and dropped.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from core.models import AuditLog, MedicalHistory, Patient, Payment, Prescription
+
+logger = logging.getLogger(__name__)
+
+AUDITED_MODELS = (Patient, MedicalHistory, Prescription, Payment, get_user_model())
+
+MASK = "********"
+# Never stored, only noted as changed
+MASKED_FIELDS = {"password"}
+# Bookkeeping that changes on every save or login
+IGNORED_FIELDS = {"last_login", "updated_at", "version"}
+
+_request = ContextVar("audit_request", default=None)
+
+
+class AuditContextMiddleware:
+    """
+    Remembers the current request so changes can be attributed to its user.
+    DRF authenticates inside the view and sets ``request.user`` on the
+    underlying request, so the user is read when the change happens.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+
+def current_actor_id():
+    user = getattr(_request.get(), "user", None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+# --- Capture ---
+
+
+def _audited_fields(instance):
+    return [
+        field
+        for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in IGNORED_FIELDS
+    ]
+
+
+def _stored(field, value):
+    try:
+        # Compare what would be stored, not e.g. a date still held as a string
+        return field.to_python(value)
+    except ValidationError:
+        return value
+
+
+def snapshot(instance):
+    """
+    The audited values an instance holds now, deferred fields skipped. Taken
+    for every loaded instance, so it only copies; diff() normalises.
+    """
+    return {
+        field.attname: instance.__dict__[field.attname]
+        for field in _audited_fields(instance)
+        if field.attname in instance.__dict__
+    }
+
+
+def diff(instance, before, update_fields=None):
+    """
+    ``{field: [old, new]}`` for the audited fields that differ from
+    ``before`` (empty for a new instance); masked fields show only MASK.
+    """
+    changes = {}
+    for field in _audited_fields(instance):
+        name = field.attname
+        if name not in instance.__dict__:
+            continue
+        if update_fields is not None and field.name not in update_fields:
+            continue
+        if before and name not in before:
+            continue  # Deferred when loaded, so the old value is unknown
+        old = _stored(field, before[name]) if before else None
+        new = _stored(field, instance.__dict__[name])
+        if old != new:
+            masked = field.name in MASKED_FIELDS
+            changes[name] = [MASK if masked else old, MASK if masked else new]
+    return changes
+
+
+def record(instance, action, changes, actor_id=None):
+    """
+    Queue an entry for when the transaction commits. The actor defaults to
+    the user of the current request.
+    """
+    entry = AuditLog(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=instance.pk,
+        action=action,
+        changes=changes,
+        actor_id=actor_id if actor_id is not None else current_actor_id(),
+    )
+    transaction.on_commit(lambda: writer.put(entry))
+
+
+def record_update(instance, update_fields, actor_id=None):
+    """
+    Audit an update written without save(), so without the model signals,
+    against the values the instance was loaded with.
+    """
+    changes = diff(instance, getattr(instance, "_audit_values", {}), update_fields)
+    if changes:
+        record(instance, "update", changes, actor_id)
+    instance._audit_values = snapshot(instance)
+
+
+# --- Buffered writer ---
+
+
+class AuditWriter:
+    """
+    Queue of AuditLog rows written by a background thread in batches of up
+    to HMS_AUDIT_BATCH_SIZE, at most HMS_AUDIT_FLUSH_INTERVAL seconds after
+    they were queued. With HMS_AUDIT_ASYNC off, rows are written at once.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, entry):
+        if not getattr(settings, "HMS_AUDIT_ASYNC", True):
+            entry.save()
+            return
+        self.queue.put(entry)
+        if self.thread is None or not self.thread.is_alive():
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(
+                target=self.run, name="audit-writer", daemon=True
+            )
+            self.thread.start()
+
+    def run(self):
+        batch_size = getattr(settings, "HMS_AUDIT_BATCH_SIZE", 500)
+        interval = getattr(settings, "HMS_AUDIT_FLUSH_INTERVAL", 1.0)
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.write(batch)
+            close_old_connections()
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        # The trail must not take the writer thread down, nor hold it forever
+        attempts = getattr(settings, "HMS_AUDIT_WRITE_ATTEMPTS", 3)
+        for attempt in range(1, attempts + 1):
+            try:
+                AuditLog.objects.bulk_create(
+                    batch, batch_size=getattr(settings, "HMS_AUDIT_BATCH_SIZE", 500)
+                )
+                return
+            except Exception:
+                logger.exception(
+                    "Could not write %d audit entries (attempt %d of %d)",
+                    len(batch),
+                    attempt,
+                    attempts,
+                )
+                if attempt < attempts:
+                    time.sleep(getattr(settings, "HMS_AUDIT_FLUSH_INTERVAL", 1.0))
+        # One bad row (e.g. a value the JSON column refuses) fails the whole
+        # INSERT; write the rest and keep the rejected ones in the log
+        for entry in batch:
+            entry.pk = None
+            try:
+                entry.save(force_insert=True)
+            except Exception:
+                logger.exception(
+                    "Dropped audit entry: %s %s %s by %s: %r",
+                    entry.action,
+                    entry.content_type_id,
+                    entry.object_id,
+                    entry.actor_id,
+                    entry.changes,
+                )
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+# --- Query API ---
+
+
+def _trail(queryset, request):
+    """
+    Newest first (ids follow the order entries were queued in); ``?before=``
+    an id pages back, ``?limit=`` caps the page.
+    """
+    try:
+        limit = min(int(request.query_params.get("limit", 100)), 1000)
+        before = request.query_params.get("before")
+        if before:
+            queryset = queryset.filter(pk__lt=int(before))
+    except ValueError:
+        return Response(
+            {"detail": "limit and before must be integers."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    entries = queryset.select_related("content_type", "actor").order_by("-pk")[:limit]
+    return Response(
+        [
+            {
+                "id": entry.id,
+                "entity": entry.content_type.model,
+                "object_id": entry.object_id,
+                "action": entry.action,
+                "changes": entry.changes,
+                "actor": entry.actor_id,
+                "actor_email": entry.actor.email if entry.actor else None,
+                "created_at": entry.created_at,
+            }
+            for entry in entries
+        ]
+    )
+
+
+class AuditEntityView(APIView):
+    """
+    Audit trail of one record, e.g. ``audit/patient/42/``. The entity is the
+    model name of an audited model (patient, medicalhistory, prescription,
+    payment, customuser).
+    """
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, entity, object_id):
+        models = {model._meta.model_name: model for model in AUDITED_MODELS}
+        if entity not in models:
+            return Response(
+                {"detail": f"{entity} is not audited."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return _trail(
+            AuditLog.objects.filter(
+                content_type=ContentType.objects.get_for_model(models[entity]),
+                object_id=object_id,
+            ),
+            request,
+        )
+
+
+class AuditActorView(APIView):
+    """Everything one staff member changed."""
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, user_id):
+        return _trail(AuditLog.objects.filter(actor_id=user_id), request)
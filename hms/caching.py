@@ -0,0 +1,60 @@
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def _version_key(namespace):
+    return f"views:{namespace}:version"
+
+
+def namespace_version(namespace):
+    # A fresh timestamp rather than a counter, so an evicted version key can
+    # never bring back entries stored under an older version.
+    return cache.get_or_set(_version_key(namespace), time.time_ns, None)
+
+
+def invalidate_views(*namespaces):
+    """Drop every response cached under ``namespaces``."""
+    for namespace in namespaces:
+        cache.set(_version_key(namespace), time.time_ns(), None)
+
+
+def response_cache_key(namespace, request):
+    user = request.user
+    role = user.role if user and user.is_authenticated else "anonymous"
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"views:{namespace}:{namespace_version(namespace)}:{role}:{path}"
+
+
+def cache_response(namespace, timeout=None):
+    """
+    Cache the successful responses of an APIView GET handler per user role and
+    query string. Entries live for ``timeout`` seconds (HMS_VIEW_CACHE_TIMEOUT
+    by default) or until invalidate_views(namespace) is called, which the model
+    signals do whenever the underlying rows change.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = response_cache_key(namespace, request)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data, status=status.HTTP_200_OK)
+
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(
+                    key,
+                    response.data,
+                    timeout or getattr(settings, "HMS_VIEW_CACHE_TIMEOUT", 300),
+                )
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+REPLICA_ALIAS = "replica"
+
+# Set for the duration of a request that may be served from the replica
+_read_from_replica = ContextVar("hms_read_from_replica", default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def route_reads_to_replica():
+    """Route reads to the replica until reset_reads(token) is called."""
+    return _read_from_replica.set(True)
+
+
+def reset_reads(token):
+    _read_from_replica.reset(token)
+
+
+@contextmanager
+def read_from_replica():
+    token = route_reads_to_replica()
+    try:
+        yield
+    finally:
+        reset_reads(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to the "replica" alias while a replica-eligible request is
+    being served (see hms.middleware.ReplicaRoutingMiddleware). Everything
+    else, including all writes and migrations, uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and replica_configured():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from core.models import IdempotencyKey
+from users.authentication import CachedJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+KEY_HEADER = "HTTP_IDEMPOTENCY_KEY"
+MAX_KEY_LENGTH = 255
+
+
+def _authenticated_user_id(request):
+    """
+    The JWT user behind the request. DRF authenticates inside the view, after
+    middleware has run, so the (cached) authenticator is consulted here;
+    failures are left for the view to report.
+    """
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except APIException:
+        return None
+    return result[0].pk if result else None
+
+
+def expiry_cutoff():
+    hours = getattr(settings, "HMS_IDEMPOTENCY_KEY_TTL_HOURS", 24)
+    return timezone.now() - timedelta(hours=hours)
+
+
+def lease_cutoff():
+    """Claims without a response older than this belong to a dead request."""
+    seconds = getattr(settings, "HMS_IDEMPOTENCY_CLAIM_LEASE_SECONDS", 60)
+    return timezone.now() - timedelta(seconds=seconds)
+
+
+def _in_progress():
+    return JsonResponse(
+        {"detail": "A request with this Idempotency-Key is still being processed."},
+        status=409,
+    )
+
+
+def fingerprint(user_id, method, path, key):
+    return hashlib.sha256(f"{user_id}|{method}|{path}|{key}".encode()).hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    Makes POSTs to views marked ``idempotent = True`` safe to retry. The first
+    request carrying an Idempotency-Key header runs normally and its response
+    is stored; a retry with the same key, user and path gets the stored
+    response back (with ``Idempotent-Replayed: true``) without the view, and
+    so the billing tables, being touched.
+
+    - A retry while the first request is still running gets 409. A claim
+      left unanswered for HMS_IDEMPOTENCY_CLAIM_LEASE_SECONDS (its worker
+      died) is taken over by the next retry.
+    - Reusing a key with a different body gets 422.
+    - 5xx responses are not stored, so the client can retry them.
+
+    Requests without the header are not affected. Stored keys expire after
+    HMS_IDEMPOTENCY_KEY_TTL_HOURS; purge_idempotency_keys removes them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._idempotency_record = None
+        response = self.get_response(request)
+
+        record = request._idempotency_record
+        if record is not None:
+            # A 409 means another request changed the row first; the retry
+            # should run again against the reloaded state, not replay it
+            if (
+                response.status_code >= 500
+                or response.status_code == 409
+                or response.streaming
+            ):
+                record.delete()
+            else:
+                record.status_code = response.status_code
+                record.response_body = response.content
+                record.content_type = response.get("Content-Type", "")
+                record.save(update_fields=["status_code", "response_body", "content_type"])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        key = request.META.get(KEY_HEADER)
+        view_class = getattr(view_func, "view_class", None)
+        if (
+            not key
+            or request.method != "POST"
+            or not getattr(view_class, "idempotent", False)
+        ):
+            return None
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse(
+                {"detail": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters."},
+                status=400,
+            )
+
+        user_id = _authenticated_user_id(request)
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        claim = {
+            "fingerprint": fingerprint(user_id, request.method, request.path, key),
+            "key": key,
+            "user_id": user_id,
+            "request_hash": request_hash,
+        }
+        try:
+            # Committed on its own, so concurrent retries see the claim
+            with transaction.atomic():
+                request._idempotency_record = IdempotencyKey.objects.create(**claim)
+            return None
+        except IntegrityError:
+            pass
+
+        stored = IdempotencyKey.objects.filter(fingerprint=claim["fingerprint"]).first()
+        if stored is None or stored.created_at < expiry_cutoff():
+            # Gone (the first attempt failed) or expired: run the request again
+            return self._reclaim(request, claim, stored)
+        if stored.request_hash != request_hash:
+            return JsonResponse(
+                {"detail": "This Idempotency-Key was used with a different request."},
+                status=422,
+            )
+        if stored.status_code is None:
+            if stored.created_at < lease_cutoff():
+                # The worker holding the claim died without answering
+                logger.warning("Taking over stale claim on Idempotency-Key %s", key)
+                return self._reclaim(request, claim, stored)
+            return _in_progress()
+        logger.info("Replaying stored response for Idempotency-Key %s", key)
+        response = HttpResponse(
+            bytes(stored.response_body or b""),
+            status=stored.status_code,
+            content_type=stored.content_type or None,
+        )
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    def _reclaim(self, request, claim, stored):
+        # Only the row that was read is removed: of two retries taking it
+        # over, the second then fails to claim and gets 409
+        if stored is not None:
+            IdempotencyKey.objects.filter(pk=stored.pk).delete()
+        try:
+            with transaction.atomic():
+                request._idempotency_record = IdempotencyKey.objects.create(**claim)
+        except IntegrityError:
+            # Another retry took it over first
+            return _in_progress()
+        return None
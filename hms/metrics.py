@@ -0,0 +1,223 @@
+import atexit
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.views import APIView
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """
+    Per-process metrics, keyed by (route, method). Recording is a lock and a
+    few integer additions; nothing is formatted until /metrics is scraped.
+
+    When HMS_METRICS_DIR is set every process periodically dumps its series
+    to ``<dir>/metrics-<pid>.json`` and the /metrics view sums all the files,
+    so any worker can answer for the whole server.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.last_flush = time.monotonic()
+
+    def record(self, route, method, status_code, duration, queries, size):
+        with self.lock:
+            entry = self.series.get((route, method))
+            if entry is None:
+                entry = self.series[(route, method)] = {
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                    "errors": 0,
+                    "queries": 0,
+                    "bytes": 0,
+                    "statuses": {},
+                }
+            entry["buckets"][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+            entry["sum"] += duration
+            entry["count"] += 1
+            entry["queries"] += queries
+            entry["bytes"] += size
+            if status_code >= 500:
+                entry["errors"] += 1
+            status = str(status_code)
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {
+                    "route": route,
+                    "method": method,
+                    **entry,
+                    "buckets": list(entry["buckets"]),
+                    "statuses": dict(entry["statuses"]),
+                }
+                for (route, method), entry in self.series.items()
+            ]
+
+    def maybe_flush(self):
+        interval = getattr(settings, "HMS_METRICS_FLUSH_INTERVAL", 5)
+        if time.monotonic() - self.last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        directory = getattr(settings, "HMS_METRICS_DIR", None)
+        self.last_flush = time.monotonic()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename so a scrape never reads a half-written file
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path, os.path.join(directory, f"metrics-{os.getpid()}.json"))
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def collect():
+    """Merge the series of every process into one list."""
+    own_file = f"metrics-{os.getpid()}.json"
+    snapshots = [registry.snapshot()]
+    directory = getattr(settings, "HMS_METRICS_DIR", None)
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name == own_file or not (
+                name.startswith("metrics-") and name.endswith(".json")
+            ):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # The process is mid-write or gone
+
+    merged = {}
+    for snapshot in snapshots:
+        for entry in snapshot:
+            key = (entry["route"], entry["method"])
+            total = merged.get(key)
+            if total is None:
+                merged[key] = {
+                    **entry,
+                    "buckets": list(entry["buckets"]),
+                    "statuses": dict(entry["statuses"]),
+                }
+                continue
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], entry["buckets"])]
+            for field in ("sum", "count", "errors", "queries", "bytes"):
+                total[field] += entry[field]
+            for status, count in entry["statuses"].items():
+                total["statuses"][status] = total["statuses"].get(status, 0) + count
+    return [merged[key] for key in sorted(merged)]
+
+
+def _labels(**labels):
+    return ",".join(
+        '{}="{}"'.format(
+            name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+        )
+        for name, value in labels.items()
+    )
+
+
+def render(series):
+    """Format merged series in the Prometheus text exposition format."""
+    lines = [
+        "# HELP hms_request_duration_seconds API request latency.",
+        "# TYPE hms_request_duration_seconds histogram",
+    ]
+    for entry in series:
+        labels = _labels(route=entry["route"], method=entry["method"])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), entry["buckets"]):
+            cumulative += count
+            lines.append(
+                f'hms_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+            )
+        lines.append(f"hms_request_duration_seconds_sum{{{labels}}} {entry['sum']:.6f}")
+        lines.append(f"hms_request_duration_seconds_count{{{labels}}} {entry['count']}")
+
+    counters = [
+        ("hms_requests_total", "API requests by status code."),
+        ("hms_request_errors_total", "API requests that ended in a 5xx response."),
+        ("hms_db_queries_total", "SQL queries run by API requests."),
+        ("hms_response_bytes_total", "Bytes of API response bodies."),
+    ]
+    fields = {
+        "hms_request_errors_total": "errors",
+        "hms_db_queries_total": "queries",
+        "hms_response_bytes_total": "bytes",
+    }
+    for name, help_text in counters:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for entry in series:
+            if name == "hms_requests_total":
+                for status, count in sorted(entry["statuses"].items()):
+                    labels = _labels(
+                        route=entry["route"], method=entry["method"], status=status
+                    )
+                    lines.append(f"{name}{{{labels}}} {count}")
+            else:
+                labels = _labels(route=entry["route"], method=entry["method"])
+                lines.append(f"{name}{{{labels}}} {entry[fields[name]]}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status, query count (from QueryBudgetMiddleware, which
+    must come after it) and response size for every request served by a DRF
+    APIView, labelled by the URL route pattern rather than the concrete path.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view_class = getattr(match.func, "view_class", None) if match else None
+        if view_class is not None and issubclass(view_class, APIView):
+            registry.record(
+                match.route,
+                request.method,
+                response.status_code,
+                duration,
+                getattr(response, "query_count", 0),
+                0 if response.streaming else len(response.content),
+            )
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Requires ``Authorization: Bearer <token>``
+    when HMS_METRICS_TOKEN is set.
+    """
+    token = getattr(settings, "HMS_METRICS_TOKEN", None)
+    if token and request.META.get("HTTP_AUTHORIZATION") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render(collect()), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
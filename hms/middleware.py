@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from . import db_routers
+
+query_logger = logging.getLogger("hms.queries")
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _client_key(request):
+    """
+    Identify the client before authentication has run: the bearer token when
+    present, else the remote address.
+    """
+    ident = request.META.get("HTTP_AUTHORIZATION") or request.META.get(
+        "REMOTE_ADDR", ""
+    )
+    return "replica:pin:" + hashlib.md5(ident.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serves safe requests to views marked ``use_read_replica = True`` from the
+    read replica. A client that has just written is pinned to the primary for
+    HMS_REPLICA_STICKY_SECONDS so it always reads its own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not db_routers.replica_configured():
+            return self.get_response(request)
+
+        request._replica_token = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if request._replica_token is not None:
+                db_routers.reset_reads(request._replica_token)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            cache.set(
+                _client_key(request),
+                True,
+                getattr(settings, "HMS_REPLICA_STICKY_SECONDS", 10),
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not hasattr(request, "_replica_token"):
+            return None
+        view_class = getattr(view_func, "view_class", None)
+        if (
+            request.method in SAFE_METHODS
+            and getattr(view_class, "use_read_replica", False)
+            and not cache.get(_client_key(request))
+        ):
+            request._replica_token = db_routers.route_reads_to_replica()
+        return None
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """connection.execute_wrapper() callable counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the SQL queries and database time of every request without keeping
+    the statements themselves, so it is safe to leave on in production.
+
+    The totals are sent as a Server-Timing header and kept on the response
+    as ``response.query_count`` for MetricsMiddleware and tests. With
+    HMS_QUERY_BUDGET_LOGGING on they are also logged as JSON on the
+    "hms.queries" logger, and a request whose URL name has a budget in
+    HMS_QUERY_BUDGETS and runs more queries is logged as a warning, or raises
+    QueryBudgetExceeded when HMS_QUERY_BUDGET_STRICT is on (as in the test
+    suite).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = counter.duration * 1000
+
+        response["Server-Timing"] = (
+            f'db;dur={db_ms:.1f};desc="{counter.count} queries", total;dur={total_ms:.1f}'
+        )
+        response.query_count = counter.count
+        if not getattr(settings, "HMS_QUERY_BUDGET_LOGGING", True):
+            return response
+
+        match = request.resolver_match
+        url_name = match.url_name if match else None
+        budget = getattr(settings, "HMS_QUERY_BUDGETS", {}).get(url_name)
+        stats = {
+            "method": request.method,
+            "path": request.path,
+            "url_name": url_name,
+            "status": response.status_code,
+            "queries": counter.count,
+            "db_ms": round(db_ms, 1),
+            "total_ms": round(total_ms, 1),
+            "budget": budget,
+        }
+        over_budget = budget is not None and counter.count > budget
+        query_logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            json.dumps(stats),
+            extra={"query_stats": stats},
+        )
+        if over_budget and getattr(settings, "HMS_QUERY_BUDGET_STRICT", False):
+            raise QueryBudgetExceeded(
+                f"{request.method} {request.path} ({url_name}) ran {counter.count} "
+                f"queries; the budget is {budget}."
+            )
+        return response
@@ -0,0 +1,223 @@
+import cProfile
+import hashlib
+import logging
+import os
+import pstats
+import random
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import connections
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "HTTP_X_HMS_PROFILE"
+ROUTES_KEY = "profiling:routes"
+SIGNING_SALT = "hms.profiling"
+
+
+def _cache():
+    return caches[getattr(settings, "HMS_PROFILE_CACHE", "default")]
+
+
+def _route_key(route):
+    return "profiling:route:" + hashlib.md5(route.encode()).hexdigest()
+
+
+def issue_token():
+    """A short-lived value for the X-HMS-Profile header."""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign("profile")
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+            token, max_age=getattr(settings, "HMS_PROFILE_TOKEN_MAX_AGE", 300)
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class SQLRecorder:
+    """connection.execute_wrapper() callable grouping time by statement."""
+
+    def __init__(self):
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            entry = self.statements.setdefault(sql, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - started
+
+    def breakdown(self, limit=10):
+        ordered = sorted(self.statements.items(), key=lambda item: -item[1][1])
+        return [
+            {"sql": sql[:500], "count": count, "duration_ms": round(duration * 1000, 2)}
+            for sql, (count, duration) in ordered[:limit]
+        ]
+
+
+def _frame_name(filename, line, function):
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    return f"{filename}:{line}({function})"
+
+
+def top_frames(profiler, limit):
+    stats = pstats.Stats(profiler).stats
+    ordered = sorted(stats.items(), key=lambda item: -item[1][3])
+    return [
+        {
+            "function": _frame_name(*frame),
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 2),
+            "cumtime_ms": round(cumtime * 1000, 2),
+        }
+        for frame, (_, calls, tottime, cumtime, _) in ordered[:limit]
+    ]
+
+
+def store(route, profile):
+    """Append to the route's ring buffer, dropping the oldest profile when full."""
+    cache = _cache()
+    size = getattr(settings, "HMS_PROFILE_BUFFER_SIZE", 20)
+    key = _route_key(route)
+    profiles = cache.get(key, [])
+    profiles.append(profile)
+    cache.set(key, profiles[-size:], None)
+    routes = cache.get(ROUTES_KEY, set())
+    if route not in routes:
+        routes.add(route)
+        cache.set(ROUTES_KEY, routes, None)
+
+
+def stored(route=None):
+    cache = _cache()
+    routes = sorted(cache.get(ROUTES_KEY, set()))
+    selected = [route] if route else routes
+    profiles = []
+    for name in selected:
+        profiles.extend(cache.get(_route_key(name), []))
+    profiles.sort(key=lambda profile: profile["recorded_at"], reverse=True)
+    return routes, profiles
+
+
+def clear():
+    cache = _cache()
+    cache.delete_many(
+        [_route_key(route) for route in cache.get(ROUTES_KEY, set())] + [ROUTES_KEY]
+    )
+
+
+class ProfilingMiddleware:
+    """
+    Runs one request in HMS_PROFILE_SAMPLE_RATE, and every request with a
+    valid signed X-HMS-Profile header, under cProfile while recording the time
+    spent per SQL statement. The slowest frames and statements are kept per
+    URL route for admins to read from /api/management/profiles/.
+    Requests that are not sampled only pay for a random number.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = self.reason(request)
+        if reason is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = SQLRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this thread
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is not None:
+            statements = recorder.statements.values()
+            try:
+                store(
+                    match.route,
+                    {
+                        "route": match.route,
+                        "method": request.method,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "reason": reason,
+                        "recorded_at": timezone.now().isoformat(),
+                        "duration_ms": round(duration * 1000, 2),
+                        "queries": sum(count for count, _ in statements),
+                        "db_ms": round(sum(t for _, t in statements) * 1000, 2),
+                        "frames": top_frames(
+                            profiler, getattr(settings, "HMS_PROFILE_TOP_FRAMES", 25)
+                        ),
+                        "sql": recorder.breakdown(),
+                    },
+                )
+            except Exception:
+                # Profiling must never break the request it observed
+                logger.exception("Could not store the profile of %s", request.path)
+        return response
+
+    def reason(self, request):
+        token = request.META.get(PROFILE_HEADER)
+        if token and valid_token(token):
+            return "header"
+        rate = getattr(settings, "HMS_PROFILE_SAMPLE_RATE", 0)
+        if rate and random.randrange(rate) == 0:
+            return "sampled"
+        return None
+
+
+class ProfileListView(APIView):
+    """
+    GET lists the stored profiles, newest first (``?route=`` filters by URL
+    route). POST issues a signed X-HMS-Profile header value that forces
+    profiling for HMS_PROFILE_TOKEN_MAX_AGE seconds. DELETE empties the buffers.
+    """
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        routes, profiles = stored(request.query_params.get("route"))
+        return Response({"routes": routes, "profiles": profiles})
+
+    def post(self, request):
+        return Response(
+            {
+                "header": "X-HMS-Profile",
+                "token": issue_token(),
+                "expires_in": getattr(settings, "HMS_PROFILE_TOKEN_MAX_AGE", 300),
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    def delete(self, request):
+        clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
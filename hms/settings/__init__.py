@@ -0,0 +1,24 @@
+"""
+Django settings for hms.
+
+DJANGO_ENV selects the profile layered over base.py: "dev" (default) adds
+DEBUG and the debug toolbar, "prod" is the lean deployment profile.
+"""
+
+import os
+from django.core.exceptions import ImproperlyConfigured
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+DJANGO_ENV = os.getenv("DJANGO_ENV", "dev")
+
+if DJANGO_ENV == "prod":
+    from .prod import *  # noqa: F401,F403
+elif DJANGO_ENV == "dev":
+    from .dev import *  # noqa: F401,F403
+else:
+    raise ImproperlyConfigured(
+        f"Unknown DJANGO_ENV {DJANGO_ENV!r}. Must be one of: dev, prod."
+    )
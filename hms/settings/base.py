@@ -0,0 +1,361 @@
+"""
+Settings shared by every profile. Environment-specific overrides live in
+dev.py and prod.py; hms.settings picks one based on DJANGO_ENV.
+"""
+
+import os
+from pathlib import Path
+from datetime import timedelta
+
+# from decouple import config
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = os.getenv("SECRET_KEY")
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = False
+
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+
+# Application definition
+
+
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "corsheaders",
+    "rest_framework",
+    "core.apps.CoreConfig",
+    "users.apps.UsersConfig",
+]
+
+MIDDLEWARE = [
+    "hms.metrics.MetricsMiddleware",
+    "hms.middleware.QueryBudgetMiddleware",
+    "hms.profiling.ProfilingMiddleware",
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "hms.middleware.ReplicaRoutingMiddleware",
+    "hms.idempotency.IdempotencyMiddleware",
+    "hms.audit.AuditContextMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+# Whether /admin/ is served (prod turns it off unless ADMIN_SITE=True)
+HMS_ADMIN_SITE = True
+
+ROOT_URLCONF = "hms.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [
+            os.path.join(BASE_DIR, "templates/build"),
+        ],
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.debug",
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = "hms.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+
+# Connection reuse. With DB_POOL=True each worker process keeps a psycopg pool
+# (needs psycopg[pool]); Django requires CONN_MAX_AGE=0 in that case. Otherwise
+# connections persist for CONN_MAX_AGE seconds and are health-checked on reuse.
+DB_POOL = os.getenv("DB_POOL", "False") == "True"
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.getenv("DB_NAME"),
+        "USER": os.getenv("DB_USER"),
+        "PASSWORD": os.getenv("DB_PASSWORD"),
+        "HOST": os.getenv("DB_HOST", "127.0.0.1"),
+        "PORT": os.getenv("DB_PORT", "5432"),
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": os.getenv("CONN_HEALTH_CHECKS", "True") == "True",
+        "OPTIONS": (
+            {
+                "pool": {
+                    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+                    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                    "timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+                }
+            }
+            if DB_POOL
+            else {}
+        ),
+    }
+}
+
+# Optional streaming replica serving the views marked use_read_replica. Locally
+# a second database name on the same server (or SQLite file) works as well.
+if os.getenv("DB_REPLICA_HOST") or os.getenv("DB_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.getenv("DB_REPLICA_NAME", DATABASES["default"]["NAME"]),
+        "HOST": os.getenv("DB_REPLICA_HOST", DATABASES["default"]["HOST"]),
+        "PORT": os.getenv("DB_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["hms.db_routers.PrimaryReplicaRouter"]
+
+# Seconds a client reads from the primary after a successful write
+HMS_REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+
+
+# Caches. "default" is shared by the auth user cache, cached reference views and
+# reports: local memory unless CACHE_BACKEND is "file" or "redis" (needs redis;
+# use a shared backend when running several processes so invalidation reaches
+# all of them). "local" is always per-process and holds the login throttle.
+CACHE_BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+}
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem")
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKENDS[CACHE_BACKEND],
+        "LOCATION": os.getenv(
+            "CACHE_LOCATION",
+            {
+                "locmem": "hms-default",
+                "file": "/var/tmp/hms-cache",
+                "redis": "redis://127.0.0.1:6379/1",
+            }[CACHE_BACKEND],
+        ),
+        "KEY_PREFIX": "hms",
+    },
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "hms-local",
+    },
+}
+
+# Seconds a cached reference list (departments, items, ...) may be served
+HMS_VIEW_CACHE_TIMEOUT = int(os.getenv("VIEW_CACHE_TIMEOUT", "300"))
+
+
+# Maximum SQL queries per request, by URL name (see QueryBudgetMiddleware).
+# List endpoints must stay constant in the number of rows returned.
+HMS_QUERY_BUDGETS = {
+    "patient_list": 5,
+    "visit-list": 5,
+    "medical_history_list": 5,
+    "test_list": 6,
+    "tests": 6,
+    "prescription_list": 5,
+    "payment_list": 6,
+    "payment-item-list": 5,
+    "visit-payment-item-list": 5,
+    "invoice_list": 5,
+    "invoice-item-list": 6,
+    "hospital-item-list": 5,
+    "item-type-list": 4,
+    "insurance-company-list": 4,
+    "department_list": 4,
+    "user_list": 4,
+    "dashboard": 8,
+    "patient-timeline": 12,
+    "visit-transitions": 4,
+    "audit-entity": 3,
+    "audit-actor": 3,
+}
+# Raise instead of logging a warning when a budget is exceeded
+HMS_QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False") == "True"
+# Log every request's query stats and check the budgets. Queries are counted
+# (for Server-Timing and the metrics) either way.
+HMS_QUERY_BUDGET_LOGGING = True
+
+
+# Per-route API metrics served on /metrics. With several worker processes set
+# METRICS_DIR to a directory shared by them (emptied on deploy) so the scrape
+# covers all workers; each flushes at most every HMS_METRICS_FLUSH_INTERVAL s.
+HMS_METRICS_DIR = os.getenv("METRICS_DIR")
+HMS_METRICS_FLUSH_INTERVAL = int(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Bearer token required to scrape /metrics (open when unset)
+HMS_METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+# Sampled request profiling, off by default. With a rate of N one request in N
+# is run under cProfile; a request carrying a valid signed X-HMS-Profile header
+# (issued by POST /api/management/profiles/) is always profiled. The last
+# HMS_PROFILE_BUFFER_SIZE profiles per route are kept in HMS_PROFILE_CACHE.
+HMS_PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+HMS_PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))
+HMS_PROFILE_TOP_FRAMES = 25
+HMS_PROFILE_TOKEN_MAX_AGE = 300
+HMS_PROFILE_CACHE = "default"
+
+
+# Completed visits older than this are moved to core.ArchivedVisit by the
+# archive_visits command
+HMS_ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+# Soft-deleted patients and visits are purged by purge_deleted after this long
+HMS_PURGE_AFTER_DAYS = int(os.getenv("PURGE_AFTER_DAYS", "30"))
+# Visits still open this many days after their visit date are closed by
+# the close_stale_visits command
+HMS_STALE_VISIT_AFTER_DAYS = int(os.getenv("STALE_VISIT_AFTER_DAYS", "1"))
+
+
+# Responses of views marked ``idempotent = True`` are stored per
+# Idempotency-Key header and replayed to retries for this long
+HMS_IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+# A retry takes over a key whose first request has not answered within this
+# many seconds; keep it above the slowest idempotent view
+HMS_IDEMPOTENCY_CLAIM_LEASE_SECONDS = int(
+    os.getenv("IDEMPOTENCY_CLAIM_LEASE_SECONDS", "60")
+)
+
+# Audit trail (hms.audit): entries are queued and written by a background
+# thread in batches of HMS_AUDIT_BATCH_SIZE, at most HMS_AUDIT_FLUSH_INTERVAL
+# seconds after the change. With AUDIT_ASYNC=False each entry is written
+# when its transaction commits. A failing batch is retried
+# HMS_AUDIT_WRITE_ATTEMPTS times before it is written row by row.
+HMS_AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "True") == "True"
+HMS_AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+HMS_AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+HMS_AUDIT_WRITE_ATTEMPTS = int(os.getenv("AUDIT_WRITE_ATTEMPTS", "3"))
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+# Password hashing. The preferred hasher (PASSWORD_HASHER) comes first; the
+# others stay listed so existing hashes verify and are upgraded on next login.
+# argon2 needs argon2-cffi and bcrypt needs bcrypt installed.
+PASSWORD_HASHER_CHOICES = {
+    "pbkdf2": "users.hashers.TunedPBKDF2PasswordHasher",
+    "argon2": "users.hashers.TunedArgon2PasswordHasher",
+    "bcrypt": "users.hashers.TunedBCryptSHA256PasswordHasher",
+}
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "pbkdf2")
+PASSWORD_HASHERS = [PASSWORD_HASHER_CHOICES[PASSWORD_HASHER]] + [
+    path for name, path in PASSWORD_HASHER_CHOICES.items() if name != PASSWORD_HASHER
+]
+
+# Hasher costs; pick them with `manage.py benchmark_hashers`
+HMS_PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "870000"))
+HMS_ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+HMS_ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "102400"))
+HMS_ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "8"))
+HMS_BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Token buckets applied to LoginView before any password is hashed, as
+# "<burst>/<period>": the bucket holds <burst> attempts and refills over <period>.
+HMS_LOGIN_THROTTLE_RATES = {
+    "email": os.getenv("LOGIN_THROTTLE_EMAIL_RATE", "5/min"),
+    "ip": os.getenv("LOGIN_THROTTLE_IP_RATE", "100/min"),
+}
+HMS_LOGIN_THROTTLE_CACHE = os.getenv("LOGIN_THROTTLE_CACHE", "local")
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.1/topics/i18n/
+
+LANGUAGE_CODE = "en-us"
+
+TIME_ZONE = "UTC"
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.1/howto/static-files/
+
+STATIC_URL = "/static/"
+MEDIA_URL = "/images/"
+# STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static_in_env')]
+MEDIA_ROOT = BASE_DIR / "static/images"
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+STATICFILES_DIRS = [BASE_DIR / "static", BASE_DIR / "templates/build/static"]
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+REST_FRAMEWORK = {
+    # Use Django's standard `django.contrib.auth` permissions,
+    # or allow read-only access for unauthenticated users.
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    "DEFAULT_AUTHENTICATION_CLASSES": (
+        "users.authentication.CachedJWTAuthentication",
+    ),
+    "COERCE_DECIMAL_TO_STRING": False,
+}
+
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(days=30),
+    "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    "ROTATE_REFRESH_TOKENS": False,
+    "BLACKLIST_AFTER_ROTATION": True,
+    "UPDATE_LAST_LOGIN": False,
+    "ALGORITHM": "HS256",
+    "VERIFYING_KEY": None,
+    "AUDIENCE": None,
+    "ISSUER": None,
+    "AUTH_HEADER_TYPES": ("Bearer",),
+    "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
+    "USER_ID_FIELD": "id",
+    "USER_ID_CLAIM": "user_id",
+    "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
+    "TOKEN_TYPE_CLAIM": "token_type",
+    "JTI_CLAIM": "jti",
+    "SLIDING_TOKEN_REFRESH_EXP_CLAIM": "refresh_exp",
+    "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
+    "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
+}
+
+# Seconds an authenticated user's id/role/department/is_active stay cached
+HMS_AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", "60"))
+# Embed role and department claims in tokens issued by LoginView
+HMS_JWT_ROLE_CLAIMS = os.getenv("JWT_ROLE_CLAIMS", "False") == "True"
+
+
+CORS_ALLOW_ALL_ORIGINS = True
+
+AUTH_USER_MODEL = "users.CustomUser"
+
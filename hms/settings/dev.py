@@ -0,0 +1,17 @@
+from .base import *  # noqa: F401,F403
+from .base import INSTALLED_APPS, MIDDLEWARE
+
+DEBUG = True
+
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+INSTALLED_APPS = INSTALLED_APPS + ["debug_toolbar"]
+
+# The toolbar must come as early as possible, right after CORS
+MIDDLEWARE = MIDDLEWARE[:1] + [
+    "debug_toolbar.middleware.DebugToolbarMiddleware"
+] + MIDDLEWARE[1:]
+
+INTERNAL_IPS = [
+    "127.0.0.1",
+]
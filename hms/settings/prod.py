@@ -0,0 +1,76 @@
+import os
+from .base import *  # noqa: F401,F403
+from .base import REST_FRAMEWORK, TEMPLATES
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "127.0.0.1,localhost").split(",")
+
+# The API authenticates every request with JWT inside DRF, so production runs
+# an explicit, short middleware stack. Queries are always counted (the
+# metrics report them) but only logged per request with QUERY_BUDGETS=True.
+# Profiling stays installed for signed X-HMS-Profile requests; unsampled
+# requests only pay for a random number. Sessions, auth, CSRF and messages
+# only come along while the Django admin is served (ADMIN_SITE).
+HMS_ADMIN_SITE = os.getenv("ADMIN_SITE", "False") == "True"
+HMS_QUERY_BUDGET_LOGGING = os.getenv("QUERY_BUDGETS", "False") == "True"
+
+MIDDLEWARE = [
+    "hms.metrics.MetricsMiddleware",
+    "hms.middleware.QueryBudgetMiddleware",
+    "hms.profiling.ProfilingMiddleware",
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    *(
+        [
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.middleware.common.CommonMiddleware",
+            "django.middleware.csrf.CsrfViewMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+        ]
+        if HMS_ADMIN_SITE
+        else ["django.middleware.common.CommonMiddleware"]
+    ),
+    "hms.middleware.ReplicaRoutingMiddleware",
+    "hms.idempotency.IdempotencyMiddleware",
+    "hms.audit.AuditContextMiddleware",
+    *(
+        [
+            "django.contrib.messages.middleware.MessageMiddleware",
+            "django.middleware.clickjacking.XFrameOptionsMiddleware",
+        ]
+        if HMS_ADMIN_SITE
+        else []
+    ),
+]
+
+if not HMS_ADMIN_SITE:
+    # admin stays installed for its migrations and permissions; without its
+    # URLs the session, auth and message middleware it checks for are unused
+    SILENCED_SYSTEM_CHECKS = ["admin.E408", "admin.E409", "admin.E410"]
+
+# Compile templates once per process instead of on every render
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "APP_DIRS": False,
+        "OPTIONS": {
+            **TEMPLATES[0]["OPTIONS"],
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                )
+            ],
+        },
+    }
+]
+
+# The API is consumed by the frontend only; skip the browsable API renderer
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+}
@@ -0,0 +1,22 @@
+from django.test import override_settings
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin turning HMS_QUERY_BUDGETS into hard limits: any request in
+    the test that exceeds its endpoint's budget raises QueryBudgetExceeded.
+    """
+
+    def setUp(self):
+        super().setUp()
+        strict = override_settings(HMS_QUERY_BUDGET_STRICT=True)
+        strict.enable()
+        self.addCleanup(strict.disable)
+
+    def assertQueryCount(self, response, expected):
+        """Assert the exact number of queries the request ran."""
+        self.assertEqual(
+            response.query_count,
+            expected,
+            f"{response.wsgi_request.path} ran {response.query_count} queries",
+        )
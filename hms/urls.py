@@ -1,7 +1,8 @@
-import debug_toolbar
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
+from hms.metrics import metrics_view
 
 
 def custom_404_handler(request, exception):
@@ -15,13 +16,20 @@ def custom_404_handler(request, exception):
 
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
     path("api/users/", include("api.users.urls")),
     path("api/core/", include("api.core.urls")),
     path("api/management/", include("api.management.urls")),
     path("api/payments/", include("api.payments.urls")),
-    path("__debug__/", include(debug_toolbar.urls)),
+    path("api/reports/", include("api.reports.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
+if getattr(settings, "HMS_ADMIN_SITE", True):
+    urlpatterns.append(path("admin/", admin.site.urls))
+
+# Only the dev profile installs the debug toolbar
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    urlpatterns.append(path("__debug__/", include("debug_toolbar.urls")))
+
 
 handler404 = custom_404_handler
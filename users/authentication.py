@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .models import CustomUser
+
+# Columns needed by authentication and the role permissions, in model order so
+# they can be handed straight to CustomUser.from_db(). Any other field is
+# deferred and loaded lazily if a view touches it.
+CACHED_USER_FIELDS = [
+    field.attname
+    for field in CustomUser._meta.concrete_fields
+    if field.attname
+    in {"id", "email", "role", "department_id", "is_active", "is_staff", "is_superuser"}
+]
+
+
+def user_cache_key(user_id):
+    return f"users:auth:{user_id}"
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user from a short-lived cache
+    instead of querying CustomUser on every request.
+
+    Entries are dropped by users.signals whenever a user is saved or deleted,
+    and expire after HMS_AUTH_USER_CACHE_TIMEOUT seconds regardless.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = user_cache_key(user_id)
+        cached = cache.get(key)
+        if cached is None:
+            cached = self.load_user(user_id)
+            cache.set(key, cached, getattr(settings, "HMS_AUTH_USER_CACHE_TIMEOUT", 60))
+        values, password_digest = cached
+
+        user = CustomUser.from_db(DEFAULT_DB_ALIAS, CACHED_USER_FIELDS, values)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+    def load_user(self, user_id):
+        """
+        Fetch the cached columns for ``user_id``. Only a digest of the password
+        hash is kept, and only when token revocation checks are enabled.
+        """
+        fields = list(CACHED_USER_FIELDS)
+        if api_settings.CHECK_REVOKE_TOKEN:
+            fields.append("password")
+        try:
+            row = CustomUser.objects.values_list(*fields).get(
+                **{api_settings.USER_ID_FIELD: user_id}
+            )
+        except CustomUser.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return row[:-1], get_md5_hash_password(row[-1])
+        return row, None
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    BCryptSHA256PasswordHasher,
+    PBKDF2PasswordHasher,
+)
+
+# The tuned hashers keep Django's algorithm names, so existing hashes verify
+# unchanged. Their must_update() compares the stored cost with the configured
+# one, and check_password() re-hashes on the next successful login whenever
+# the cost or the preferred hasher (first in PASSWORD_HASHERS) changes.
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the iteration count taken from HMS_PBKDF2_ITERATIONS.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(
+            settings, "HMS_PBKDF2_ITERATIONS", PBKDF2PasswordHasher.iterations
+        )
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id with costs taken from HMS_ARGON2_TIME_COST, HMS_ARGON2_MEMORY_COST
+    (KiB) and HMS_ARGON2_PARALLELISM. Requires argon2-cffi.
+    """
+
+    @property
+    def time_cost(self):
+        return getattr(settings, "HMS_ARGON2_TIME_COST", Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return getattr(
+            settings, "HMS_ARGON2_MEMORY_COST", Argon2PasswordHasher.memory_cost
+        )
+
+    @property
+    def parallelism(self):
+        return getattr(
+            settings, "HMS_ARGON2_PARALLELISM", Argon2PasswordHasher.parallelism
+        )
+
+
+class TunedBCryptSHA256PasswordHasher(BCryptSHA256PasswordHasher):
+    """
+    BCrypt-SHA256 with the log2 work factor taken from HMS_BCRYPT_ROUNDS.
+    Requires bcrypt.
+    """
+
+    @property
+    def rounds(self):
+        return getattr(settings, "HMS_BCRYPT_ROUNDS", BCryptSHA256PasswordHasher.rounds)
+
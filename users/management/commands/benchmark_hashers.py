@@ -0,0 +1,71 @@
+import math
+import statistics
+import time
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Time each configured password hasher at its current cost and suggest "
+        "the cost that meets --target-ms per hash on this machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=5)
+        parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=100,
+            help="Desired time for a single hash (default: 100ms).",
+        )
+
+    def handle(self, *args, **options):
+        target = options["target_ms"]
+        for hasher in get_hashers():
+            if hasher.library:
+                try:
+                    hasher._load_library()
+                except ValueError:
+                    self.stdout.write(
+                        f"{hasher.algorithm}: library not installed, skipped"
+                    )
+                    continue
+
+            timings = []
+            for _ in range(options["samples"]):
+                started = time.perf_counter()
+                hasher.encode("benchmark-password", hasher.salt())
+                timings.append((time.perf_counter() - started) * 1000)
+            median = statistics.median(timings)
+
+            self.stdout.write(
+                f"{hasher.algorithm}: {self.describe_cost(hasher)} -> {median:.1f}ms "
+                f"per hash (~{1000 / median:.0f} logins/s per core); "
+                f"for {target:.0f}ms use {self.suggest_cost(hasher, median, target)}"
+            )
+
+    @staticmethod
+    def describe_cost(hasher):
+        if hasattr(hasher, "iterations"):
+            return f"iterations={hasher.iterations}"
+        if hasattr(hasher, "time_cost"):
+            return (
+                f"time_cost={hasher.time_cost} memory_cost={hasher.memory_cost} "
+                f"parallelism={hasher.parallelism}"
+            )
+        if hasattr(hasher, "rounds"):
+            return f"rounds={hasher.rounds}"
+        return "default cost"
+
+    @staticmethod
+    def suggest_cost(hasher, measured, target):
+        ratio = target / measured
+        if hasattr(hasher, "iterations"):
+            return f"PBKDF2_ITERATIONS={max(1, round(hasher.iterations * ratio, -3)):.0f}"
+        if hasattr(hasher, "time_cost"):
+            return f"ARGON2_TIME_COST={max(1, round(hasher.time_cost * ratio))}"
+        if hasattr(hasher, "rounds"):
+            # bcrypt's cost is a power of two
+            return f"BCRYPT_ROUNDS={max(4, hasher.rounds + round(math.log2(ratio)))}"
+        return "n/a"
@@ -55,3 +55,16 @@ class IsCashier(BasePermission):
             and request.user.is_authenticated
             and request.user.role == "cashier"
         )
+
+
+class IsFinanceStaff(BasePermission):
+    """
+    Allows cashiers and administrators, who handle the hospital's money.
+    """
+
+    def has_permission(self, request, view):
+        return (
+            request.user
+            and request.user.is_authenticated
+            and (request.user.role in ("cashier", "admin") or request.user.is_superuser)
+        )
@@ -0,0 +1,101 @@
+from django.db.models import Q
+
+
+# Roles whose clinical data is limited to their own visits and department queue
+ASSIGNED_ROLES = {"doctor", "dentist"}
+# Roles whose clinical data is limited to their department
+DEPARTMENT_ROLES = {"nurse"}
+
+
+class DataScope:
+    """
+    Row-level filter derived from the authenticated user's role and department.
+
+    Every clinical record hangs off a Visit, so the scope is expressed as a
+    Q object on Visit and re-rooted onto other models through a lookup path,
+    e.g. ``scope.visits(Test.objects.all(), "visit")``. Patients (and records
+    that hang off a patient) are visible when the patient has a visible visit.
+    Records of a soft-deleted visit or patient are never visible.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.visit_q = self._build_visit_q(user)
+
+    @staticmethod
+    def _build_visit_q(user):
+        """Return the Visit filter, None for unrestricted or False for no access."""
+        if not (user and user.is_authenticated):
+            return False
+        if user.is_superuser or user.is_staff or user.role not in (
+            ASSIGNED_ROLES | DEPARTMENT_ROLES
+        ):
+            return None
+        if user.role in ASSIGNED_ROLES:
+            queue = Q(department_id=user.department_id, assigned_doctor__isnull=True)
+            return Q(assigned_doctor_id=user.pk) | (
+                queue if user.department_id else Q(pk__in=[])
+            )
+        if user.department_id:
+            return Q(department_id=user.department_id)
+        return False
+
+    @property
+    def is_unrestricted(self):
+        return self.visit_q is None
+
+    @classmethod
+    def _reroot(cls, node, path):
+        """Prefix every lookup in a Q tree with ``path``."""
+        if isinstance(node, Q):
+            rerooted = Q()
+            rerooted.connector = node.connector
+            rerooted.negated = node.negated
+            rerooted.children = [cls._reroot(child, path) for child in node.children]
+            return rerooted
+        lookup, value = node
+        return (f"{path}__{lookup}", value)
+
+    def visits(self, queryset, path=""):
+        """
+        Restrict ``queryset`` to rows whose visit (reached through ``path``,
+        empty for Visit itself) is visible to the user.
+        """
+        if path:
+            # Visit's own manager already hides soft-deleted visits
+            queryset = queryset.filter(**{f"{path}__deleted_at__isnull": True})
+        if self.visit_q is None:
+            return queryset
+        if self.visit_q is False:
+            return queryset.none()
+        return queryset.filter(self._reroot(self.visit_q, path) if path else self.visit_q)
+
+    def patients(self, queryset, path=""):
+        """
+        Restrict ``queryset`` to rows whose patient (reached through ``path``,
+        empty for Patient itself) has a visit visible to the user.
+        """
+        if path:
+            queryset = queryset.filter(**{f"{path}__is_active": True})
+        if self.visit_q is None:
+            return queryset
+        if self.visit_q is False:
+            return queryset.none()
+        from core.models import Visit
+
+        visible = Visit.objects.filter(self.visit_q).values("patient_id")
+        lookup = f"{path}__in" if path else "pk__in"
+        return queryset.filter(**{lookup: visible})
+
+
+def get_data_scope(request):
+    """
+    Return the DataScope for this request, computing it once and caching it on
+    the underlying HttpRequest so every view and serializer shares it.
+    """
+    http_request = getattr(request, "_request", request)
+    scope = getattr(http_request, "_data_scope", None)
+    if scope is None or scope.user is not request.user:
+        scope = DataScope(request.user)
+        http_request._data_scope = scope
+    return scope
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from hms.caching import invalidate_views
+from .authentication import invalidate_cached_user
+from .models import CustomUser, Department
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def drop_cached_user(sender, instance, **kwargs):
+    # Role, department or active flag may have changed (e.g. via UserDetailView)
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def drop_cached_departments(sender, instance, **kwargs):
+    invalidate_views("departments")
@@ -1,3 +1,160 @@
-from django.test import TestCase
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .authentication import user_cache_key
+from .models import CustomUser, Department
 
-# Create your tests here.
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.department = Department.objects.create(name="General", short_name="GEN")
+        self.admin = CustomUser.objects.create_user(
+            email="admin@hms.test", password="secret", is_staff=True, role="admin"
+        )
+        self.nurse = CustomUser.objects.create_user(
+            email="nurse@hms.test",
+            password="secret",
+            role="nurse",
+            department=self.department,
+        )
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_user_is_resolved_from_cache(self):
+        self.authenticate(self.admin)
+        self.assertEqual(self.client.get(f"/api/users/{self.nurse.pk}/").status_code, 200)
+        self.assertIsNotNone(cache.get(user_cache_key(self.admin.pk)))
+
+        # Only the view's own user and department lookups hit the database
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/users/{self.nurse.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_through_user_detail_invalidates_cache(self):
+        self.authenticate(self.nurse)
+        self.client.get("/api/users/departments/")
+
+        self.authenticate(self.admin)
+        response = self.client.patch(
+            f"/api/users/{self.nurse.pk}/", {"is_active": False}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(user_cache_key(self.nurse.pk)))
+
+        self.authenticate(self.nurse)
+        self.assertEqual(self.client.get("/api/users/departments/").status_code, 401)
+
+    def test_deleted_user_is_rejected(self):
+        self.authenticate(self.nurse)
+        self.client.get("/api/users/departments/")
+        self.nurse.delete()
+        self.assertEqual(self.client.get("/api/users/departments/").status_code, 401)
+
+    @override_settings(HMS_JWT_ROLE_CLAIMS=True)
+    def test_login_embeds_role_claims(self):
+        response = self.client.post(
+            "/api/users/login/",
+            {"email": "nurse@hms.test", "password": "secret"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        token = AccessToken(response.data["access"])
+        self.assertEqual(token["role"], "nurse")
+        self.assertEqual(token["department"], self.department.pk)
+
+
+@override_settings(
+    HMS_PBKDF2_ITERATIONS=1000,
+    HMS_LOGIN_THROTTLE_RATES={"email": "3/min", "ip": "10/min"},
+)
+class LoginThrottleAndHasherTests(TestCase):
+    def setUp(self):
+        caches["local"].clear()
+        self.user = CustomUser.objects.create_user(
+            email="cashier@hms.test", password="secret", role="cashier"
+        )
+        self.client = APIClient()
+
+    def login(self, email="cashier@hms.test", password="secret"):
+        return self.client.post(
+            "/api/users/login/", {"email": email, "password": password}, format="json"
+        )
+
+    def test_email_bucket_rejects_before_authenticating(self):
+        for _ in range(3):
+            self.assertEqual(self.login(password="wrong").status_code, 401)
+
+        # Rejected by the throttle: no user lookup and no hashing
+        with self.assertNumQueries(0):
+            response = self.login(email="  Cashier@HMS.test ")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+        # Other accounts behind the same IP are unaffected
+        self.assertEqual(self.login(email="other@hms.test").status_code, 401)
+
+    def test_ip_bucket_limits_many_emails(self):
+        for i in range(10):
+            self.login(email=f"user{i}@hms.test")
+        self.assertEqual(self.login(email="new@hms.test").status_code, 429)
+
+    def test_login_rehashes_with_new_cost(self):
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+        with self.settings(HMS_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertTrue(self.user.check_password("secret"))
+
+
+class CachedReferenceViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.department = Department.objects.create(name="General", short_name="GEN")
+        self.nurse = CustomUser.objects.create_user(
+            email="nurse@hms.test", password="secret", role="nurse"
+        )
+        self.admin = CustomUser.objects.create_user(
+            email="admin@hms.test", password="secret", role="admin"
+        )
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_departments_are_cached_per_role(self):
+        self.authenticate(self.nurse)
+        self.client.get("/api/users/departments/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/users/departments/")
+        self.assertEqual([d["name"] for d in response.data], ["General"])
+
+        # Another role gets its own entry
+        self.authenticate(self.admin)
+        self.client.get("/api/users/departments/")
+        with self.assertNumQueries(1):
+            self.client.get("/api/users/departments/?page=2")
+
+    def test_writes_invalidate_cached_list(self):
+        self.authenticate(self.nurse)
+        self.client.get("/api/users/departments/")
+        response = self.client.post(
+            "/api/users/departments/",
+            {"name": "Dental", "short_name": "DEN"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get("/api/users/departments/")
+        self.assertEqual(
+            sorted(d["name"] for d in response.data), ["Dental", "General"]
+        )
+
+        self.client.delete(f"/api/users/departments/{self.department.pk}/")
+        response = self.client.get("/api/users/departments/")
+        self.assertEqual([d["name"] for d in response.data], ["Dental"])
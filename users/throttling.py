@@ -0,0 +1,65 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    Parse "<burst>/<period>" (e.g. "5/min") into (capacity, seconds).
+    """
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    Token-bucket limiter for LoginView keyed by the submitted email and by the
+    client IP. DRF runs throttles before the view, so rejected attempts never
+    reach the password hasher; the response is a 429 with Retry-After.
+
+    Buckets live in the cache named by HMS_LOGIN_THROTTLE_CACHE and each
+    attempt, successful or not, takes one token.
+    """
+
+    def allow_request(self, request, view):
+        rates = getattr(settings, "HMS_LOGIN_THROTTLE_RATES", {})
+        store = caches[getattr(settings, "HMS_LOGIN_THROTTLE_CACHE", "default")]
+        idents = {"email": self.get_email(request), "ip": self.get_ident(request)}
+        now = time.time()
+
+        self.wait_seconds = 0
+        buckets = []
+        for scope, ident in idents.items():
+            if not ident or not rates.get(scope):
+                continue
+            capacity, period = parse_rate(rates[scope])
+            digest = hashlib.md5(ident.encode()).hexdigest()
+            key = f"throttle:login:{scope}:{digest}"
+
+            tokens, stamp = store.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * capacity / period)
+            if tokens < 1:
+                self.wait_seconds = max(
+                    self.wait_seconds, (1 - tokens) * period / capacity
+                )
+            buckets.append((key, tokens, period))
+
+        if self.wait_seconds:
+            return False
+        for key, tokens, period in buckets:
+            # An untouched bucket is full again after one period
+            store.set(key, (tokens - 1, now), period)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+    @staticmethod
+    def get_email(request):
+        data = request.data if hasattr(request.data, "get") else {}
+        email = data.get("email")
+        return email.strip().lower() if isinstance(email, str) else None
@@ -1,3 +1,5 @@
+from django.conf import settings
+from hms.caching import cache_response
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
@@ -8,9 +10,12 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from .models import Department, CustomUser as User
 from .serializers import UserSerializer, DepartmentSerializer
+from .throttling import LoginRateThrottle
 
 
 class LoginView(APIView):
+    throttle_classes = [LoginRateThrottle]
+
     def post(self, request):
         """
         Authenticate user and return JWT tokens.
@@ -29,6 +34,10 @@ class LoginView(APIView):
         if user is not None:
             # Generate tokens
             refresh = RefreshToken.for_user(user)
+            if settings.HMS_JWT_ROLE_CLAIMS:
+                # Copied into the access token so clients can read them directly
+                refresh["role"] = user.role
+                refresh["department"] = user.department_id
 
             return Response(
                 {
@@ -59,7 +68,7 @@ class UserListView(APIView):
         """
         List all users.
         """
-        users = User.objects.all()
+        users = User.objects.select_related("department")
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -68,7 +77,6 @@ class UserListView(APIView):
         Create a new user.
         """
         data = request.data
-        print(data)  # Debugging step
 
         try:
             # Get the department instance if provided
@@ -189,6 +197,7 @@ class UserDetailView(APIView):
 class DepartmentListView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @cache_response("departments")
     def get(self, request):
         """
         List all departments.